@@ -0,0 +1,202 @@
+# COPYRIGHT (C) 2020-2022 Nicotine+ Contributors
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the cost of packing and parsing every protocol message class. Messages that declare
+a schema are compared with the previous hand-written methods, which called the generic
+pack_*/unpack_* methods for every field. Messages with a more complex layout still use
+hand-written methods, and are listed.
+
+Usage: python3 benchmarks/codec.py [-v]
+"""
+
+import os
+import socket
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pynicotine import slskmessages  # noqa: E402  # pylint: disable=wrong-import-position
+from pynicotine.slskcodec import OPTIONAL  # noqa: E402  # pylint: disable=wrong-import-position
+from pynicotine.slskcodec import FieldType  # noqa: E402  # pylint: disable=wrong-import-position
+
+NUMBER = 20000
+REPEAT = 3
+
+SAMPLE_VALUES = {
+    FieldType.BOOL: True,
+    FieldType.UINT8: 1,
+    FieldType.INT32: -12345,
+    FieldType.UINT32: 123456,
+    FieldType.UINT64: 123456789012,
+    FieldType.IP: "192.168.1.20",
+    FieldType.STRING: "Some username or room name",
+    FieldType.BYTES: b"some bytes"
+}
+PACK_FUNCTIONS = {
+    FieldType.BOOL: "pack_bool",
+    FieldType.UINT8: "pack_uint8",
+    FieldType.INT32: "pack_int32",
+    FieldType.UINT32: "pack_uint32",
+    FieldType.UINT64: "pack_uint64",
+    FieldType.STRING: "pack_string",
+    FieldType.BYTES: "pack_bytes"
+}
+UNPACK_FUNCTIONS = {
+    FieldType.BOOL: "unpack_bool",
+    FieldType.UINT8: "unpack_uint8",
+    FieldType.INT32: "unpack_int32",
+    FieldType.UINT32: "unpack_uint32",
+    FieldType.UINT64: "unpack_uint64",
+    FieldType.IP: "unpack_ip",
+    FieldType.STRING: "unpack_string",
+    FieldType.BYTES: "unpack_bytes"
+}
+
+
+def get_message_classes():
+
+    classes = set()
+
+    for class_map in (slskmessages.SERVER_MESSAGE_CLASSES, slskmessages.PEER_INIT_MESSAGE_CLASSES,
+                      slskmessages.PEER_MESSAGE_CLASSES, slskmessages.DISTRIBUTED_MESSAGE_CLASSES):
+        classes.update(class_map.values())
+
+    for class_map in (slskmessages.SERVER_MESSAGE_CODES, slskmessages.PEER_INIT_MESSAGE_CODES,
+                      slskmessages.PEER_MESSAGE_CODES, slskmessages.DISTRIBUTED_MESSAGE_CODES):
+        classes.update(class_map)
+
+    return sorted(classes, key=lambda cls: cls.__name__)
+
+
+def create_message(msg_class, schema):
+
+    msg = msg_class.__new__(msg_class)
+
+    for field in schema:
+        if field is not OPTIONAL and field[0]:
+            setattr(msg, field[0], SAMPLE_VALUES[field[1]])
+
+    return msg
+
+
+def compile_hand_written(schema, make):
+    """ Generate methods like the previous hand-written ones, with one generic
+    method call (and slice) per field """
+
+    if make:
+        lines = ["def make_network_message(self):", "    msg = bytearray()"]
+
+        for field in schema:
+            if field is OPTIONAL:
+                continue
+
+            name, field_type = field
+
+            if field_type == FieldType.IP:
+                lines.append("    msg.extend(socket.inet_aton(self.%s)[::-1])" % name)
+            else:
+                lines.append("    msg.extend(self.%s(self.%s))" % (PACK_FUNCTIONS[field_type], name))
+
+        lines.append("    return msg")
+
+    else:
+        lines = ["def parse_network_message(self, message):", "    pos = 0"]
+        indent = "    "
+
+        for field in schema:
+            if field is OPTIONAL:
+                lines.append(indent + "if message[pos:]:")
+                indent += "    "
+                continue
+
+            name, field_type = field
+            target = "self." + name if name else "_unused"
+            lines.append(indent + "pos, %s = self.%s(message, pos)" % (target, UNPACK_FUNCTIONS[field_type]))
+
+    namespace = {"socket": socket}
+    exec("\n".join(lines), namespace)  # pylint: disable=exec-used
+
+    return namespace["make_network_message" if make else "parse_network_message"]
+
+
+def measure(function):
+    return min(timeit.repeat(function, number=NUMBER, repeat=REPEAT)) / NUMBER * 1e9
+
+
+def main():
+
+    verbose = "-v" in sys.argv
+    results = []
+    hand_written = []
+
+    for msg_class in get_message_classes():
+        make_schema = getattr(msg_class, "MAKE_SCHEMA", None)
+        parse_schema = getattr(msg_class, "PARSE_SCHEMA", None)
+
+        if make_schema is None and parse_schema is None:
+            hand_written.append(msg_class.__name__)
+            continue
+
+        if make_schema is not None:
+            msg = create_message(msg_class, make_schema)
+            make_network_message = compile_hand_written(make_schema, make=True)
+            assert bytes(msg.make_network_message()) == bytes(make_network_message(msg))
+
+            generic_time = measure(lambda m=msg, f=make_network_message: f(m))
+            compiled_time = measure(msg.make_network_message)
+            results.append((msg_class.__name__, "pack", generic_time, compiled_time))
+
+        if parse_schema is not None:
+            msg = create_message(msg_class, parse_schema)
+            message = memoryview(bytes(compile_hand_written(parse_schema, make=True)(msg)))
+            parse_network_message = compile_hand_written(parse_schema, make=False)
+            msg = msg_class.__new__(msg_class)
+
+            generic_time = measure(lambda m=msg, d=message, f=parse_network_message: f(m, d))
+            compiled_time = measure(lambda m=msg, d=message: m.parse_network_message(d))
+            results.append((msg_class.__name__, "parse", generic_time, compiled_time))
+
+    if verbose:
+        print("%-28s %-6s %10s %10s %8s" % ("Message", "", "before", "compiled", "speedup"))
+
+        for name, operation, generic_time, compiled_time in results:
+            print("%-28s %-6s %8.0fns %8.0fns %7.2fx" % (
+                name, operation, generic_time, compiled_time, generic_time / compiled_time))
+
+        print()
+
+    num_classes = len(get_message_classes())
+    print("%i message classes, %i with schemas, %i hand-written" % (
+        num_classes, num_classes - len(hand_written), len(hand_written)))
+
+    for operation in ("pack", "parse"):
+        rows = [row for row in results if row[1] == operation]
+        generic_total = sum(row[2] for row in rows)
+        compiled_total = sum(row[3] for row in rows)
+
+        print("%-5s %3i schemas: before %6.0f ns, compiled %6.0f ns per message on average (%.2fx)" % (
+            operation, len(rows), generic_total / len(rows), compiled_total / len(rows),
+            generic_total / compiled_total))
+
+    print("\nHand-written: " + ", ".join(hand_written))
+
+
+if __name__ == "__main__":
+    main()
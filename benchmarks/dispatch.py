@@ -0,0 +1,276 @@
+# COPYRIGHT (C) 2020-2022 Nicotine+ Contributors
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the per-message cost of dispatching messages in the networking thread
+and in NicotineCore, comparing the previous if/elif chains with dispatch tables.
+
+Usage: python3 benchmarks/dispatch.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pynicotine import slskmessages  # noqa: E402  # pylint: disable=wrong-import-position
+from pynicotine.slskmessages import MessageType  # noqa: E402  # pylint: disable=wrong-import-position
+
+NUM_MESSAGES = 100000
+REPEAT = 5
+
+
+def handle(_msg):
+    pass
+
+
+class ChainDispatcher:
+    """ Dispatch as previously done in SlskProtoThread and NicotineCore """
+
+    def __init__(self, events):
+        self.events = events
+
+    def process_queue_messages(self, msgs):
+
+        for msg_obj in msgs:
+            msg_type = msg_obj.msgtype
+
+            if msg_type == MessageType.INIT:
+                handle(msg_obj)
+
+            elif msg_type == MessageType.INTERNAL:
+                self.process_internal_messages(msg_obj)
+
+            elif msg_type == MessageType.PEER:
+                handle(msg_obj)
+
+            elif msg_type == MessageType.DISTRIBUTED:
+                handle(msg_obj)
+
+            elif msg_type == MessageType.FILE:
+                handle(msg_obj)
+
+            elif msg_type == MessageType.SERVER:
+                handle(msg_obj)
+
+    @staticmethod
+    def process_internal_messages(msg_obj):
+
+        msg_class = msg_obj.__class__
+
+        if msg_class is slskmessages.InitPeerConn:
+            handle(msg_obj)
+
+        elif msg_class is slskmessages.ConnClose:
+            handle(msg_obj)
+
+        elif msg_class is slskmessages.ConnCloseIP:
+            handle(msg_obj)
+
+        elif msg_class is slskmessages.ServerConnect:
+            handle(msg_obj)
+
+        elif msg_class is slskmessages.ServerDisconnect:
+            handle(msg_obj)
+
+        elif msg_class is slskmessages.DownloadFile:
+            handle(msg_obj)
+
+        elif msg_class is slskmessages.UploadFile:
+            handle(msg_obj)
+
+        elif msg_class is slskmessages.SetDownloadLimit:
+            handle(msg_obj)
+
+        elif msg_class is slskmessages.SetUploadLimit:
+            handle(msg_obj)
+
+        elif msg_class is slskmessages.SendNetworkMessage:
+            handle(msg_obj)
+
+    @staticmethod
+    def process_server_input(msgs):
+
+        for msg in msgs:
+            msg_class = msg.__class__
+
+            if msg_class is slskmessages.EmbeddedMessage:
+                handle(msg)
+
+            elif msg_class is slskmessages.Login:
+                handle(msg)
+
+            elif msg_class is slskmessages.ConnectToPeer:
+                handle(msg)
+
+            elif msg_class is slskmessages.GetUserStatus:
+                handle(msg)
+
+            elif msg_class is slskmessages.GetUserStats:
+                handle(msg)
+
+            elif msg_class is slskmessages.GetPeerAddress:
+                handle(msg)
+
+            elif msg_class is slskmessages.Relogged:
+                handle(msg)
+
+            elif msg_class is slskmessages.PossibleParents:
+                handle(msg)
+
+            elif msg_class is slskmessages.ParentMinSpeed:
+                handle(msg)
+
+            elif msg_class is slskmessages.ParentSpeedRatio:
+                handle(msg)
+
+            elif msg_class is slskmessages.ResetDistributed:
+                handle(msg)
+
+    def network_event(self, msgs):
+
+        for msg in msgs:
+            try:
+                self.events[msg.__class__](msg)
+            except KeyError:
+                pass
+
+
+class TableDispatcher:
+    """ Dispatch as currently done in SlskProtoThread and NicotineCore """
+
+    def __init__(self, events):
+
+        self.events = events
+        self._output_handlers = dict.fromkeys(
+            (MessageType.INIT, MessageType.PEER, MessageType.DISTRIBUTED, MessageType.FILE, MessageType.SERVER),
+            handle
+        )
+        self._internal_message_handlers = dict.fromkeys(INTERNAL_CLASSES, handle)
+        self._queue_message_handlers = {}
+        self._server_input_hooks = dict.fromkeys(SERVER_HOOK_CLASSES, handle)
+
+    def process_queue_messages(self, msgs):
+
+        handlers = self._queue_message_handlers
+
+        for msg_obj in msgs:
+            msg_class = msg_obj.__class__
+            handler = handlers.get(msg_class)
+
+            if handler is None:
+                handler = handlers[msg_class] = self.get_queue_message_handler(msg_class)
+
+            handler(msg_obj)
+
+    def get_queue_message_handler(self, msg_class):
+
+        msg_type = msg_class.msgtype
+
+        if msg_type == MessageType.INTERNAL:
+            return self._internal_message_handlers.get(msg_class, handle)
+
+        return self._output_handlers[msg_type]
+
+    def process_server_input(self, msgs):
+
+        server_input_hooks = self._server_input_hooks
+
+        for msg in msgs:
+            msg_class = msg.__class__
+
+            if msg_class is slskmessages.EmbeddedMessage:
+                handle(msg)
+
+            elif msg_class in server_input_hooks:
+                server_input_hooks[msg_class](msg)
+
+    def network_event(self, msgs):
+
+        events = self.events
+
+        for msg in msgs:
+            handler = events.get(msg.__class__)
+
+            if handler is not None:
+                handler(msg)
+
+
+INTERNAL_CLASSES = (
+    slskmessages.InitPeerConn, slskmessages.ConnClose, slskmessages.ConnCloseIP, slskmessages.ServerConnect,
+    slskmessages.ServerDisconnect, slskmessages.DownloadFile, slskmessages.UploadFile,
+    slskmessages.SetDownloadLimit, slskmessages.SetUploadLimit, slskmessages.SendNetworkMessage
+)
+SERVER_HOOK_CLASSES = (
+    slskmessages.Login, slskmessages.ConnectToPeer, slskmessages.GetUserStatus, slskmessages.GetUserStats,
+    slskmessages.GetPeerAddress, slskmessages.Relogged, slskmessages.PossibleParents,
+    slskmessages.ParentMinSpeed, slskmessages.ParentSpeedRatio, slskmessages.ResetDistributed
+)
+
+
+def create_messages(classes):
+    """ Create message instances without running their constructors, since only the class matters """
+
+    msgs = [cls.__new__(cls) for cls in classes]
+    return (msgs * (NUM_MESSAGES // len(msgs) + 1))[:NUM_MESSAGES]
+
+
+def main():
+
+    # Typical mix of messages queued by NicotineCore
+    queue_msgs = create_messages((
+        slskmessages.FileSearchResult, slskmessages.SendNetworkMessage, slskmessages.TransferRequest,
+        slskmessages.SetUploadLimit, slskmessages.UploadFile, slskmessages.SharedFileList,
+        slskmessages.GetPeerAddress, slskmessages.ConnClose, slskmessages.PeerInit
+    ))
+
+    # Typical mix of messages received from the server. Most of them have no hook.
+    server_msgs = create_messages((
+        slskmessages.GetUserStatus, slskmessages.FileSearch, slskmessages.SayChatroom,
+        slskmessages.EmbeddedMessage, slskmessages.UserJoinedRoom, slskmessages.GetUserStats,
+        slskmessages.ConnectToPeer, slskmessages.UserLeftRoom, slskmessages.ResetDistributed
+    ))
+
+    # Messages passed to NicotineCore, some of them without a handler
+    events = dict.fromkeys((
+        slskmessages.GetUserStatus, slskmessages.FileSearch, slskmessages.SayChatroom,
+        slskmessages.UserJoinedRoom, slskmessages.GetUserStats, slskmessages.UserLeftRoom
+    ), handle)
+
+    print("Dispatching %i messages, best of %i runs (ns per message)\n" % (NUM_MESSAGES, REPEAT))
+    print("%-24s %10s %10s %10s" % ("", "if/elif", "table", "speedup"))
+
+    for name, function_name, msgs in (
+        ("process_queue_messages", "process_queue_messages", queue_msgs),
+        ("process_server_input", "process_server_input", server_msgs),
+        ("network_event", "network_event", server_msgs)
+    ):
+        results = []
+
+        for dispatcher_class in (ChainDispatcher, TableDispatcher):
+            function = getattr(dispatcher_class(events), function_name)
+            elapsed = min(timeit.repeat(lambda f=function: f(msgs), number=1, repeat=REPEAT))
+            results.append(elapsed / NUM_MESSAGES * 1e9)
+
+        chain_time, table_time = results
+        print("%-24s %10.1f %10.1f %9.2fx" % (name, chain_time, table_time, chain_time / table_time))
+
+
+if __name__ == "__main__":
+    main()
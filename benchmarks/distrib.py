@@ -0,0 +1,125 @@
+# COPYRIGHT (C) 2020-2022 Nicotine+ Contributors
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the cost of forwarding a search request to our children in the distributed
+network. Queuing a DistribSearch message for every child, which packs the message once
+per child, is compared with forwarding the received bytes by reference.
+
+Usage: python3 benchmarks/distrib.py
+"""
+
+import os
+import selectors
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pynicotine import slskmessages  # noqa: E402  # pylint: disable=wrong-import-position
+from pynicotine import slskproto  # noqa: E402  # pylint: disable=wrong-import-position
+
+NUMBER = 2000
+REPEAT = 5
+
+
+class DummySelector:
+
+    @staticmethod
+    def register(_sock, _events):
+        pass
+
+    @staticmethod
+    def modify(_sock, _events):
+        pass
+
+
+class DummySocket:
+    pass
+
+
+def create_network_thread(num_children):
+
+    network_thread = slskproto.SlskProtoThread(
+        core_callback=None, queue=slskproto.NetworkQueue(), bindip=None, interface=None, port=0, port_range=(0, 0))
+    network_thread.selector = DummySelector()
+
+    for i in range(num_children):
+        sock = DummySocket()
+        init = slskmessages.PeerInit(init_user="user%i" % i, target_user="user%i" % i, conn_type="D")
+        init.sock = sock
+        conn_obj = slskproto.PeerConnection(sock=sock, addr=("127.0.0.1", 2234), events=selectors.EVENT_READ,
+                                            init=init)
+
+        network_thread._conns[sock] = conn_obj             # pylint: disable=protected-access
+        network_thread._distrib_children[sock] = conn_obj  # pylint: disable=protected-access
+
+    return network_thread
+
+
+def forward_per_child(network_thread, msg):
+    """ Queue a message for every child, packed separately """
+
+    for conn_obj in network_thread._distrib_children.values():  # pylint: disable=protected-access
+        network_thread.process_distrib_output(
+            slskmessages.DistribSearch(conn_obj.init, msg.unknown, msg.user, msg.token, msg.searchterm))
+
+
+def forward_by_reference(network_thread, data):
+    network_thread.forward_to_distrib_children(bytes(data))
+
+
+def clear_output_buffers(network_thread):
+
+    for conn_obj in network_thread._distrib_children.values():  # pylint: disable=protected-access
+        conn_obj.obuf.clear()
+        conn_obj.events = selectors.EVENT_READ
+
+
+def measure(function, network_thread):
+
+    times = []
+
+    for _ in range(REPEAT):
+        clear_output_buffers(network_thread)
+        times.append(timeit.timeit(function, number=NUMBER))
+
+    return min(times) / NUMBER * 1e9
+
+
+def main():
+
+    msg = slskmessages.DistribSearch(None, 0, "someuser", 123456, "artist album year flac")
+    body = msg.make_network_message()
+    data = memoryview(b"".join((slskproto.UINT_PACK(len(body) + 1), bytes((3,)), body)))
+
+    print("Forwarding a %i byte search request, best of %i runs (ns per search)\n" % (len(data), REPEAT))
+    print("%-10s %14s %14s %10s" % ("children", "per child", "by reference", "speedup"))
+
+    for num_children in (1, 5, 10, 50):
+        network_thread = create_network_thread(num_children)
+
+        per_child_time = measure(lambda t=network_thread: forward_per_child(t, msg), network_thread)
+        reference_time = measure(lambda t=network_thread: forward_by_reference(t, data), network_thread)
+
+        print("%-10i %14.0f %14.0f %9.2fx" % (
+            num_children, per_child_time, reference_time, per_child_time / reference_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# COPYRIGHT (C) 2020-2022 Nicotine+ Contributors
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the memory used by 100k live message and connection objects, and the time
+a full garbage collection takes while they're alive. Objects of classes declaring
+__slots__ are compared with equivalent classes that store attributes in a __dict__.
+
+Usage: python3 benchmarks/memory.py
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pynicotine import slskmessages  # noqa: E402  # pylint: disable=wrong-import-position
+from pynicotine import slskproto  # noqa: E402  # pylint: disable=wrong-import-position
+
+NUM_OBJECTS = 100000
+
+
+def create_objects(classes):
+    """ A mix of objects the networking thread creates frequently """
+
+    peer_init = classes["PeerInit"](addr=("192.168.1.20", 2234), init_user="user", target_user="user",
+                                    conn_type="P", token=1234)
+    factories = (
+        lambda i: classes["FileSearchResult"](peer_init, "user", i, [], True, 100, 0, 0),
+        lambda i: classes["GetUserStatus"]("user%i" % i),
+        lambda i: classes["ConnectToPeer"](i, "user", "P"),
+        lambda i: classes["TransferRequest"](peer_init, 0, i, "file", "realfile", 1000),
+        lambda i: classes["DownloadFile"](peer_init, i, None, 1000),
+        lambda i: classes["MessageProgress"]("user", None, i, 1000),
+        lambda i: classes["SendNetworkMessage"]("user", None, None),
+        lambda i: classes["PeerInit"](addr=("192.168.1.20", 2234), init_user="user", target_user="user",
+                                      conn_type="P", token=i),
+        lambda i: classes["PeerConnection"](addr=("192.168.1.20", 2234), init=peer_init)
+    )
+
+    return [factories[i % len(factories)](i) for i in range(NUM_OBJECTS)]
+
+
+def copy_class_without_slots(cls, base):
+
+    namespace = {key: value for key, value in cls.__dict__.items()
+                 if key not in ("__slots__", "__dict__", "__weakref__") and key not in cls.__dict__.get("__slots__", ())}
+    class_cell = types.CellType()
+
+    # Methods calling super() need to refer to the copy
+    for key, value in namespace.items():
+        function = value.__func__ if isinstance(value, classmethod) else value
+
+        if isinstance(function, types.FunctionType) and "__class__" in function.__code__.co_freevars:
+            closure = tuple(class_cell if var_name == "__class__" else cell
+                            for var_name, cell in zip(function.__code__.co_freevars, function.__closure__))
+            function = types.FunctionType(
+                function.__code__, function.__globals__, function.__name__, function.__defaults__, closure)
+            namespace[key] = classmethod(function) if isinstance(value, classmethod) else function
+
+    namespace["__classcell__"] = class_cell
+    return type(cls.__name__, (base,), namespace)
+
+
+def get_classes_without_slots(classes):
+    """ Copy classes, but store attributes in a __dict__ instead of slots """
+
+    copies = {}
+
+    for name, cls in classes.items():
+        copy = object
+
+        for base in cls.__mro__[-2::-1]:
+            copy = copy_class_without_slots(base, copy)
+
+        copies[name] = copy
+
+    return copies
+
+
+def measure(classes):
+
+    gc.collect()
+    tracemalloc.start()
+    objects = create_objects(classes)
+    memory, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start_time = time.perf_counter()
+    gc.collect()
+    gc_time = time.perf_counter() - start_time
+
+    del objects
+    return memory, gc_time
+
+
+def main():
+
+    classes = {name: getattr(slskmessages, name) for name in (
+        "FileSearchResult", "GetUserStatus", "ConnectToPeer", "TransferRequest", "DownloadFile",
+        "MessageProgress", "SendNetworkMessage", "PeerInit")}
+    classes["PeerConnection"] = slskproto.PeerConnection
+
+    print("%i live objects (%i classes)\n" % (NUM_OBJECTS, len(classes)))
+    print("%-12s %14s %14s %14s" % ("", "memory", "per object", "gc.collect()"))
+
+    for label, test_classes in (("__dict__", get_classes_without_slots(classes)), ("__slots__", classes)):
+        memory, gc_time = measure(test_classes)
+        print("%-12s %11.1f MB %11i B %11.1f ms" % (label, memory / 1e6, memory / NUM_OBJECTS, gc_time * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -74,7 +74,11 @@ class Config:
                 "ipblocklist": {},
                 "ipignorelist": {},
                 "login": "",
+                "metricsport": 0,
                 "passw": "",
+                "peeraddresscache": True,
+                "peerconnectionidletime": 120,
+                "peerconnectionpoolsize": 200,
                 "portrange": (2234, 2239),
                 "server": ("server.slsknet.org", 2242),
                 "userlist": [],
@@ -117,6 +121,7 @@ class Config:
                 "uploaddir": os.path.join(self.data_dir, 'received'),
                 "uploadlimit": 1000,
                 "uploadlimitalt": 100,
+                "uploadpriorityweights": {"privileged": 4, "buddy": 2, "regular": 1},
                 "uploadsinsubdirs": True,
                 "uploadslots": 2,
                 "usealtlimits": False,
@@ -17,11 +17,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import threading
 import time
 
 from pynicotine import slskmessages
 from pynicotine.config import config
+from pynicotine.scheduler import scheduler
 
 
 class LogFile:
@@ -52,6 +52,7 @@ class Logger:
         slskmessages.EmbeddedMessage,
         slskmessages.SetConnectionStats,
         slskmessages.SharedFileList,
+        slskmessages.SharedFileListChunk,
         slskmessages.UnknownPeerMessage
     }
 
@@ -133,15 +134,8 @@ class Logger:
             if (current_time - log_file.last_active) >= 10:
                 self.close_log_file(log_file)
 
-        # Repeat timer
-        self.start_log_file_timer()
-
     def start_log_file_timer(self):
-
-        thread = threading.Timer(interval=10, function=self._close_inactive_log_files)
-        thread.name = "LogFileTimer"
-        thread.daemon = True
-        thread.start()
+        scheduler.add(delay=10, callback=self._close_inactive_log_files, repeat_interval=10)
 
     def add_listener(self, callback):
         self.listeners.add(callback)
@@ -230,10 +224,18 @@ class Logger:
     @staticmethod
     def contents(obj):
         """ Returns variables for object, for debug output """
-        try:
-            return {s: getattr(obj, s) for s in obj.__slots__ if hasattr(obj, s)}
-        except AttributeError:
-            return vars(obj)
+
+        contents = {}
+
+        for cls in reversed(type(obj).__mro__):
+            for name in cls.__dict__.get("__slots__", ()):
+                if hasattr(obj, name):
+                    contents[name] = getattr(obj, name)
+
+        if hasattr(obj, "__dict__"):
+            contents.update(vars(obj))
+
+        return contents
 
     @staticmethod
     def log_console(timestamp_format, msg, _level):
@@ -0,0 +1,370 @@
+# COPYRIGHT (C) 2020-2022 Nicotine+ Contributors
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module implements a registry of counters, gauges, histograms and summaries, and
+exporters that make them available in the Prometheus text format, or to a callback.
+
+Metrics are only recorded while an exporter is added. Code recording metrics in hot
+paths checks metrics.enabled first, to keep the cost negligible when nobody is
+listening.
+"""
+
+import threading
+
+from bisect import bisect_left
+from collections import deque
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from pynicotine.logfacility import log
+from pynicotine.scheduler import scheduler
+
+# Upper bounds of histogram buckets, in seconds
+TIME_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+class Metric:
+    """ A named value, or one value per combination of label values. Label values are
+    passed as tuples, in the order of label_names. """
+
+    __slots__ = ("name", "description", "label_names", "_values", "_function")
+    TYPE = "untyped"
+
+    def __init__(self, name, description, label_names=()):
+
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._function = None
+
+    def set_function(self, function):
+        """ Read values from function() when exporting, instead of storing them. The
+        function returns a value, or a dict of label value tuples and values if the
+        metric has labels. It may be called from any thread. """
+        self._function = function
+
+    def get_values(self):
+
+        if self._function is None:
+            return self._values.copy()
+
+        values = self._function()
+        return values if self.label_names else {(): values}
+
+    def get_samples(self):
+        """ Yields (name suffix, label pairs, value) tuples """
+
+        for label_values, value in self.get_values().items():
+            yield "", tuple(zip(self.label_names, label_values)), value
+
+    def clear(self):
+        self._values.clear()
+
+
+class Counter(Metric):
+
+    __slots__ = ()
+    TYPE = "counter"
+
+    def inc(self, amount=1, labels=()):
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+
+    __slots__ = ()
+    TYPE = "gauge"
+
+    def set(self, value, labels=()):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    """ Counts observed values in buckets. For every combination of label values, a list
+    holds the count of each bucket, the count of values above the last bucket and the
+    sum of all values. """
+
+    __slots__ = ("buckets",)
+    TYPE = "histogram"
+
+    def __init__(self, name, description, label_names=(), buckets=TIME_BUCKETS):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+
+        counts = self._values.get(labels)
+
+        if counts is None:
+            counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def get_samples(self):
+
+        upper_bounds = self.buckets + (float("inf"),)
+
+        for label_values, counts in self.get_values().items():
+            counts = counts[:]
+            label_pairs = tuple(zip(self.label_names, label_values))
+            cumulative_count = 0
+
+            for upper_bound, count in zip(upper_bounds, counts):
+                cumulative_count += count
+                yield "_bucket", label_pairs + (("le", upper_bound),), cumulative_count
+
+            yield "_sum", label_pairs, counts[-1]
+            yield "_count", label_pairs, cumulative_count
+
+
+class Summary(Metric):
+    """ Keeps the count and sum of observed values, and the most recent values to
+    calculate quantiles from. For every combination of label values, a list holds the
+    recent values, the count and the sum. """
+
+    __slots__ = ("quantiles", "window")
+    TYPE = "summary"
+
+    def __init__(self, name, description, label_names=(), quantiles=(0.5, 0.9, 0.99), window=1000):
+
+        super().__init__(name, description, label_names)
+
+        self.quantiles = tuple(quantiles)
+        self.window = window
+
+    def observe(self, value, labels=()):
+
+        entry = self._values.get(labels)
+
+        if entry is None:
+            entry = self._values[labels] = [deque(maxlen=self.window), 0, 0]
+
+        entry[0].append(value)
+        entry[1] += 1
+        entry[2] += value
+
+    def get_stats(self):
+        """ Returns a dict of label value tuples and (count, sum, quantile values) tuples """
+
+        stats = {}
+
+        for label_values, (recent_values, count, total) in self.get_values().items():
+            recent_values = sorted(recent_values.copy())
+            num_values = len(recent_values)
+            quantile_values = tuple(
+                recent_values[min(int(quantile * num_values), num_values - 1)] if num_values else 0
+                for quantile in self.quantiles)
+
+            stats[label_values] = (count, total, quantile_values)
+
+        return stats
+
+    def get_samples(self):
+
+        for label_values, (count, total, quantile_values) in self.get_stats().items():
+            label_pairs = tuple(zip(self.label_names, label_values))
+
+            for quantile, value in zip(self.quantiles, quantile_values):
+                yield "", label_pairs + (("quantile", quantile),), value
+
+            yield "_sum", label_pairs, total
+            yield "_count", label_pairs, count
+
+
+class MetricsRegistry:
+    """ Holds all metrics. Metrics are created once, usually at import time, and
+    recording values is enabled once an exporter is added. """
+
+    def __init__(self):
+
+        self.enabled = False
+        self._metrics = {}
+        self._exporters = []
+
+    def _add_metric(self, metric_class, name, description, label_names, **kwargs):
+
+        metric = self._metrics.get(name)
+
+        if metric is None:
+            metric = self._metrics[name] = metric_class(name, description, label_names, **kwargs)
+
+        return metric
+
+    def counter(self, name, description, label_names=()):
+        return self._add_metric(Counter, name, description, label_names)
+
+    def gauge(self, name, description, label_names=()):
+        return self._add_metric(Gauge, name, description, label_names)
+
+    def histogram(self, name, description, label_names=(), buckets=TIME_BUCKETS):
+        return self._add_metric(Histogram, name, description, label_names, buckets=buckets)
+
+    def summary(self, name, description, label_names=(), quantiles=(0.5, 0.9, 0.99), window=1000):
+        return self._add_metric(Summary, name, description, label_names, quantiles=quantiles, window=window)
+
+    def add_exporter(self, exporter):
+
+        exporter.start(self)
+        self._exporters.append(exporter)
+        self.enabled = True
+
+    def remove_exporter(self, exporter):
+
+        self._exporters.remove(exporter)
+        exporter.stop()
+
+        if not self._exporters:
+            self.enabled = False
+
+            for metric in self._metrics.values():
+                metric.clear()
+
+    def remove_all_exporters(self):
+
+        for exporter in self._exporters[:]:
+            self.remove_exporter(exporter)
+
+    def collect(self):
+        """ Returns a list of (sample name, label dict, value) tuples for all metrics """
+
+        samples = []
+
+        for metric in list(self._metrics.values()):
+            for suffix, label_pairs, value in metric.get_samples():
+                samples.append((metric.name + suffix, dict(label_pairs), value))
+
+        return samples
+
+    @staticmethod
+    def _format_value(value):
+
+        if isinstance(value, int):
+            return str(value)
+
+        if value == float("inf"):
+            return "+Inf"
+
+        return repr(float(value))
+
+    @staticmethod
+    def _format_label_value(value):
+
+        if not isinstance(value, str):
+            return MetricsRegistry._format_value(value)
+
+        return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+    def render_prometheus(self):
+        """ Returns all metrics in the Prometheus text exposition format """
+
+        lines = []
+
+        for metric in list(self._metrics.values()):
+            lines.append("# HELP %s %s" % (metric.name, metric.description.replace("\\", "\\\\").replace("\n", "\\n")))
+            lines.append("# TYPE %s %s" % (metric.name, metric.TYPE))
+
+            for suffix, label_pairs, value in metric.get_samples():
+                if label_pairs:
+                    labels = "{%s}" % ",".join(
+                        '%s="%s"' % (label_name, self._format_label_value(label_value))
+                        for label_name, label_value in label_pairs)
+                else:
+                    labels = ""
+
+                lines.append("%s%s%s %s" % (metric.name, suffix, labels, self._format_value(value)))
+
+        lines.append("")
+        return "\n".join(lines)
+
+
+class PrometheusExporter:
+    """ Serves metrics in the Prometheus text format at http://address:port/metrics.
+    Requests are handled in separate threads, and don't block the networking loop. """
+
+    def __init__(self, port, address="127.0.0.1"):
+
+        self.port = port
+        self.address = address
+        self._server = None
+
+    def start(self, registry):
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):  # pylint: disable=invalid-name
+
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+
+                body = registry.render_prometheus().encode("utf-8")
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self._server = ThreadingHTTPServer((self.address, self.port), MetricsRequestHandler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+        threading.Thread(target=self._server.serve_forever, name="MetricsExporter", daemon=True).start()
+        log.add("Serving metrics at http://%(address)s:%(port)s/metrics", {"address": self.address, "port": self.port})
+
+    def stop(self):
+
+        if self._server is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+
+
+class CallbackExporter:
+    """ Calls callback(samples) every interval seconds, from the networking thread.
+    samples is a list of (sample name, label dict, value) tuples. """
+
+    def __init__(self, callback, interval=10):
+
+        self.callback = callback
+        self.interval = interval
+        self._timer = None
+
+    def start(self, registry):
+        self._timer = scheduler.add(
+            delay=self.interval, callback=self._export, args=(registry,), repeat_interval=self.interval)
+
+    def stop(self):
+
+        scheduler.cancel(self._timer)
+        self._timer = None
+
+    def _export(self, registry):
+        self.callback(registry.collect())
+
+
+metrics = MetricsRegistry()
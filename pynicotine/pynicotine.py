@@ -34,13 +34,14 @@ This is the actual client code. Actual GUI classes are in the separate modules
 import os
 import signal
 import sys
-
-from collections import deque
+import threading
 
 from pynicotine import slskmessages
 from pynicotine import slskproto
 from pynicotine.config import config
 from pynicotine.logfacility import log
+from pynicotine.metrics import PrometheusExporter
+from pynicotine.metrics import metrics
 from pynicotine.networkfilter import NetworkFilter
 from pynicotine.search import Search
 from pynicotine.shares import Shares
@@ -58,6 +59,9 @@ class NicotineCore(EventEmitter):
         super().__init__()
 
         self.network_callback = None
+        self._num_network_msgs_received = 0
+        self._num_network_msgs_processed = 0
+        self._network_msgs_lock = threading.Lock()
 
         self.network_filter = None
         self.shares = None
@@ -76,16 +80,21 @@ class NicotineCore(EventEmitter):
         self.privileges_left = 0  # None
 
         self.events = {}
-        self.queue = deque()
+        self.queue = slskproto.NetworkQueue()
         self.user_statuses = {}
         self.watched_users = set()
         self.ip_requested = set()
 
     """ Actions """
 
-    def start(self, network_callback):
+    def start(self, network_callback, event_loop=None):
+        """ Start the networking engine. By default, networking runs in a separate thread.
+        If an asyncio event_loop is provided, networking runs inside the event loop instead,
+        and network_callback is called from the event loop thread. """
 
         self.network_callback = network_callback
+        self._num_network_msgs_received = 0
+        self._num_network_msgs_processed = 0
 
         script_dir = os.path.dirname(__file__)
         log.add("Loading %(program)s %(version)s", {"program": "Python", "version": config.python_version})
@@ -93,17 +102,40 @@ class NicotineCore(EventEmitter):
         log.add_debug("Using %(program)s executable: %(exe)s", {"program": config.application_name, "exe": script_dir})
         log.add("Loading %(program)s %(version)s", {"program": config.application_name, "version": config.version})
 
-        self.protothread = slskproto.SlskProtoThread(
-            core_callback=self.network_callback, queue=self.queue, bindip=self.bindip, port=self.port,
-            interface=config.sections["server"]["interface"],
-            port_range=config.sections["server"]["portrange"]
-        )
+        network_options = {
+            "core_callback": self.receive_network_msgs,
+            "queue": self.queue,
+            "bindip": self.bindip,
+            "port": self.port,
+            "interface": config.sections["server"]["interface"],
+            "port_range": config.sections["server"]["portrange"],
+            "max_peer_conns": config.sections["server"]["peerconnectionpoolsize"],
+            "peer_conn_idle_time": config.sections["server"]["peerconnectionidletime"],
+            "peer_address_file": (os.path.join(config.data_dir, "peer_addresses.json")
+                                  if config.sections["server"]["peeraddresscache"] else None),
+            "core_backlog_function": self.get_network_msg_backlog
+        }
+
+        if event_loop is not None:
+            self.protothread = slskproto.SlskProtoAsyncio(event_loop=event_loop, **network_options)
+        else:
+            self.protothread = slskproto.SlskProtoThread(**network_options)
+
         self.protothread.start()
 
+        metrics_port = config.sections["server"]["metricsport"]
+
+        if metrics_port:
+            try:
+                metrics.add_exporter(PrometheusExporter(metrics_port))
+
+            except OSError as error:
+                log.add("Unable to serve metrics on port %(port)s: %(error)s", {"port": metrics_port, "error": error})
+
         self.network_filter = NetworkFilter(self, config, self.queue)
-        self.shares = Shares(self, config, self.queue, self.network_callback)
+        self.shares = Shares(self, config, self.queue, self.receive_network_msgs)
         self.search = Search(self, config, self.queue, self.shares.share_dbs)
-        self.transfers = Transfers(self, config, self.queue, self.network_callback)
+        self.transfers = Transfers(self, config, self.queue, self.receive_network_msgs)
 
         self.transfers.init_transfers()
 
@@ -209,6 +241,7 @@ class NicotineCore(EventEmitter):
             slskmessages.SearchInactivityTimeout: self.dummy_message,
             slskmessages.ServerPing: self.dummy_message,
             slskmessages.SharedFileList: self.dummy_message,
+            slskmessages.SharedFileListChunk: self.dummy_message,
             slskmessages.SimilarUsers: self.dummy_message,
             slskmessages.TunneledMessage: self.dummy_message,
             slskmessages.UnknownPeerMessage: self.dummy_message,
@@ -237,6 +270,8 @@ class NicotineCore(EventEmitter):
         if self.protothread:
             self.protothread.abort()
 
+        metrics.remove_all_exporters()
+
         # Save download/upload list to file
         if self.transfers:
             self.transfers.quit()
@@ -319,6 +354,11 @@ class NicotineCore(EventEmitter):
     def request_set_status(self, status):
         self.queue.append(slskmessages.SetStatus(status))
 
+    def set_loop_profiling(self, enabled):
+        """ Start or stop timing the phases of the networking loop. When stopped, the
+        timings are logged. While running, they're also available as metrics. """
+        self.queue.append(slskmessages.SetLoopProfiling(enabled))
+
     def watch_user(self, user, force_update=False):
         """ Tell the server we want to be notified of status/stat updates
         for a user """
@@ -339,16 +379,42 @@ class NicotineCore(EventEmitter):
 
     """ Network Events """
 
+    def receive_network_msgs(self, msgs):
+        """ Pass messages for network_event() to the network_callback provided in start().
+        Can be called from any thread. """
+
+        with self._network_msgs_lock:
+            self._num_network_msgs_received += len(msgs)
+
+        self.network_callback(msgs)
+
+    def get_network_msg_backlog(self):
+        """ Returns the number of messages passed to network_callback that network_event()
+        hasn't processed yet """
+        return self._num_network_msgs_received - self._num_network_msgs_processed
+
     def network_event(self, msgs):
+
+        events = self.events
+        num_msgs = len(msgs)
+
         for msg in msgs:
             if self.shutdown:
                 return
-            try:
-                self.events[msg.__class__](msg)
-            except KeyError:
-#                log.add("No handler for class %s %s", (msg.__class__, dir(msg)))
-                pass
+
+            handler = events.get(msg.__class__)
+
+            if handler is not None:
+                handler(msg)
+
         msgs.clear()
+        self._num_network_msgs_processed += num_msgs
+
+        # Let the networking thread resume reading from peers as soon as we've caught up
+        protothread = self.protothread
+
+        if protothread.peer_reads_paused and self.get_network_msg_backlog() <= protothread.BACKLOG_LOW_WATER_MARK:
+            protothread.wakeup()
 
     @staticmethod
     def dummy_message(msg):
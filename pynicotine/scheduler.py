@@ -0,0 +1,150 @@
+# COPYRIGHT (C) 2020-2022 Nicotine+ Contributors
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module implements timers that run in the networking loop.
+"""
+
+import heapq
+import threading
+import time
+
+
+class Timer:
+    """ A callback that runs at a certain (monotonic) time. Created by Scheduler.add(). """
+
+    __slots__ = ("when", "callback", "args", "repeat_interval", "cancelled")
+
+    def __init__(self, when, callback, args, repeat_interval):
+
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.repeat_interval = repeat_interval
+        self.cancelled = False
+
+
+class Scheduler:
+    """ Keeps timers in a heap, ordered by their deadline. The networking loop sleeps
+    until the next deadline, and runs timers that are due. Timers can be added and
+    cancelled from any thread. Cancelled timers stay in the heap until they're due,
+    unless there are many of them, in which case the heap is rebuilt. """
+
+    def __init__(self):
+
+        self._heap = []
+        self._counter = 0
+        self._num_cancelled = 0
+        self._lock = threading.Lock()
+        self._wakeup_function = None
+
+    def set_wakeup_function(self, function):
+        """ Function to call when a timer is added before the current next deadline,
+        to let the networking loop recalculate how long to sleep """
+        self._wakeup_function = function
+
+    def add(self, delay, callback, args=(), repeat_interval=None):
+        """ Run callback(*args) in delay seconds, and then every repeat_interval seconds,
+        if provided. Returns a Timer that can be passed to cancel(). """
+
+        timer = Timer(time.monotonic() + delay, callback, args, repeat_interval)
+
+        with self._lock:
+            is_next_timer = (not self._heap or timer.when < self._heap[0][0])
+            self._push(timer)
+
+        if is_next_timer and self._wakeup_function is not None:
+            self._wakeup_function()
+
+        return timer
+
+    def cancel(self, timer):
+
+        if timer is None or timer.cancelled:
+            return
+
+        with self._lock:
+            timer.cancelled = True
+            self._num_cancelled += 1
+
+            if self._num_cancelled > 64 and self._num_cancelled > len(self._heap) // 2:
+                # Drop cancelled timers
+                self._heap = [item for item in self._heap if not item[2].cancelled]
+                heapq.heapify(self._heap)
+                self._num_cancelled = 0
+
+    def clear(self):
+
+        with self._lock:
+            for _when, _count, timer in self._heap:
+                timer.cancelled = True
+
+            self._heap.clear()
+            self._num_cancelled = 0
+
+    def get_timeout(self):
+        """ Returns the number of seconds until the next timer is due, or None if there
+        are no timers """
+
+        with self._lock:
+            if not self._heap:
+                return None
+
+            return max(0, self._heap[0][0] - time.monotonic())
+
+    def run_due_timers(self):
+        """ Run all timers that are due. Called by the networking loop. """
+
+        current_time = time.monotonic()
+        due_timers = []
+
+        with self._lock:
+            heap = self._heap
+
+            while heap and heap[0][0] <= current_time:
+                _when, _count, timer = heapq.heappop(heap)
+
+                if timer.cancelled:
+                    self._num_cancelled -= 1
+                    continue
+
+                if timer.repeat_interval is not None:
+                    timer.when = max(timer.when + timer.repeat_interval, current_time)
+                    self._push(timer)
+                else:
+                    timer.cancelled = True
+
+                due_timers.append(timer)
+
+        for timer in due_timers:
+            try:
+                timer.callback(*timer.args)
+
+            except Exception:
+                from traceback import format_exc
+                from pynicotine.logfacility import log
+                log.add("Timer callback %(callback)s failed: %(error)s",
+                        {"callback": timer.callback, "error": format_exc()})
+
+    def _push(self, timer):
+
+        self._counter += 1
+        heapq.heappush(self._heap, (timer.when, self._counter, timer))
+
+
+scheduler = Scheduler()
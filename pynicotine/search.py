@@ -24,18 +24,77 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import random
+import time
 
+from collections import OrderedDict
 from itertools import islice
 from operator import itemgetter
 
 from pynicotine import slskmessages
 from pynicotine.logfacility import log
+from pynicotine.metrics import metrics
 from pynicotine.slskmessages import increment_token
 from pynicotine.utils import TRANSLATE_PUNCTUATION
 
+DUPLICATE_SEARCH_REQUESTS = metrics.counter(
+    "pynicotine_search_request_duplicate_checks_total", "Incoming search requests checked for duplicates, by result",
+    ("result",))
+SHED_SEARCH_REQUESTS = metrics.counter(
+    "pynicotine_search_requests_shed_total", "Incoming search requests dropped due to load, by reason", ("reason",))
+
+
+class RequestBucket:
+    """ Limits the rate of search requests we respond to. Tokens (requests) are added
+    to the bucket at a constant rate, up to capacity. """
+
+    __slots__ = ("rate", "capacity", "tokens", "last_refill_time")
+
+    def __init__(self, rate, capacity):
+
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill_time = time.monotonic()
+
+    def consume(self, current_time):
+        """ Returns True if a request can be processed right now """
+
+        self.tokens = min(self.capacity, self.tokens + (current_time - self.last_refill_time) * self.rate)
+        self.last_refill_time = current_time
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
 
 class Search():
 
+    """ The same search request often reaches us several times, e.g. from our distributed
+    parent and from the server. Requests we processed are remembered in LRU order, and
+    copies arriving within DUPLICATE_REQUEST_TIME seconds are skipped. Requests we didn't
+    respond to because of load are not remembered, and can be answered later. """
+
+    MAX_RECENT_SEARCH_REQUESTS = 2048
+    DUPLICATE_REQUEST_TIME = 300
+
+    """ Responding to search requests is limited per user and in total, and by the
+    wall-clock time spent on it per second, to leave time for other messages. The time
+    budget is checked before and after looking up a search term, so that a single slow
+    lookup doesn't cause us to spend time on a response we don't have time for. When more
+    than half of the time budget is used, short and partial word search terms, which match
+    the most files, are dropped first. """
+
+    USER_REQUESTS_PER_SECOND = 1
+    USER_REQUEST_BURST = 5
+    MAX_USER_REQUEST_BUCKETS = 1000
+    TOTAL_REQUESTS_PER_SECOND = 50
+    TOTAL_REQUEST_BURST = 100
+    REQUEST_TIME_BUDGET = 0.1
+    SHORT_TERM_LOAD = 0.5
+    SHORT_TERM_LENGTH = 6
+
     def __init__(self, core, config, queue, share_dbs):
         self.core = core
         self.config = config
@@ -43,6 +102,25 @@ class Search():
         self.searches = {}
         self.token = int(random.random() * (2 ** 31 - 1))
         self.share_dbs = share_dbs
+        self._recent_search_requests = OrderedDict()
+        self.duplicate_request_hits = 0
+        self.duplicate_request_misses = 0
+
+        self._user_request_buckets = OrderedDict()
+        self._total_request_bucket = RequestBucket(self.TOTAL_REQUESTS_PER_SECOND, self.TOTAL_REQUEST_BURST)
+        self._request_time_window_start = time.monotonic()
+        self._request_time_used = 0
+        self.shed_requests = {
+            "user_rate": 0,
+            "total_rate": 0,
+            "short_term": 0,
+            "time_budget": 0
+        }
+
+        DUPLICATE_SEARCH_REQUESTS.set_function(
+            lambda: {("hit",): self.duplicate_request_hits, ("miss",): self.duplicate_request_misses})
+        SHED_SEARCH_REQUESTS.set_function(
+            lambda: {(reason,): count for reason, count in self.shed_requests.copy().items()})
 
     def request_folder_download(self, user, folder, visible_files):
 
@@ -159,12 +237,16 @@ class Search():
     def search_request(self, msg):
         """ Server code: 26, 42 and 120 """
 
+        start_time = time.perf_counter()
         self.process_search_request(msg.searchterm, msg.user, msg.token, direct=True)
+        self._request_time_used += time.perf_counter() - start_time
 
     def distrib_search(self, msg):
         """ Distrib code: 3 """
 
+        start_time = time.perf_counter()
         self.process_search_request(msg.searchterm, msg.user, msg.token, direct=False)
+        self._request_time_used += time.perf_counter() - start_time
 
     """ Incoming search requests """
 
@@ -243,6 +325,82 @@ class Search():
             log.add_debug("Error: DB closed during search, perhaps due to rescanning shares or closing the application")
             return None
 
+    @staticmethod
+    def get_search_request_key(searchterm, user, token):
+        """ Search terms only differing in case and whitespace are considered the same """
+        return (user, token, " ".join(searchterm.lower().split()))
+
+    def is_duplicate_search_request(self, key):
+        """ Returns True if we recently processed the same search request """
+
+        recent_requests = self._recent_search_requests
+        request_time = recent_requests.get(key)
+
+        if request_time is not None and time.monotonic() - request_time < self.DUPLICATE_REQUEST_TIME:
+            recent_requests.move_to_end(key)
+            self.duplicate_request_hits += 1
+            return True
+
+        self.duplicate_request_misses += 1
+        return False
+
+    def add_recent_search_request(self, key):
+        """ Remember a search request we're processing, to skip copies of it """
+
+        recent_requests = self._recent_search_requests
+        recent_requests[key] = time.monotonic()
+        recent_requests.move_to_end(key)
+
+        if len(recent_requests) > self.MAX_RECENT_SEARCH_REQUESTS:
+            recent_requests.popitem(last=False)
+
+    def get_request_load(self, current_time):
+        """ Returns the fraction of the time budget for responding to search requests used
+        in the current one-second window. Time is measured with perf_counter(), since
+        wall-clock time spent on the core thread is what delays other messages. """
+
+        if current_time - self._request_time_window_start >= 1:
+            self._request_time_window_start = current_time
+            self._request_time_used = 0
+
+        return self._request_time_used / self.REQUEST_TIME_BUDGET
+
+    def allow_search_request(self, searchterm, user, partial_words):
+        """ Returns False if the search request should be dropped, because the user or
+        everyone else sends too many requests, or we're running out of time """
+
+        current_time = time.monotonic()
+        load = self.get_request_load(current_time)
+
+        if load >= 1:
+            self.shed_requests["time_budget"] += 1
+            return False
+
+        if load >= self.SHORT_TERM_LOAD and (len(searchterm) < self.SHORT_TERM_LENGTH or partial_words):
+            self.shed_requests["short_term"] += 1
+            return False
+
+        user_buckets = self._user_request_buckets
+        user_bucket = user_buckets.get(user)
+
+        if user_bucket is None:
+            user_bucket = user_buckets[user] = RequestBucket(self.USER_REQUESTS_PER_SECOND, self.USER_REQUEST_BURST)
+
+            if len(user_buckets) > self.MAX_USER_REQUEST_BUCKETS:
+                user_buckets.popitem(last=False)
+        else:
+            user_buckets.move_to_end(user)
+
+        if not user_bucket.consume(current_time):
+            self.shed_requests["user_rate"] += 1
+            return False
+
+        if not self._total_request_bucket.consume(current_time):
+            self.shed_requests["total_rate"] += 1
+            return False
+
+        return True
+
     def process_search_request(self, searchterm, user, token, direct=False):
         """ Note: since this section is accessed every time a search request arrives several
             times per second, please keep it as optimized and memory sparse as possible! """
@@ -294,6 +452,11 @@ class Search():
         if not checkuser:
             return
 
+        request_key = self.get_search_request_key(searchterm_old, user, token)
+
+        if self.is_duplicate_search_request(request_key):
+            return
+
         if checkuser == 2:
             wordindex = self.share_dbs.get("buddywordindex")
         else:
@@ -302,12 +465,25 @@ class Search():
         if wordindex is None:
             return
 
+        if not self.allow_search_request(searchterm, user, partial_words):
+            return
+
+        self.add_recent_search_request(request_key)
+
         # Find common file matches for each word in search term
+        lookup_start_time = time.perf_counter()
         resultlist = self.create_search_result_list(searchterm, wordindex, excluded_words, partial_words)
 
         if not resultlist:
             return
 
+        if self._request_time_used + time.perf_counter() - lookup_start_time >= self.REQUEST_TIME_BUDGET:
+            # The lookup used up the rest of the time budget, skip building a response.
+            # Forget the request, so that a later copy of it can be answered.
+            self.shed_requests["time_budget"] += 1
+            self._recent_search_requests.pop(request_key, None)
+            return
+
         if checkuser == 2:
             fileindex = self.share_dbs.get("buddyfileindex")
         else:
@@ -866,8 +866,13 @@ class Shares:
         if not shares_list:
             # Nyah, Nyah
             shares_list = slskmessages.SharedFileList(init=msg.init)
+        else:
+            # Every peer gets its own message, but the compressed list of shares is
+            # shared between them, and is never copied
+            compressed_shares = shares_list
+            shares_list = slskmessages.SharedFileList(init=msg.init)
+            shares_list.built = compressed_shares.built
 
-        shares_list.init = msg.init
         self.queue.append(shares_list)
 
     def folder_contents_request(self, msg):
@@ -0,0 +1,228 @@
+# COPYRIGHT (C) 2020-2022 Nicotine+ Contributors
+#
+# GNU GENERAL PUBLIC LICENSE
+#    Version 3, 29 June 2007
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module compiles message layouts, declared as schemas in slskmessages, into
+specialized functions that pack and parse messages.
+"""
+
+import socket
+import struct
+
+
+class FieldType:
+    BOOL = "?"
+    UINT8 = "B"
+    INT32 = "i"
+    UINT32 = "I"
+    UINT64 = "Q"
+    IP = "ip"
+    STRING = "string"
+    BYTES = "bytes"
+
+
+# Fields following OPTIONAL in a schema are only parsed if the message contains more data.
+# Some servers and clients (e.g. Soulfind) send additional fields.
+OPTIONAL = None
+
+FIXED_SIZE_FORMATS = {
+    FieldType.BOOL: "?",
+    FieldType.UINT8: "B",
+    FieldType.INT32: "i",
+    FieldType.UINT32: "I",
+    FieldType.UINT64: "Q",
+    FieldType.IP: "I"
+}
+UINT_STRUCT = struct.Struct("<I")
+IP_STRUCT = struct.Struct(">I")
+
+
+class SchemaCompiler:
+    """ Generates the source code of a pack or parse function for a schema. Consecutive
+    fixed size fields are merged into a single struct.Struct, and fields are read
+    with unpack_from(), without slicing the message. """
+
+    def __init__(self, schema):
+
+        self.schema = schema
+        self.lines = []
+        self.namespace = {
+            "UINT_PACK": UINT_STRUCT.pack,
+            "UINT_UNPACK_FROM": UINT_STRUCT.unpack_from,
+            "IP_PACK": IP_STRUCT.pack,
+            "IP_UNPACK": IP_STRUCT.unpack,
+            "inet_aton": socket.inet_aton,
+            "inet_ntoa": socket.inet_ntoa
+        }
+
+    def add_struct(self, fields, function_name):
+
+        struct_format = "<" + "".join(FIXED_SIZE_FORMATS[field_type] for _name, field_type in fields)
+        struct_obj = struct.Struct(struct_format)
+        struct_name = "STRUCT_%i" % len(self.namespace)
+
+        self.namespace[struct_name] = getattr(struct_obj, function_name)
+        return struct_name, struct_obj.size
+
+    def get_fixed_size_runs(self, schema):
+        """ Yields (fields, is_fixed_size) tuples, where consecutive fixed size fields are grouped """
+
+        run = []
+
+        for field in schema:
+            if field is not OPTIONAL and field[1] in FIXED_SIZE_FORMATS:
+                run.append(field)
+                continue
+
+            if run:
+                yield run, True
+                run = []
+
+            yield field, False
+
+        if run:
+            yield run, True
+
+    """ Parsing """
+
+    def add_parse_fixed_size(self, fields):
+
+        struct_name, size = self.add_struct(fields, "unpack_from")
+        targets = []
+        ip_fields = []
+
+        for index, (name, field_type) in enumerate(fields):
+            if field_type == FieldType.IP and name:
+                target = "ip_%i" % index
+                ip_fields.append((name, target))
+
+            elif name:
+                target = "self." + name
+
+            else:
+                target = "_unused"
+
+            targets.append(target)
+
+        self.lines.append("    %s, = %s(message, pos)" % (", ".join(targets), struct_name))
+        self.lines.append("    pos += %i" % size)
+
+        for name, target in ip_fields:
+            self.lines.append("    self.%s = inet_ntoa(IP_PACK(%s))" % (name, target))
+
+    def add_parse_variable_size(self, name, field_type):
+
+        self.lines.append("    length, = UINT_UNPACK_FROM(message, pos)")
+        self.lines.append("    pos += 4")
+
+        if not name:
+            self.lines.append("    pos += length")
+            return
+
+        self.lines.append("    value = message[pos:pos + length]")
+        self.lines.append("    pos += length")
+
+        if field_type == FieldType.BYTES:
+            self.lines.append("    self.%s = bytes(value)" % name)
+            return
+
+        # Older clients (Soulseek NS) send latin-1 strings
+        self.lines.append("    try:")
+        self.lines.append("        self.%s = str(value, 'utf-8')" % name)
+        self.lines.append("    except UnicodeDecodeError:")
+        self.lines.append("        self.%s = str(value, 'latin-1')" % name)
+
+    def compile_parser(self):
+
+        self.lines.append("def parse_network_message(self, message):")
+        self.lines.append("    pos = 0")
+
+        if OPTIONAL in self.schema:
+            self.lines.append("    message_len = len(message)")
+
+        for field, is_fixed_size in self.get_fixed_size_runs(self.schema):
+            if is_fixed_size:
+                self.add_parse_fixed_size(field)
+
+            elif field is OPTIONAL:
+                self.lines.append("    if pos >= message_len:")
+                self.lines.append("        return")
+
+            else:
+                self.add_parse_variable_size(*field)
+
+        return self.build_function("parse_network_message")
+
+    """ Packing """
+
+    def compile_packer(self):
+
+        self.lines.append("def make_network_message(self):")
+        parts = []
+
+        for field, is_fixed_size in self.get_fixed_size_runs(self.schema):
+            if field is OPTIONAL:
+                continue
+
+            if is_fixed_size:
+                struct_name, _size = self.add_struct(field, "pack")
+                values = []
+
+                for name, field_type in field:
+                    if field_type == FieldType.IP:
+                        values.append("IP_UNPACK(inet_aton(self.%s))[0]" % name)
+                    else:
+                        values.append("self." + name)
+
+                parts.append("%s(%s)" % (struct_name, ", ".join(values)))
+                continue
+
+            name, field_type = field
+            variable = "value_%i" % len(parts)
+
+            if field_type == FieldType.BYTES:
+                self.lines.append("    %s = self.%s" % (variable, name))
+            else:
+                self.lines.append("    %s = bytes(self.%s, 'utf-8', 'replace')" % (variable, name))
+
+            parts.append("UINT_PACK(len(%s))" % variable)
+            parts.append(variable)
+
+        if len(parts) == 1:
+            self.lines.append("    return " + parts[0])
+        else:
+            self.lines.append("    return b''.join((%s))" % ", ".join(parts))
+
+        return self.build_function("make_network_message")
+
+    def build_function(self, function_name):
+
+        exec("\n".join(self.lines), self.namespace)  # pylint: disable=exec-used
+        return self.namespace[function_name]
+
+
+def compile_parser(schema):
+    """ Returns a parse_network_message() function for the fields in schema, a sequence of
+    (attribute name, FieldType) tuples and OPTIONAL markers. Fields without an attribute
+    name are skipped. """
+    return SchemaCompiler(schema).compile_parser()
+
+
+def compile_packer(schema):
+    """ Returns a make_network_message() function for the fields in schema """
+    return SchemaCompiler(schema).compile_packer()
@@ -24,6 +24,10 @@ import zlib
 from operator import itemgetter
 
 from pynicotine.config import config
+from pynicotine.slskcodec import OPTIONAL
+from pynicotine.slskcodec import FieldType
+from pynicotine.slskcodec import compile_packer
+from pynicotine.slskcodec import compile_parser
 
 """ This module contains message classes, that networking and UI thread
 exchange. Basically there are three types of messages: internal messages,
@@ -91,6 +95,12 @@ class TransferDirection:
     UPLOAD = 1
 
 
+class UploadPriority:
+    PRIVILEGED = "privileged"
+    BUDDY = "buddy"
+    REGULAR = "regular"
+
+
 class FileAttribute:
     BITRATE = 0
     DURATION = 1
@@ -106,12 +116,17 @@ Internal Messages
 
 
 class InternalMessage:
+
+    __slots__ = ()
+
     msgtype = MessageType.INTERNAL
 
 
 class ServerConnect(InternalMessage):
     """ NicotineCore sends this to make networking thread establish a server connection. """
 
+    __slots__ = ("addr", "login")
+
     def __init__(self, addr=None, login=None):
         self.addr = addr
         self.login = login
@@ -119,12 +134,15 @@ class ServerConnect(InternalMessage):
 
 class ServerDisconnect(InternalMessage):
 
+    __slots__ = ("manual_disconnect",)
+
     def __init__(self, manual_disconnect=False):
         self.manual_disconnect = manual_disconnect
 
 
 class ServerTimeout(InternalMessage):
-    pass
+
+    __slots__ = ()
 
 
 class InitPeerConn(InternalMessage):
@@ -138,6 +156,8 @@ class InitPeerConn(InternalMessage):
 
 class ConnClose(InternalMessage):
 
+    __slots__ = ("sock",)
+
     def __init__(self, sock=None):
         self.sock = sock
 
@@ -146,12 +166,16 @@ class ConnCloseIP(InternalMessage):
     """ Sent by the main thread to the networking thread in order to close any connections
     using a certain IP address. """
 
+    __slots__ = ("addr",)
+
     def __init__(self, addr=None):
         self.addr = addr
 
 
 class SendNetworkMessage(InternalMessage):
 
+    __slots__ = ("user", "message", "addr")
+
     def __init__(self, user=None, message=None, addr=None):
         self.user = user
         self.message = message
@@ -160,6 +184,8 @@ class SendNetworkMessage(InternalMessage):
 
 class ShowConnectionErrorMessage(InternalMessage):
 
+    __slots__ = ("user", "msgs")
+
     def __init__(self, user=None, msgs=None):
         self.user = user
         self.msgs = msgs
@@ -177,6 +203,18 @@ class MessageProgress(InternalMessage):
         self.total = total
 
 
+class SharedFileListChunk(InternalMessage):
+    """ Sent while a large SharedFileList message is being received, with the directories
+    parsed so far. The complete SharedFileList message follows once all data has arrived. """
+
+    __slots__ = ("init", "list", "privatelist")
+
+    def __init__(self, init=None, shares=None, privatelist=None):
+        self.init = init
+        self.list = shares
+        self.privatelist = privatelist
+
+
 class TransferTimeout(InternalMessage):
 
     __slots__ = ("transfer",)
@@ -189,11 +227,15 @@ class CheckDownloadQueue(InternalMessage):
     """ Sent from a timer to the main thread to indicate that stuck downloads
     should be checked. """
 
+    __slots__ = ()
+
 
 class CheckUploadQueue(InternalMessage):
     """ Sent from a timer to the main thread to indicate that the upload queue
     should be checked. """
 
+    __slots__ = ()
+
 
 class DownloadFile(InternalMessage):
     """ Sent by networking thread to indicate file transfer progress.
@@ -210,15 +252,17 @@ class DownloadFile(InternalMessage):
 
 class UploadFile(InternalMessage):
 
-    __slots__ = ("init", "token", "file", "size", "sentbytes", "offset")
+    __slots__ = ("init", "token", "file", "size", "sentbytes", "offset", "priority")
 
-    def __init__(self, init=None, token=None, file=None, size=None, sentbytes=0, offset=None):
+    def __init__(self, init=None, token=None, file=None, size=None, sentbytes=0, offset=None,
+                 priority=UploadPriority.REGULAR):
         self.init = init
         self.token = token
         self.file = file
         self.size = size
         self.sentbytes = sentbytes
         self.offset = offset
+        self.priority = priority
 
 
 class DownloadFileError(InternalMessage):
@@ -235,7 +279,8 @@ class DownloadFileError(InternalMessage):
 
 
 class UploadFileError(DownloadFileError):
-    pass
+
+    __slots__ = ()
 
 
 class DownloadConnClose(InternalMessage):
@@ -261,35 +306,74 @@ class UploadConnClose(InternalMessage):
 class SetUploadLimit(InternalMessage):
     """ Sent by the GUI thread to indicate changes in bandwidth shaping rules"""
 
-    def __init__(self, uselimit, limit, limitby):
+    __slots__ = ("uselimit", "limit", "limitby", "priority_weights")
+
+    def __init__(self, uselimit, limit, limitby, priority_weights=None):
         self.uselimit = uselimit
         self.limit = limit
         self.limitby = limitby
+        self.priority_weights = priority_weights
 
 
 class SetDownloadLimit(InternalMessage):
     """ Sent by the GUI thread to indicate changes in bandwidth shaping rules"""
 
+    __slots__ = ("limit",)
+
     def __init__(self, limit):
         self.limit = limit
 
 
+class SetLoopProfiling(InternalMessage):
+    """ Sent by NicotineCore to enable or disable profiling of the networking loop.
+    When profiling is disabled, the recorded timings are logged. """
+
+    __slots__ = ("enabled",)
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+
+
 class SetConnectionStats(InternalMessage):
     """ Sent by networking thread to update the number of current
-    connections shown in the GUI. """
+    connections shown in the GUI. core_backlog and queue_depth are the
+    largest number of messages waiting for NicotineCore and the networking
+    thread since the last update. read_paused_conns is the number of
+    connections not read from until the backlog clears. """
 
-    __slots__ = ("total_conns", "download_conns", "download_bandwidth", "upload_conns", "upload_bandwidth")
+    __slots__ = ("total_conns", "download_conns", "download_bandwidth", "upload_conns", "upload_bandwidth",
+                 "core_backlog", "queue_depth", "read_paused_conns")
 
-    def __init__(self, total_conns=0, download_conns=0, download_bandwidth=0, upload_conns=0, upload_bandwidth=0):
+    def __init__(self, total_conns=0, download_conns=0, download_bandwidth=0, upload_conns=0, upload_bandwidth=0,
+                 core_backlog=0, queue_depth=0, read_paused_conns=0):
         self.total_conns = total_conns
         self.download_conns = download_conns
         self.download_bandwidth = download_bandwidth
         self.upload_conns = upload_conns
         self.upload_bandwidth = upload_bandwidth
+        self.core_backlog = core_backlog
+        self.queue_depth = queue_depth
+        self.read_paused_conns = read_paused_conns
 
 
 class SlskMessage:
-    """ This is a parent class for all protocol messages. """
+    """ This is a parent class for all protocol messages. Messages with a simple layout
+    declare their fields in MAKE_SCHEMA and PARSE_SCHEMA, which are compiled into
+    make_network_message() and parse_network_message() functions. """
+
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+
+        super().__init_subclass__(**kwargs)
+
+        if "MAKE_SCHEMA" in cls.__dict__:
+            cls.make_network_message = compile_packer(cls.MAKE_SCHEMA)
+            cls.make_network_message.__qualname__ = cls.__name__ + ".make_network_message"
+
+        if "PARSE_SCHEMA" in cls.__dict__:
+            cls.parse_network_message = compile_parser(cls.PARSE_SCHEMA)
+            cls.parse_network_message.__qualname__ = cls.__name__ + ".parse_network_message"
 
     @staticmethod
     def pack_bytes(content):
@@ -335,7 +419,7 @@ class SlskMessage:
     def unpack_bytes(message, start=0):
 
         length = UINT_UNPACK(message[start:start + 4])[0]
-        content = message[start + 4:start + length + 4]
+        content = bytes(message[start + 4:start + length + 4])
 
         return start + 4 + length, content
 
@@ -397,8 +481,9 @@ class SlskMessage:
         log.add_debug("Can't parse incoming messages, class %s", self.__class__)
 
     def debug(self, message=None):
+        from pynicotine.logfacility import log
         from pynicotine.utils import debug
-        debug(type(self).__name__, self.__dict__, repr(message))
+        debug(type(self).__name__, log.contents(self), repr(message))
 
 
 """
@@ -407,6 +492,9 @@ Server Messages
 
 
 class ServerMessage(SlskMessage):
+
+    __slots__ = ()
+
     msgtype = MessageType.SERVER
 
 
@@ -415,6 +503,9 @@ class Login(ServerMessage):
     """ We send this to the server right after the connection has been
     established. Server responds with the greeting message. """
 
+    __slots__ = ("username", "passwd", "version", "minorversion", "success", "reason", "banner", "ip_address",
+                 "checksum")
+
     def __init__(self, username=None, passwd=None, version=None, minorversion=None):
         self.username = username
         self.passwd = passwd
@@ -465,31 +556,38 @@ class SetWaitPort(ServerMessage):
     """ We send this to the server to indicate the port number that we
     listen on (2234 by default). """
 
+    __slots__ = ("port",)
+
+    MAKE_SCHEMA = (
+        ("port", FieldType.UINT32),
+    )
+
     def __init__(self, port=None):
         self.port = port
 
-    def make_network_message(self):
-        return self.pack_uint32(self.port)
-
 
 class GetPeerAddress(ServerMessage):
     """ Server code: 3 """
     """ We send this to the server to ask for a peer's address
     (IP address and port), given the peer's username. """
 
+    __slots__ = ("user", "ip_address", "port")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("ip_address", FieldType.IP),
+        ("port", FieldType.UINT32)
+    )
+
     def __init__(self, user=None):
         self.user = user
         self.ip_address = None
         self.port = None
 
-    def make_network_message(self):
-        return self.pack_string(self.user)
-
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.ip_address = self.unpack_ip(message, pos)
-        pos, self.port = self.unpack_uint32(message, pos)
-
 
 class AddUser(ServerMessage):
     """ Server code: 5 """
@@ -497,6 +595,12 @@ class AddUser(ServerMessage):
     stats have changed, the server sends a GetUserStats response message
     with the new user stats. """
 
+    __slots__ = ("user", "userexists", "status", "avgspeed", "uploadnum", "files", "dirs", "country")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
     def __init__(self, user=None):
         self.user = user
         self.userexists = None
@@ -507,9 +611,6 @@ class AddUser(ServerMessage):
         self.dirs = None
         self.country = None
 
-    def make_network_message(self):
-        return self.pack_string(self.user)
-
     def parse_network_message(self, message):
         pos, self.user = self.unpack_string(message)
         pos, self.userexists = self.unpack_bool(message, pos)
@@ -537,55 +638,62 @@ class RemoveUser(ServerMessage):
     """ Used when we no longer want to be kept updated about a
     user's stats. """
 
+    __slots__ = ("user",)
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
     def __init__(self, user=None):
         self.user = user
 
-    def make_network_message(self):
-        return self.pack_string(self.user)
-
 
 class GetUserStatus(ServerMessage):
     """ Server code: 7 """
     """ The server tells us if a user has gone away or has returned. """
 
+    __slots__ = ("user", "status", "privileged")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("status", FieldType.UINT32),
+        # Soulfind support
+        OPTIONAL,
+        ("privileged", FieldType.BOOL)
+    )
+
     def __init__(self, user=None):
         self.user = user
         self.status = None
         self.privileged = None
 
-    def make_network_message(self):
-        return self.pack_string(self.user)
-
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.status = self.unpack_uint32(message, pos)
-
-        # Soulfind support
-        if message[pos:]:
-            pos, self.privileged = self.unpack_bool(message, pos)
-
 
 class SayChatroom(ServerMessage):
     """ Server code: 13 """
     """ Either we want to say something in the chatroom, or someone else did. """
 
+    __slots__ = ("room", "msg", "user")
+
+    MAKE_SCHEMA = (
+        ("room", FieldType.STRING),
+        ("msg", FieldType.STRING)
+    )
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+        ("user", FieldType.STRING),
+        ("msg", FieldType.STRING)
+    )
+
     def __init__(self, room=None, msg=None):
         self.room = room
         self.msg = msg
         self.user = None
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.room))
-        msg.extend(self.pack_string(self.msg))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.room = self.unpack_string(message)
-        pos, self.user = self.unpack_string(message, pos)
-        pos, self.msg = self.unpack_string(message, pos)
-
 
 class UserData:
     """ When we join a room, the server sends us a bunch of these for each user. """
@@ -612,6 +720,8 @@ class JoinRoom(ServerMessage):
     Server responds with this message when we join a room. Contains users list
     with data on everyone. """
 
+    __slots__ = ("room", "private", "owner", "users", "operators")
+
     def __init__(self, room=None, private=None):
         self.room = room
         self.private = private
@@ -677,20 +787,26 @@ class LeaveRoom(ServerMessage):
     """ Server code: 15 """
     """ We send this to the server when we want to leave a room. """
 
-    def __init__(self, room=None):
-        self.room = room
+    __slots__ = ("room",)
 
-    def make_network_message(self):
-        return self.pack_string(self.room)
+    MAKE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
 
-    def parse_network_message(self, message):
-        _pos, self.room = self.unpack_string(message)
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
+    def __init__(self, room=None):
+        self.room = room
 
 
 class UserJoinedRoom(ServerMessage):
     """ Server code: 16 """
     """ The server tells us someone has just joined a room we're in. """
 
+    __slots__ = ("room", "userdata")
+
     def __init__(self):
         self.room = None
         self.userdata = None
@@ -716,14 +832,17 @@ class UserLeftRoom(ServerMessage):
     """ Server code: 17 """
     """ The server tells us someone has just left a room we're in. """
 
+    __slots__ = ("room", "username")
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+        ("username", FieldType.STRING)
+    )
+
     def __init__(self):
         self.room = None
         self.username = None
 
-    def parse_network_message(self, message):
-        pos, self.room = self.unpack_string(message)
-        pos, self.username = self.unpack_string(message, pos)
-
 
 class ConnectToPeer(ServerMessage):
     """ Server code: 18 """
@@ -733,6 +852,25 @@ class ConnectToPeer(ServerMessage):
     to go the other way around (direct connection has failed).
     """
 
+    __slots__ = ("token", "user", "conn_type", "ip_address", "port", "privileged")
+
+    MAKE_SCHEMA = (
+        ("token", FieldType.UINT32),
+        ("user", FieldType.STRING),
+        ("conn_type", FieldType.STRING)
+    )
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("conn_type", FieldType.STRING),
+        ("ip_address", FieldType.IP),
+        ("port", FieldType.UINT32),
+        ("token", FieldType.UINT32),
+        # Soulfind support
+        OPTIONAL,
+        ("privileged", FieldType.BOOL)
+    )
+
     def __init__(self, token=None, user=None, conn_type=None):
         self.token = token
         self.user = user
@@ -741,30 +879,18 @@ class ConnectToPeer(ServerMessage):
         self.port = None
         self.privileged = None
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_uint32(self.token))
-        msg.extend(self.pack_string(self.user))
-        msg.extend(self.pack_string(self.conn_type))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.conn_type = self.unpack_string(message, pos)
-        pos, self.ip_address = self.unpack_ip(message, pos)
-        pos, self.port = self.unpack_uint32(message, pos)
-        pos, self.token = self.unpack_uint32(message, pos)
-
-        # Soulfind support
-        if message[pos:]:
-            pos, self.privileged = self.unpack_bool(message, pos)
-
 
 class MessageUser(ServerMessage):
     """ Server code: 22 """
     """ Chat phrase sent to someone or received by us in private. """
 
+    __slots__ = ("user", "msg", "msgid", "timestamp", "newmessage")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("msg", FieldType.STRING)
+    )
+
     def __init__(self, user=None, msg=None):
         self.user = user
         self.msg = msg
@@ -772,13 +898,6 @@ class MessageUser(ServerMessage):
         self.timestamp = None
         self.newmessage = None
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.user))
-        msg.extend(self.pack_string(self.msg))
-
-        return msg
-
     def parse_network_message(self, message):
         pos, self.msgid = self.unpack_uint32(message)
         pos, self.timestamp = self.unpack_uint32(message, pos)
@@ -797,31 +916,34 @@ class MessageAcked(ServerMessage):
     If we don't send it, the server will keep sending the chat phrase to us.
     """
 
+    __slots__ = ("msgid",)
+
+    MAKE_SCHEMA = (
+        ("msgid", FieldType.UINT32),
+    )
+
     def __init__(self, msgid=None):
         self.msgid = msgid
 
-    def make_network_message(self):
-        return self.pack_uint32(self.msgid)
-
 
 class FileSearchRoom(ServerMessage):
     """ Server code: 25 """
     """ We send this to the server when we search for something in a room. """
     """ OBSOLETE, use RoomSearch server message """
 
+    __slots__ = ("token", "roomid", "searchterm")
+
+    MAKE_SCHEMA = (
+        ("token", FieldType.UINT32),
+        ("roomid", FieldType.UINT32),
+        ("searchterm", FieldType.STRING)
+    )
+
     def __init__(self, token=None, roomid=None, text=None):
         self.token = token
         self.roomid = roomid
         self.searchterm = text
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_uint32(self.token))
-        msg.extend(self.pack_uint32(self.roomid))
-        msg.extend(self.pack_string(self.searchterm))
-
-        return msg
-
 
 class FileSearch(ServerMessage):
     """ Server code: 26 """
@@ -834,6 +956,14 @@ class FileSearch(ServerMessage):
     search results.
     """
 
+    __slots__ = ("token", "searchterm", "user")
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32),
+        ("searchterm", FieldType.STRING)
+    )
+
     def __init__(self, token=None, text=None):
         self.token = token
         self.searchterm = text
@@ -849,11 +979,6 @@ class FileSearch(ServerMessage):
 
         return msg
 
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.token = self.unpack_uint32(message, pos)
-        pos, self.searchterm = self.unpack_string(message, pos)
-
 
 class SetStatus(ServerMessage):
     """ Server code: 28 """
@@ -864,18 +989,23 @@ class SetStatus(ServerMessage):
     2 = Online
     """
 
+    __slots__ = ("status",)
+
+    MAKE_SCHEMA = (
+        ("status", FieldType.INT32),
+    )
+
     def __init__(self, status=None):
         self.status = status
 
-    def make_network_message(self):
-        return self.pack_int32(self.status)
-
 
 class ServerPing(ServerMessage):
     """ Server code: 32 """
     """ We test if the server responds. """
     """ DEPRECATED """
 
+    __slots__ = ()
+
     def make_network_message(self):
         return b""
 
@@ -888,20 +1018,21 @@ class SendConnectToken(ServerMessage):
     """ Server code: 33 """
     """ OBSOLETE, no longer used """
 
-    def __init__(self, user, token):
-        self.user = user
-        self.token = token
+    __slots__ = ("user", "token")
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.user))
-        msg.extend(self.pack_uint32(self.token))
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32)
+    )
 
-        return msg
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32)
+    )
 
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.token = self.unpack_uint32(message, pos)
+    def __init__(self, user, token):
+        self.user = user
+        self.token = token
 
 
 class SendDownloadSpeed(ServerMessage):
@@ -910,34 +1041,34 @@ class SendDownloadSpeed(ServerMessage):
     the speed statistics for a user. """
     """ OBSOLETE, use SendUploadSpeed server message """
 
+    __slots__ = ("user", "speed")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("speed", FieldType.UINT32)
+    )
+
     def __init__(self, user=None, speed=None):
         self.user = user
         self.speed = speed
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.user))
-        msg.extend(self.pack_uint32(self.speed))
-
-        return msg
-
 
 class SharedFoldersFiles(ServerMessage):
     """ Server code: 35 """
     """ We send this to server to indicate the number of folder and files
     that we share. """
 
+    __slots__ = ("folders", "files")
+
+    MAKE_SCHEMA = (
+        ("folders", FieldType.UINT32),
+        ("files", FieldType.UINT32)
+    )
+
     def __init__(self, folders=None, files=None):
         self.folders = folders
         self.files = files
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_uint32(self.folders))
-        msg.extend(self.pack_uint32(self.files))
-
-        return msg
-
 
 class GetUserStats(ServerMessage):
     """ Server code: 36 """
@@ -946,6 +1077,20 @@ class GetUserStats(ServerMessage):
     stats can also be requested by sending a GetUserStats message to the
     server, but AddUser should be used instead. """
 
+    __slots__ = ("user", "avgspeed", "uploadnum", "files", "dirs")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("avgspeed", FieldType.UINT32),
+        ("uploadnum", FieldType.UINT64),
+        ("files", FieldType.UINT32),
+        ("dirs", FieldType.UINT32)
+    )
+
     def __init__(self, user=None):
         self.user = user
         self.avgspeed = None
@@ -953,16 +1098,6 @@ class GetUserStats(ServerMessage):
         self.files = None
         self.dirs = None
 
-    def make_network_message(self):
-        return self.pack_string(self.user)
-
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.avgspeed = self.unpack_uint32(message, pos)
-        pos, self.uploadnum = self.unpack_uint64(message, pos)
-        pos, self.files = self.unpack_uint32(message, pos)
-        pos, self.dirs = self.unpack_uint32(message, pos)
-
 
 class QueuedDownloads(ServerMessage):
     """ Server code: 40 """
@@ -970,20 +1105,25 @@ class QueuedDownloads(ServerMessage):
     or not. """
     """ OBSOLETE, no longer sent by the server """
 
+    __slots__ = ("user", "slotsfull")
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("slotsfull", FieldType.UINT32)
+    )
+
     def __init__(self):
         self.user = None
         self.slotsfull = None
 
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.slotsfull = self.unpack_uint32(message, pos)
-
 
 class Relogged(ServerMessage):
     """ Server code: 41 """
     """ The server sends this if someone else logged in under our nickname,
     and then disconnects us. """
 
+    __slots__ = ()
+
     def parse_network_message(self, message):
         # Empty message
         pass
@@ -995,6 +1135,14 @@ class UserSearch(ServerMessage):
     The token is a number generated by the client and is used to track the
     search results. """
 
+    __slots__ = ("user", "token", "searchterm")
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32),
+        ("searchterm", FieldType.STRING)
+    )
+
     def __init__(self, user=None, token=None, text=None):
         self.user = user
         self.token = token
@@ -1009,10 +1157,6 @@ class UserSearch(ServerMessage):
         return msg
 
     # Soulfind support, the official server sends a FileSearch message (code 26) instead
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.token = self.unpack_uint32(message, pos)
-        pos, self.searchterm = self.unpack_string(message, pos)
 
 
 class AddThingILike(ServerMessage):
@@ -1020,24 +1164,30 @@ class AddThingILike(ServerMessage):
     """ We send this to the server when we add an item to our likes list. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("thing",)
+
+    MAKE_SCHEMA = (
+        ("thing", FieldType.STRING),
+    )
+
     def __init__(self, thing=None):
         self.thing = thing
 
-    def make_network_message(self):
-        return self.pack_string(self.thing)
-
 
 class RemoveThingILike(ServerMessage):
     """ Server code: 52 """
     """ We send this to the server when we remove an item from our likes list. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("thing",)
+
+    MAKE_SCHEMA = (
+        ("thing", FieldType.STRING),
+    )
+
     def __init__(self, thing=None):
         self.thing = thing
 
-    def make_network_message(self):
-        return self.pack_string(self.thing)
-
 
 class Recommendations(ServerMessage):
     """ Server code: 54 """
@@ -1045,6 +1195,8 @@ class Recommendations(ServerMessage):
     for each. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("recommendations", "unrecommendations")
+
     def __init__(self):
         self.recommendations = []
         self.unrecommendations = []
@@ -1086,6 +1238,8 @@ class GlobalRecommendations(Recommendations):
     for each. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ()
+
 
 class UserInterests(ServerMessage):
     """ Server code: 57 """
@@ -1093,14 +1247,17 @@ class UserInterests(ServerMessage):
     responds with a list of interests. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("user", "likes", "hates")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
     def __init__(self, user=None):
         self.user = user
         self.likes = []
         self.hates = []
 
-    def make_network_message(self):
-        return self.pack_string(self.user)
-
     def parse_network_message(self, message):
         pos, self.user = self.unpack_string(message)
         pos, likesnum = self.unpack_uint32(message, pos)
@@ -1125,6 +1282,8 @@ class AdminCommand(ServerMessage):
     """ OBSOLETE, no longer used since Soulseek stopped supporting third-party
     servers in 2002 """
 
+    __slots__ = ("command", "command_args")
+
     def __init__(self, command=None, command_args=None):
         self.command = command
         self.command_args = command_args
@@ -1146,48 +1305,55 @@ class PlaceInLineResponse(ServerMessage):
     waiting for files from another peer. """
     """ OBSOLETE, use PlaceInQueue peer message """
 
+    __slots__ = ("token", "user", "place")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32),
+        ("place", FieldType.UINT32)
+    )
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32),
+        ("place", FieldType.UINT32)
+    )
+
     def __init__(self, user=None, token=None, place=None):
         self.token = token
         self.user = user
         self.place = place
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.user))
-        msg.extend(self.pack_uint32(self.token))
-        msg.extend(self.pack_uint32(self.place))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.token = self.unpack_uint32(message, pos)
-        pos, self.place = self.unpack_uint32(message, pos)
-
 
 class RoomAdded(ServerMessage):
     """ Server code: 62 """
     """ The server tells us a new room has been added. """
     """ OBSOLETE, no longer sent by the server """
 
+    __slots__ = ("room",)
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
     def __init__(self):
         self.room = None
 
-    def parse_network_message(self, message):
-        _pos, self.room = self.unpack_string(message)
-
 
 class RoomRemoved(ServerMessage):
     """ Server code: 63 """
     """ The server tells us a room has been removed. """
     """ OBSOLETE, no longer sent by the server """
 
+    __slots__ = ("room",)
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
     def __init__(self):
         self.room = None
 
-    def parse_network_message(self, message):
-        _pos, self.room = self.unpack_string(message)
-
 
 class RoomList(ServerMessage):
     """ Server code: 64 """
@@ -1197,6 +1363,8 @@ class RoomList(ServerMessage):
     nicotine and The Lobby. Requesting the room list yields a response
     containing the missing rooms. """
 
+    __slots__ = ("rooms", "ownedprivaterooms", "otherprivaterooms")
+
     def __init__(self):
         self.rooms = []
         self.ownedprivaterooms = []
@@ -1251,6 +1419,25 @@ class ExactFileSearch(ServerMessage):
     to find other sources. """
     """ OBSOLETE, no results even with official client """
 
+    __slots__ = ("token", "file", "folder", "size", "checksum", "user")
+
+    MAKE_SCHEMA = (
+        ("token", FieldType.UINT32),
+        ("file", FieldType.STRING),
+        ("folder", FieldType.STRING),
+        ("size", FieldType.UINT64),
+        ("checksum", FieldType.UINT32)
+    )
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32),
+        ("file", FieldType.STRING),
+        ("folder", FieldType.STRING),
+        ("size", FieldType.UINT64),
+        ("checksum", FieldType.UINT32)
+    )
+
     def __init__(self, token=None, file=None, folder=None, size=None, checksum=None):
         self.token = token
         self.file = file
@@ -1259,34 +1446,19 @@ class ExactFileSearch(ServerMessage):
         self.checksum = checksum
         self.user = None
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_uint32(self.token))
-        msg.extend(self.pack_string(self.file))
-        msg.extend(self.pack_string(self.folder))
-        msg.extend(self.pack_uint64(self.size))
-        msg.extend(self.pack_uint32(self.checksum))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.token = self.unpack_uint32(message, pos)
-        pos, self.file = self.unpack_string(message, pos)
-        pos, self.folder = self.unpack_string(message, pos)
-        pos, self.size = self.unpack_uint64(message, pos)
-        pos, self.checksum = self.unpack_uint32(message, pos)
-
 
 class AdminMessage(ServerMessage):
     """ Server code: 66 """
     """ A global message from the server admin has arrived. """
 
-    def __init__(self):
-        self.msg = None
+    __slots__ = ("msg",)
 
-    def parse_network_message(self, message):
-        _pos, self.msg = self.unpack_string(message)
+    PARSE_SCHEMA = (
+        ("msg", FieldType.STRING),
+    )
+
+    def __init__(self):
+        self.msg = None
 
 
 class GlobalUserList(ServerMessage):
@@ -1294,6 +1466,8 @@ class GlobalUserList(ServerMessage):
     """ We send this to get a global list of all users online. """
     """ OBSOLETE, no longer used """
 
+    __slots__ = ("users",)
+
     def __init__(self):
         self.users = None
 
@@ -1339,6 +1513,15 @@ class TunneledMessage(ServerMessage):
     """ Server message for tunneling a chat message. """
     """ OBSOLETE, no longer used """
 
+    __slots__ = ("user", "token", "code", "msg", "addr")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32),
+        ("code", FieldType.UINT32),
+        ("msg", FieldType.STRING)
+    )
+
     def __init__(self, user=None, token=None, code=None, msg=None):
         self.user = user
         self.token = token
@@ -1346,15 +1529,6 @@ class TunneledMessage(ServerMessage):
         self.msg = msg
         self.addr = None
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.user))
-        msg.extend(self.pack_uint32(self.token))
-        msg.extend(self.pack_uint32(self.code))
-        msg.extend(self.pack_string(self.msg))
-
-        return msg
-
     def parse_network_message(self, message):
         pos, self.user = self.unpack_string(message)
         pos, self.code = self.unpack_uint32(message, pos)
@@ -1372,6 +1546,8 @@ class PrivilegedUsers(ServerMessage):
     """ The server sends us a list of privileged users, a.k.a. users who
     have donated. """
 
+    __slots__ = ("users",)
+
     def __init__(self):
         self.users = []
 
@@ -1390,18 +1566,23 @@ class HaveNoParent(ServerMessage):
     If not, the server eventually sends us a PossibleParents message with a
     list of 10 possible parents to connect to. """
 
+    __slots__ = ("noparent",)
+
+    MAKE_SCHEMA = (
+        ("noparent", FieldType.BOOL),
+    )
+
     def __init__(self, noparent=None):
         self.noparent = noparent
 
-    def make_network_message(self):
-        return self.pack_bool(self.noparent)
-
 
 class SearchParent(ServerMessage):
     """ Server code: 73 """
     """ We send the IP address of our parent to the server. """
     """ DEPRECATED, sent by Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("parentip",)
+
     def __init__(self, parentip=None):
         self.parentip = parentip
 
@@ -1420,12 +1601,15 @@ class ParentMinSpeed(ServerMessage):
     """ The server informs us about the minimum upload speed required to become
     a parent in the distributed network. """
 
+    __slots__ = ("speed",)
+
+    PARSE_SCHEMA = (
+        ("speed", FieldType.UINT32),
+    )
+
     def __init__(self):
         self.speed = None
 
-    def parse_network_message(self, message):
-        _pos, self.speed = self.unpack_uint32(message)
-
 
 class ParentSpeedRatio(ServerMessage):
     """ Server code: 84 """
@@ -1433,56 +1617,71 @@ class ParentSpeedRatio(ServerMessage):
     can have in the distributed network. The maximum number of children is our
     upload speed divided by the speed ratio. """
 
+    __slots__ = ("ratio",)
+
+    PARSE_SCHEMA = (
+        ("ratio", FieldType.UINT32),
+    )
+
     def __init__(self):
         self.ratio = None
 
-    def parse_network_message(self, message):
-        _pos, self.ratio = self.unpack_uint32(message)
-
 
 class ParentInactivityTimeout(ServerMessage):
     """ Server code: 86 """
     """ OBSOLETE, no longer sent by the server """
 
+    __slots__ = ("seconds",)
+
+    PARSE_SCHEMA = (
+        ("seconds", FieldType.UINT32),
+    )
+
     def __init__(self):
         self.seconds = None
 
-    def parse_network_message(self, message):
-        _pos, self.seconds = self.unpack_uint32(message)
-
 
 class SearchInactivityTimeout(ServerMessage):
     """ Server code: 87 """
     """ OBSOLETE, no longer sent by the server """
 
+    __slots__ = ("seconds",)
+
+    PARSE_SCHEMA = (
+        ("seconds", FieldType.UINT32),
+    )
+
     def __init__(self):
         self.seconds = None
 
-    def parse_network_message(self, message):
-        _pos, self.seconds = self.unpack_uint32(message)
-
 
 class MinParentsInCache(ServerMessage):
     """ Server code: 88 """
     """ OBSOLETE, no longer sent by the server """
 
+    __slots__ = ("num",)
+
+    PARSE_SCHEMA = (
+        ("num", FieldType.UINT32),
+    )
+
     def __init__(self):
         self.num = None
 
-    def parse_network_message(self, message):
-        _pos, self.num = self.unpack_uint32(message)
-
 
 class DistribAliveInterval(ServerMessage):
     """ Server code: 90 """
     """ OBSOLETE, no longer sent by the server """
 
+    __slots__ = ("seconds",)
+
+    PARSE_SCHEMA = (
+        ("seconds", FieldType.UINT32),
+    )
+
     def __init__(self):
         self.seconds = None
 
-    def parse_network_message(self, message):
-        _pos, self.seconds = self.unpack_uint32(message)
-
 
 class AddToPrivileged(ServerMessage):
     """ Server code: 91 """
@@ -1490,27 +1689,33 @@ class AddToPrivileged(ServerMessage):
     add to our list of global privileged users. """
     """ OBSOLETE, no longer sent by the server """
 
+    __slots__ = ("user",)
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
     def __init__(self):
         self.user = None
 
-    def parse_network_message(self, message):
-        _pos, self.user = self.unpack_string(message)
-
 
 class CheckPrivileges(ServerMessage):
     """ Server code: 92 """
     """ We ask the server how much time we have left of our privileges.
     The server responds with the remaining time, in seconds. """
 
+    __slots__ = ("seconds",)
+
+    PARSE_SCHEMA = (
+        ("seconds", FieldType.UINT32),
+    )
+
     def __init__(self):
         self.seconds = None
 
     def make_network_message(self):
         return b""
 
-    def parse_network_message(self, message):
-        _pos, self.seconds = self.unpack_uint32(message)
-
 
 class EmbeddedMessage(ServerMessage):
     """ Server code: 93 """
@@ -1528,19 +1733,22 @@ class EmbeddedMessage(ServerMessage):
 
     def parse_network_message(self, message):
         pos, self.distrib_code = self.unpack_uint8(message)
-        self.distrib_message = message[pos:]
+        self.distrib_message = bytes(message[pos:])
 
 
 class AcceptChildren(ServerMessage):
     """ Server code: 100 """
     """ We tell the server if we want to accept child nodes. """
 
+    __slots__ = ("enabled",)
+
+    MAKE_SCHEMA = (
+        ("enabled", FieldType.BOOL),
+    )
+
     def __init__(self, enabled=None):
         self.enabled = enabled
 
-    def make_network_message(self):
-        return self.pack_bool(self.enabled)
-
 
 class PossibleParents(ServerMessage):
     """ Server code: 102 """
@@ -1548,6 +1756,8 @@ class PossibleParents(ServerMessage):
     This message is sent to us at regular intervals until we tell the server we don't
     need more possible parents, through a HaveNoParent message. """
 
+    __slots__ = ("list",)
+
     def __init__(self):
         self.list = {}
 
@@ -1566,23 +1776,30 @@ class WishlistSearch(FileSearch):
     """ Server code: 103 """
     """ We send the server one of our wishlist search queries at each interval. """
 
+    __slots__ = ()
+
 
 class WishlistInterval(ServerMessage):
     """ Server code: 104 """
     """ The server tells us the wishlist search interval. """
 
+    __slots__ = ("seconds",)
+
+    PARSE_SCHEMA = (
+        ("seconds", FieldType.UINT32),
+    )
+
     def __init__(self):
         self.seconds = None
 
-    def parse_network_message(self, message):
-        _pos, self.seconds = self.unpack_uint32(message)
-
 
 class SimilarUsers(ServerMessage):
     """ Server code: 110 """
     """ The server sends us a list of similar users related to our interests. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("users",)
+
     def __init__(self):
         self.users = {}
 
@@ -1606,13 +1823,16 @@ class ItemRecommendations(Recommendations):
     recommendation list. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("thing",)
+
+    MAKE_SCHEMA = (
+        ("thing", FieldType.STRING),
+    )
+
     def __init__(self, thing=None):
         super().__init__()
         self.thing = thing
 
-    def make_network_message(self):
-        return self.pack_string(self.thing)
-
     def parse_network_message(self, message):
         pos, self.thing = self.unpack_string(message)
         self.parse_recommendations(message, pos)
@@ -1624,13 +1844,16 @@ class ItemSimilarUsers(ServerMessage):
     which is usually present in the like/dislike list or recommendation list. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("thing", "users")
+
+    MAKE_SCHEMA = (
+        ("thing", FieldType.STRING),
+    )
+
     def __init__(self, thing=None):
         self.thing = thing
         self.users = []
 
-    def make_network_message(self):
-        return self.pack_string(self.thing)
-
     def parse_network_message(self, message):
         pos, self.thing = self.unpack_string(message)
         pos, num = self.unpack_uint32(message, pos)
@@ -1647,6 +1870,8 @@ class RoomTickerState(ServerMessage):
     Tickers are customizable, user-specific messages that appear on
     chat room walls. """
 
+    __slots__ = ("room", "user", "msgs")
+
     def __init__(self):
         self.room = None
         self.user = None
@@ -1670,16 +1895,19 @@ class RoomTickerAdd(ServerMessage):
     Tickers are customizable, user-specific messages that appear on
     chat room walls. """
 
+    __slots__ = ("room", "user", "msg")
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+        ("user", FieldType.STRING),
+        ("msg", FieldType.STRING)
+    )
+
     def __init__(self):
         self.room = None
         self.user = None
         self.msg = None
 
-    def parse_network_message(self, message):
-        pos, self.room = self.unpack_string(message)
-        pos, self.user = self.unpack_string(message, pos)
-        pos, self.msg = self.unpack_string(message, pos)
-
 
 class RoomTickerRemove(ServerMessage):
     """ Server code: 115 """
@@ -1688,14 +1916,17 @@ class RoomTickerRemove(ServerMessage):
     Tickers are customizable, user-specific messages that appear on
     chat room walls. """
 
+    __slots__ = ("room", "user")
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+        ("user", FieldType.STRING)
+    )
+
     def __init__(self):
         self.room = None
         self.user = None
 
-    def parse_network_message(self, message):
-        pos, self.room = self.unpack_string(message)
-        pos, self.user = self.unpack_string(message, pos)
-
 
 class RoomTickerSet(ServerMessage):
     """ Server code: 116 """
@@ -1706,29 +1937,33 @@ class RoomTickerSet(ServerMessage):
     Tickers are customizable, user-specific messages that appear on
     chat room walls. """
 
+    __slots__ = ("room", "msg")
+
+    MAKE_SCHEMA = (
+        ("room", FieldType.STRING),
+        ("msg", FieldType.STRING)
+    )
+
     def __init__(self, room=None, msg=""):
         self.room = room
         self.msg = msg
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.room))
-        msg.extend(self.pack_string(self.msg))
-
-        return msg
-
 
 class AddThingIHate(AddThingILike):
     """ Server code: 117 """
     """ We send this to the server when we add an item to our hate list. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ()
+
 
 class RemoveThingIHate(RemoveThingILike):
     """ Server code: 118 """
     """ We send this to the server when we remove an item from our hate list. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ()
+
 
 class RoomSearch(ServerMessage):
     """ Server code: 120 """
@@ -1736,6 +1971,14 @@ class RoomSearch(ServerMessage):
     joined a specific chat room. The token is a number generated by the client
     and is used to track the search results. """
 
+    __slots__ = ("room", "token", "searchterm", "user")
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32),
+        ("searchterm", FieldType.STRING)
+    )
+
     def __init__(self, room=None, token=None, text=""):
         self.room = room
         self.token = token
@@ -1751,10 +1994,6 @@ class RoomSearch(ServerMessage):
         return msg
 
     # Soulfind support, the official server sends a FileSearch message (code 26) instead
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.token = self.unpack_uint32(message, pos)
-        pos, self.searchterm = self.unpack_string(message, pos)
 
 
 class SendUploadSpeed(ServerMessage):
@@ -1762,79 +2001,91 @@ class SendUploadSpeed(ServerMessage):
     """ We send this after a finished upload to let the server update the speed
     statistics for ourselves. """
 
+    __slots__ = ("speed",)
+
+    MAKE_SCHEMA = (
+        ("speed", FieldType.UINT32),
+    )
+
     def __init__(self, speed=None):
         self.speed = speed
 
-    def make_network_message(self):
-        return self.pack_uint32(self.speed)
-
 
 class UserPrivileged(ServerMessage):
     """ Server code: 122 """
     """ We ask the server whether a user is privileged or not. """
     """ DEPRECATED, use AddUser and GetUserStatus server messages """
 
+    __slots__ = ("user", "privileged")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("privileged", FieldType.BOOL)
+    )
+
     def __init__(self, user=None):
         self.user = user
         self.privileged = None
 
-    def make_network_message(self):
-        return self.pack_string(self.user)
-
-    def parse_network_message(self, message):
-        pos, self.user = self.unpack_string(message)
-        pos, self.privileged = self.unpack_bool(message, pos)
-
 
 class GivePrivileges(ServerMessage):
     """ Server code: 123 """
     """ We give (part of) our privileges, specified in days, to another
     user on the network. """
 
+    __slots__ = ("user", "days")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+        ("days", FieldType.UINT32)
+    )
+
     def __init__(self, user=None, days=None):
         self.user = user
         self.days = days
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.user))
-        msg.extend(self.pack_uint32(self.days))
-
-        return msg
-
 
 class NotifyPrivileges(ServerMessage):
     """ Server code: 124 """
     """ DEPRECATED, sent by Soulseek NS but not SoulseekQt """
 
-    def __init__(self, token=None, user=None):
-        self.token = token
-        self.user = user
+    __slots__ = ("token", "user")
 
-    def parse_network_message(self, message):
-        pos, self.token = self.unpack_uint32(message)
-        pos, self.user = self.unpack_string(message, pos)
+    MAKE_SCHEMA = (
+        ("token", FieldType.UINT32),
+        ("user", FieldType.STRING)
+    )
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_uint32(self.token))
-        msg.extend(self.pack_string(self.user))
+    PARSE_SCHEMA = (
+        ("token", FieldType.UINT32),
+        ("user", FieldType.STRING)
+    )
 
-        return msg
+    def __init__(self, token=None, user=None):
+        self.token = token
+        self.user = user
 
 
 class AckNotifyPrivileges(ServerMessage):
     """ Server code: 125 """
     """ DEPRECATED, no longer used """
 
-    def __init__(self, token=None):
-        self.token = token
+    __slots__ = ("token",)
 
-    def parse_network_message(self, message):
-        _pos, self.token = self.unpack_uint32(message)
+    MAKE_SCHEMA = (
+        ("token", FieldType.UINT32),
+    )
 
-    def make_network_message(self):
-        return self.pack_uint32(self.token)
+    PARSE_SCHEMA = (
+        ("token", FieldType.UINT32),
+    )
+
+    def __init__(self, token=None):
+        self.token = token
 
 
 class BranchLevel(ServerMessage):
@@ -1842,24 +2093,30 @@ class BranchLevel(ServerMessage):
     """ We tell the server what our position is in our branch (xth generation)
     on the distributed network. """
 
+    __slots__ = ("value",)
+
+    MAKE_SCHEMA = (
+        ("value", FieldType.UINT32),
+    )
+
     def __init__(self, value=None):
         self.value = value
 
-    def make_network_message(self):
-        return self.pack_uint32(self.value)
-
 
 class BranchRoot(ServerMessage):
     """ Server code: 127 """
     """ We tell the server the username of the root of the branch we’re in on
     the distributed network. """
 
+    __slots__ = ("user",)
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
     def __init__(self, user=None):
         self.user = user
 
-    def make_network_message(self):
-        return self.pack_string(self.user)
-
 
 class ChildDepth(ServerMessage):
     """ Server code: 129 """
@@ -1867,17 +2124,22 @@ class ChildDepth(ServerMessage):
     have on the distributed network. """
     """ DEPRECATED, sent by Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("value",)
+
+    MAKE_SCHEMA = (
+        ("value", FieldType.UINT32),
+    )
+
     def __init__(self, value=None):
         self.value = value
 
-    def make_network_message(self):
-        return self.pack_uint32(self.value)
-
 
 class ResetDistributed(ServerMessage):
     """ Server code: 130 """
     """ The server asks us to reset our distributed parent and children. """
 
+    __slots__ = ()
+
     def parse_network_message(self, message):
         # Empty message
         pass
@@ -1888,6 +2150,8 @@ class PrivateRoomUsers(ServerMessage):
     """ The server sends us a list of room users that we can alter
     (add operator abilities / dismember). """
 
+    __slots__ = ("room", "numusers", "users")
+
     def __init__(self):
         self.room = None
         self.numusers = None
@@ -1907,92 +2171,114 @@ class PrivateRoomAddUser(ServerMessage):
     """ Server code: 134 """
     """ We send this to inform the server that we've added a user to a private room. """
 
-    def __init__(self, room=None, user=None):
-        self.room = room
-        self.user = user
+    __slots__ = ("room", "user")
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.room))
-        msg.extend(self.pack_string(self.user))
+    MAKE_SCHEMA = (
+        ("room", FieldType.STRING),
+        ("user", FieldType.STRING)
+    )
 
-        return msg
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+        ("user", FieldType.STRING)
+    )
 
-    def parse_network_message(self, message):
-        pos, self.room = self.unpack_string(message)
-        pos, self.user = self.unpack_string(message, pos)
+    def __init__(self, room=None, user=None):
+        self.room = room
+        self.user = user
 
 
 class PrivateRoomRemoveUser(PrivateRoomAddUser):
     """ Server code: 135 """
     """ We send this to inform the server that we've removed a user from a private room. """
 
+    __slots__ = ()
+
 
 class PrivateRoomDismember(ServerMessage):
     """ Server code: 136 """
     """ We send this to the server to remove our own membership of a private room. """
 
+    __slots__ = ("room",)
+
+    MAKE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_string(self.room)
-
 
 class PrivateRoomDisown(ServerMessage):
     """ Server code: 137 """
     """ We send this to the server to stop owning a private room. """
 
+    __slots__ = ("room",)
+
+    MAKE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
     def __init__(self, room=None):
         self.room = room
 
-    def make_network_message(self):
-        return self.pack_string(self.room)
-
 
 class PrivateRoomSomething(ServerMessage):
     """ Server code: 138 """
     """ OBSOLETE, no longer used """
 
-    def __init__(self, room=None):
-        self.room = room
+    __slots__ = ("room",)
 
-    def make_network_message(self):
-        return self.pack_string(self.room)
+    MAKE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
 
-    def parse_network_message(self, message):
-        _pos, self.room = self.unpack_string(message)
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
+    def __init__(self, room=None):
+        self.room = room
 
 
 class PrivateRoomAdded(ServerMessage):
     """ Server code: 139 """
     """ The server sends us this message when we are added to a private room. """
 
+    __slots__ = ("room",)
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
     def __init__(self, room=None):
         self.room = room
 
-    def parse_network_message(self, message):
-        _pos, self.room = self.unpack_string(message)
-
 
 class PrivateRoomRemoved(PrivateRoomAdded):
     """ Server code: 140 """
     """ The server sends us this message when we are removed from a private room. """
 
+    __slots__ = ()
+
 
 class PrivateRoomToggle(ServerMessage):
     """ Server code: 141 """
     """ We send this when we want to enable or disable invitations to private rooms. """
 
-    def __init__(self, enabled=None):
-        self.enabled = enabled
+    __slots__ = ("enabled",)
 
-    def make_network_message(self):
-        return self.pack_bool(self.enabled)
+    MAKE_SCHEMA = (
+        ("enabled", FieldType.BOOL),
+    )
 
-    def parse_network_message(self, message):
+    PARSE_SCHEMA = (
         # When this is received, we store it in the config, and disable the appropriate menu item
-        _pos, self.enabled = self.unpack_bool(message)
+        ("enabled", FieldType.BOOL),
+    )
+
+    def __init__(self, enabled=None):
+        self.enabled = enabled
 
 
 class ChangePassword(ServerMessage):
@@ -2000,51 +2286,66 @@ class ChangePassword(ServerMessage):
     """ We send this to the server to change our password. We receive a
     response if our password changes. """
 
-    def __init__(self, password=None):
-        self.password = password
+    __slots__ = ("password",)
 
-    def make_network_message(self):
-        return self.pack_string(self.password)
+    MAKE_SCHEMA = (
+        ("password", FieldType.STRING),
+    )
 
-    def parse_network_message(self, message):
-        _pos, self.password = self.unpack_string(message)
+    PARSE_SCHEMA = (
+        ("password", FieldType.STRING),
+    )
+
+    def __init__(self, password=None):
+        self.password = password
 
 
 class PrivateRoomAddOperator(PrivateRoomAddUser):
     """ Server code: 143 """
     """ We send this to the server to add private room operator abilities to a user. """
 
+    __slots__ = ()
+
 
 class PrivateRoomRemoveOperator(PrivateRoomAddUser):
     """ Server code: 144 """
     """ We send this to the server to remove private room operator abilities from a user. """
 
+    __slots__ = ()
+
 
 class PrivateRoomOperatorAdded(ServerMessage):
     """ Server code: 145 """
     """ The server send us this message when we're given operator abilities
     in a private room. """
 
+    __slots__ = ("room",)
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
     def __init__(self, room=None):
         self.room = room
 
-    def parse_network_message(self, message):
-        _pos, self.room = self.unpack_string(message)
-
 
 class PrivateRoomOperatorRemoved(ServerMessage):
     """ Server code: 146 """
     """ The server send us this message when our operator abilities are removed
     in a private room. """
 
-    def __init__(self, room=None):
-        self.room = room
+    __slots__ = ("room",)
 
-    def make_network_message(self):
-        return self.pack_string(self.room)
+    MAKE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
 
-    def parse_network_message(self, message):
-        _pos, self.room = self.unpack_string(message)
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
+    def __init__(self, room=None):
+        self.room = room
 
 
 class PrivateRoomOwned(ServerMessage):
@@ -2052,6 +2353,8 @@ class PrivateRoomOwned(ServerMessage):
     """ The server sends us a list of operators in a specific room, that we can
     remove operator abilities from. """
 
+    __slots__ = ("room", "number", "operators")
+
     def __init__(self):
         self.room = None
         self.number = None
@@ -2071,6 +2374,8 @@ class MessageUsers(ServerMessage):
     """ Server code: 149 """
     """ Sends a broadcast private message to the given list of users. """
 
+    __slots__ = ("users", "msg")
+
     def __init__(self, users=None, msg=None):
         self.users = users
         self.msg = msg
@@ -2091,6 +2396,8 @@ class JoinPublicRoom(ServerMessage):
     known as public room feed. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ()
+
     def make_network_message(self):
         return b""
 
@@ -2101,6 +2408,8 @@ class LeavePublicRoom(ServerMessage):
     also known as public room feed. """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ()
+
     def make_network_message(self):
         return b""
 
@@ -2111,29 +2420,35 @@ class PublicRoomMessage(ServerMessage):
     room feed (every single line written in every public room). """
     """ DEPRECATED, used in Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("room", "user", "msg")
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+        ("user", FieldType.STRING),
+        ("msg", FieldType.STRING)
+    )
+
     def __init__(self):
         self.room = None
         self.user = None
         self.msg = None
 
-    def parse_network_message(self, message):
-        pos, self.room = self.unpack_string(message)
-        pos, self.user = self.unpack_string(message, pos)
-        pos, self.msg = self.unpack_string(message, pos)
-
 
 class RelatedSearch(ServerMessage):
     """ Server code: 153 """
     """ The server returns a list of related search terms for a search query. """
     """ OBSOLETE, server sends empty list as of 2018 """
 
+    __slots__ = ("query", "terms")
+
+    MAKE_SCHEMA = (
+        ("query", FieldType.STRING),
+    )
+
     def __init__(self, query=None):
         self.query = query
         self.terms = []
 
-    def make_network_message(self):
-        return self.pack_string(self.query)
-
     def parse_network_message(self, message):
         pos, self.query = self.unpack_string(message)
         pos, num = self.unpack_uint32(message, pos)
@@ -2151,19 +2466,20 @@ class CantConnectToPeer(ServerMessage):
     to connect. We receive this if we asked peer to connect and it can't do
     this. This message means a connection can't be established either way. """
 
-    def __init__(self, token=None, user=None):
-        self.token = token
-        self.user = user
+    __slots__ = ("token", "user")
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_uint32(self.token))
-        msg.extend(self.pack_string(self.user))
+    MAKE_SCHEMA = (
+        ("token", FieldType.UINT32),
+        ("user", FieldType.STRING)
+    )
 
-        return msg
+    PARSE_SCHEMA = (
+        ("token", FieldType.UINT32),
+    )
 
-    def parse_network_message(self, message):
-        _pos, self.token = self.unpack_uint32(message)
+    def __init__(self, token=None, user=None):
+        self.token = token
+        self.user = user
 
 
 class CantCreateRoom(ServerMessage):
@@ -2173,12 +2489,15 @@ class CantCreateRoom(ServerMessage):
     private room. In other cases, such as using a room name with leading or
     trailing spaces, only a private message containing an error message is sent. """
 
+    __slots__ = ("room",)
+
+    PARSE_SCHEMA = (
+        ("room", FieldType.STRING),
+    )
+
     def __init__(self):
         self.room = None
 
-    def parse_network_message(self, message):
-        _pos, self.room = self.unpack_string(message)
-
 
 """
 Peer Init Messages
@@ -2186,6 +2505,9 @@ Peer Init Messages
 
 
 class PeerInitMessage(SlskMessage):
+
+    __slots__ = ()
+
     msgtype = MessageType.INIT
 
 
@@ -2195,13 +2517,16 @@ class PierceFireWall(PeerInitMessage):
     from another user. If the message goes through to the user, the connection
     is ready. The token is taken from the ConnectToPeer server message. """
 
+    __slots__ = ("sock", "token")
+
+    MAKE_SCHEMA = (
+        ("token", FieldType.UINT32),
+    )
+
     def __init__(self, sock=None, token=None):
         self.sock = sock
         self.token = token
 
-    def make_network_message(self):
-        return self.pack_uint32(self.token)
-
     def parse_network_message(self, message):
         if message:
             # A token is not guaranteed to be sent (buggy client?)
@@ -2216,7 +2541,13 @@ class PeerInit(PeerInitMessage):
     Nicotine+ extends the PeerInit class to reuse and keep track of peer
     connections internally. """
 
-    __slots__ = ("sock", "addr", "init_user", "target_user", "conn_type", "indirect", "token")
+    __slots__ = ("sock", "addr", "init_user", "target_user", "conn_type", "indirect", "token", "outgoing_msgs")
+
+    MAKE_SCHEMA = (
+        ("init_user", FieldType.STRING),
+        ("conn_type", FieldType.STRING),
+        ("token", FieldType.UINT32)
+    )
 
     def __init__(self, sock=None, addr=None, init_user=None, target_user=None, conn_type=None, indirect=False, token=0):
         self.sock = sock
@@ -2228,14 +2559,6 @@ class PeerInit(PeerInitMessage):
         self.token = token
         self.outgoing_msgs = []
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.init_user))
-        msg.extend(self.pack_string(self.conn_type))
-        msg.extend(self.pack_uint32(self.token))
-
-        return msg
-
     def parse_network_message(self, message):
         pos, self.init_user = self.unpack_string(message)
         pos, self.conn_type = self.unpack_string(message, pos)
@@ -2252,6 +2575,8 @@ Peer Messages
 
 class PeerMessage(SlskMessage):
 
+    __slots__ = ()
+
     msgtype = MessageType.PEER
 
     def parse_file_size(self, message, pos):
@@ -2276,6 +2601,8 @@ class GetSharedFileList(PeerMessage):
     """ Peer code: 4 """
     """ We send this to a peer to ask for a list of shared files. """
 
+    __slots__ = ("init",)
+
     def __init__(self, init=None):
         self.init = init
 
@@ -2292,6 +2619,8 @@ class SharedFileList(PeerMessage):
     """ A peer responds with a list of shared files when we've sent
     a GetSharedFileList. """
 
+    __slots__ = ("init", "list", "unknown", "privatelist", "built", "type")
+
     def __init__(self, init=None, shares=None):
         self.init = init
         self.list = shares
@@ -2341,35 +2670,39 @@ class SharedFileList(PeerMessage):
         message = memoryview(zlib.decompress(message))
         self._parse_network_message(message)
 
-    def _parse_result_list(self, message, pos=0):
-        pos, ndir = self.unpack_uint32(message, pos)
+    def _parse_directory(self, message, pos):
+        pos, directory = self.unpack_string(message, pos)
+        directory = directory.replace('/', '\\')
+        pos, nfiles = self.unpack_uint32(message, pos)
 
-        shares = []
-        for _ in range(ndir):
-            pos, directory = self.unpack_string(message, pos)
-            directory = directory.replace('/', '\\')
-            pos, nfiles = self.unpack_uint32(message, pos)
+        files = []
 
-            files = []
+        for _ in range(nfiles):
+            pos, code = self.unpack_uint8(message, pos)
+            pos, name = self.unpack_string(message, pos)
+            pos, size = self.parse_file_size(message, pos)
+            pos, ext = self.unpack_string(message, pos)
+            pos, numattr = self.unpack_uint32(message, pos)
 
-            for _ in range(nfiles):
-                pos, code = self.unpack_uint8(message, pos)
-                pos, name = self.unpack_string(message, pos)
-                pos, size = self.parse_file_size(message, pos)
-                pos, ext = self.unpack_string(message, pos)
-                pos, numattr = self.unpack_uint32(message, pos)
+            attrs = {}
 
-                attrs = {}
+            for _ in range(numattr):
+                pos, attrnum = self.unpack_uint32(message, pos)
+                pos, attr = self.unpack_uint32(message, pos)
+                attrs[str(attrnum)] = attr
 
-                for _ in range(numattr):
-                    pos, attrnum = self.unpack_uint32(message, pos)
-                    pos, attr = self.unpack_uint32(message, pos)
-                    attrs[str(attrnum)] = attr
+            files.append((code, name, size, ext, attrs))
 
-                files.append((code, name, size, ext, attrs))
+        files.sort(key=itemgetter(1))
+        return pos, (directory, files)
 
-            files.sort(key=itemgetter(1))
-            shares.append((directory, files))
+    def _parse_result_list(self, message, pos=0):
+        pos, ndir = self.unpack_uint32(message, pos)
+
+        shares = []
+        for _ in range(ndir):
+            pos, directory = self._parse_directory(message, pos)
+            shares.append(directory)
 
         shares.sort(key=itemgetter(0))
         return pos, shares
@@ -2384,6 +2717,121 @@ class SharedFileList(PeerMessage):
             pos, self.privatelist = self._parse_result_list(message, pos)
 
 
+class SharedFileListParser:
+    """ Decompresses and parses a SharedFileList message of a known size while its data
+    arrives, instead of waiting for the complete message. Directories are available as
+    soon as all their data is received, and only the unparsed remainder of the
+    decompressed data is kept in memory. """
+
+    __slots__ = ("msg", "total", "remaining", "failed", "_decompressor", "_buffer", "_min_buffer_len",
+                 "_state", "_num_dirs")
+
+    STATE_PUBLIC_COUNT = 0
+    STATE_PUBLIC_DIRS = 1
+    STATE_UNKNOWN = 2
+    STATE_PRIVATE_COUNT = 3
+    STATE_PRIVATE_DIRS = 4
+    STATE_DONE = 5
+
+    def __init__(self, init=None, size=0):
+
+        self.msg = SharedFileList(init)
+        self.msg.list = []
+        self.total = self.remaining = size
+        self.failed = False
+
+        self._decompressor = zlib.decompressobj()
+        self._buffer = bytearray()
+        self._min_buffer_len = 0
+        self._state = self.STATE_PUBLIC_COUNT
+        self._num_dirs = 0
+
+    def feed(self, data):
+        """ Decompress and parse the next part of the message. Returns lists of the
+        public and private directories that were completed. """
+
+        self.remaining -= len(data)
+        self._buffer += self._decompressor.decompress(data)
+
+        if len(self._buffer) < self._min_buffer_len:
+            # A large directory is still incomplete, avoid parsing it over and over again
+            return [], []
+
+        return self._parse()
+
+    def finish(self):
+        """ Parse the rest of the data once the whole message is received, and return
+        the complete SharedFileList message """
+
+        self._buffer += self._decompressor.flush()
+        self._parse()
+
+        if self._state in (self.STATE_PUBLIC_COUNT, self.STATE_PUBLIC_DIRS, self.STATE_PRIVATE_DIRS) \
+                or (self._buffer and self._state != self.STATE_DONE):
+            raise ValueError("Incomplete message, %i bytes left unparsed" % len(self._buffer))
+
+        self.msg.list.sort(key=itemgetter(0))
+        self.msg.privatelist.sort(key=itemgetter(0))
+
+        return self.msg
+
+    def _parse(self):
+
+        msg = self.msg
+        message = memoryview(self._buffer)
+        message_len = len(message)
+        public_dirs = []
+        private_dirs = []
+        pos = 0
+        self._min_buffer_len = 0
+
+        while True:
+            state = self._state
+            start_pos = pos
+
+            try:
+                if state in (self.STATE_PUBLIC_COUNT, self.STATE_PRIVATE_COUNT):
+                    pos, self._num_dirs = msg.unpack_uint32(message, pos)
+
+                elif state == self.STATE_UNKNOWN:
+                    pos, msg.unknown = msg.unpack_uint32(message, pos)
+
+                elif self._num_dirs and state in (self.STATE_PUBLIC_DIRS, self.STATE_PRIVATE_DIRS):
+                    # Truncated strings don't raise an error, but leave pos past the end of the data
+                    pos, directory = msg._parse_directory(message, pos)  # pylint: disable=protected-access
+
+                    if pos > message_len:
+                        raise IndexError
+
+                    self._num_dirs -= 1
+
+                    if state == self.STATE_PUBLIC_DIRS:
+                        public_dirs.append(directory)
+                    else:
+                        private_dirs.append(directory)
+
+                    continue
+
+                elif state == self.STATE_DONE:
+                    break
+
+            except (IndexError, struct.error):
+                # Wait for more data
+                pos = start_pos
+                self._min_buffer_len = 2 * (message_len - pos)
+                break
+
+            self._state += 1
+
+        message.release()
+        del self._buffer[:pos]
+
+        msg.list.extend(public_dirs)
+        msg.privatelist.extend(private_dirs)
+
+        return public_dirs, private_dirs
+
+
 class FileSearchRequest(PeerMessage):
     """ Peer code: 8 """
     """ We send this to the peer when we search for a file.
@@ -2391,6 +2839,18 @@ class FileSearchRequest(PeerMessage):
     searching for a file. """
     """ OBSOLETE, use UserSearch server message """
 
+    __slots__ = ("init", "token", "text", "searchterm")
+
+    MAKE_SCHEMA = (
+        ("token", FieldType.UINT32),
+        ("text", FieldType.STRING)
+    )
+
+    PARSE_SCHEMA = (
+        ("token", FieldType.UINT32),
+        ("searchterm", FieldType.STRING)
+    )
+
     def __init__(self, init=None, token=None, text=None):
         self.init = init
         self.token = token
@@ -2398,25 +2858,14 @@ class FileSearchRequest(PeerMessage):
         self.token = None
         self.searchterm = None
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_uint32(self.token))
-        msg.extend(self.pack_string(self.text))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.token = self.unpack_uint32(message)
-        pos, self.searchterm = self.unpack_string(message, pos)
-
 
 class FileSearchResult(PeerMessage):
     """ Peer code: 9 """
     """ A peer sends this message when it has a file search match. The token is
     taken from original FileSearch, UserSearch or RoomSearch server message. """
 
-    __slots__ = ("init", "user", "token", "list", "privatelist", "freeulslots",
-                 "ulspeed", "inqueue", "fifoqueue")
+    __slots__ = ("init", "user", "token", "list", "privatelist", "freeulslots", "ulspeed", "inqueue", "fifoqueue",
+                 "unknown")
 
     def __init__(self, init=None, user=None, token=None, shares=None, freeulslots=None,
                  ulspeed=None, inqueue=None, fifoqueue=None):
@@ -2477,7 +2926,22 @@ class FileSearchResult(PeerMessage):
         return zlib.compress(msg)
 
     def parse_network_message(self, message):
-        message = memoryview(zlib.decompress(message))
+
+        # Only decompress the username and token at first. If results are no longer accepted
+        # for this search token, the rest of the message is left compressed and unparsed.
+        decompressor = zlib.decompressobj()
+        prefix = decompressor.decompress(message, 4)
+        _pos, username_len = self.unpack_uint32(prefix)
+        prefix += decompressor.decompress(decompressor.unconsumed_tail, username_len + 4)
+
+        pos, self.user = self.unpack_string(prefix)
+        pos, self.token = self.unpack_uint32(prefix, pos)
+
+        if self.token not in SEARCH_TOKENS_ALLOWED:
+            self.list = []
+            return
+
+        message = memoryview(prefix + decompressor.decompress(decompressor.unconsumed_tail) + decompressor.flush())
         self._parse_network_message(message)
 
     def _parse_result_list(self, message, pos):
@@ -2507,12 +2971,6 @@ class FileSearchResult(PeerMessage):
     def _parse_network_message(self, message):
         pos, self.user = self.unpack_string(message)
         pos, self.token = self.unpack_uint32(message, pos)
-
-#        if self.token not in SEARCH_TOKENS_ALLOWED:
-#            # Results are no longer accepted for this search token, stop parsing message
-#            self.list = []
-#            return
-
         pos, self.list = self._parse_result_list(message, pos)
 
         pos, self.freeulslots = self.unpack_bool(message, pos)
@@ -2530,6 +2988,8 @@ class UserInfoRequest(PeerMessage):
     """ Peer code: 15 """
     """ We ask the other peer to send us their user information, picture and all. """
 
+    __slots__ = ("init",)
+
     def __init__(self, init=None):
         self.init = init
 
@@ -2545,6 +3005,8 @@ class UserInfoReply(PeerMessage):
     """ Peer code: 16 """
     """ A peer responds with this after we've sent a UserInfoRequest. """
 
+    __slots__ = ("init", "descr", "pic", "totalupl", "queuesize", "slotsavail", "uploadallowed", "has_pic")
+
     def __init__(self, init=None, descr=None, pic=None, totalupl=None, queuesize=None,
                  slotsavail=None, uploadallowed=None):
         self.init = init
@@ -2596,6 +3058,15 @@ class PMessageUser(PeerMessage):
     This is a Nicotine+ extension to the Soulseek protocol. """
     """ DEPRECATED """
 
+    __slots__ = ("init", "user", "msg", "msgid", "timestamp")
+
+    PARSE_SCHEMA = (
+        ("msgid", FieldType.UINT32),
+        ("timestamp", FieldType.UINT32),
+        ("user", FieldType.STRING),
+        ("msg", FieldType.STRING)
+    )
+
     def __init__(self, init=None, user=None, msg=None):
         self.init = init
         self.user = user
@@ -2612,17 +3083,18 @@ class PMessageUser(PeerMessage):
 
         return msg
 
-    def parse_network_message(self, message):
-        pos, self.msgid = self.unpack_uint32(message)
-        pos, self.timestamp = self.unpack_uint32(message, pos)
-        pos, self.user = self.unpack_string(message, pos)
-        pos, self.msg = self.unpack_string(message, pos)
-
 
 class FolderContentsRequest(PeerMessage):
     """ Peer code: 36 """
     """ We ask the peer to send us the contents of a single folder. """
 
+    __slots__ = ("init", "dir", "token")
+
+    PARSE_SCHEMA = (
+        ("token", FieldType.UINT32),
+        ("dir", FieldType.STRING)
+    )
+
     def __init__(self, init=None, directory=None, token=None):
         self.init = init
         self.dir = directory
@@ -2635,16 +3107,14 @@ class FolderContentsRequest(PeerMessage):
 
         return msg
 
-    def parse_network_message(self, message):
-        pos, self.token = self.unpack_uint32(message)
-        pos, self.dir = self.unpack_string(message, pos)
-
 
 class FolderContentsResponse(PeerMessage):
     """ Peer code: 37 """
     """ A peer responds with the contents of a particular folder
     (with all subfolders) after we've sent a FolderContentsRequest. """
 
+    __slots__ = ("init", "dir", "token", "list")
+
     def __init__(self, init=None, directory=None, token=None, shares=None):
         self.init = init
         self.dir = directory
@@ -2716,6 +3186,8 @@ class TransferRequest(PeerMessage):
     but Nicotine+, Museek+ and the official clients use the QueueUpload message for
     this purpose today. """
 
+    __slots__ = ("init", "direction", "token", "file", "realfile", "filesize")
+
     def __init__(self, init=None, direction=None, token=None, file=None, filesize=None, realfile=None):
         self.init = init
         self.direction = direction
@@ -2749,6 +3221,8 @@ class TransferResponse(PeerMessage):
     """ Response to TransferRequest - We (or the other peer) either agrees,
     or tells the reason for rejecting the file transfer. """
 
+    __slots__ = ("init", "allowed", "token", "reason", "filesize")
+
     def __init__(self, init=None, allowed=None, reason=None, token=None, filesize=None):
         self.init = init
         self.allowed = allowed
@@ -2784,16 +3258,20 @@ class PlaceholdUpload(PeerMessage):
     """ Peer code: 42 """
     """ OBSOLETE, no longer used """
 
+    __slots__ = ("init", "file")
+
+    MAKE_SCHEMA = (
+        ("file", FieldType.STRING),
+    )
+
+    PARSE_SCHEMA = (
+        ("file", FieldType.STRING),
+    )
+
     def __init__(self, init=None, file=None):
         self.init = init
         self.file = file
 
-    def make_network_message(self):
-        return self.pack_string(self.file)
-
-    def parse_network_message(self, message):
-        _pos, self.file = self.unpack_string(message)
-
 
 class QueueUpload(PeerMessage):
     """ Peer code: 43 """
@@ -2801,6 +3279,12 @@ class QueueUpload(PeerMessage):
     their end. Once the recipient is ready to transfer the requested file, they
     will send a TransferRequest to us. """
 
+    __slots__ = ("init", "file", "legacy_client")
+
+    PARSE_SCHEMA = (
+        ("file", FieldType.STRING),
+    )
+
     def __init__(self, init=None, file=None, legacy_client=False):
         self.init = init
         self.file = file
@@ -2809,30 +3293,28 @@ class QueueUpload(PeerMessage):
     def make_network_message(self):
         return self.pack_string(self.file, latin1=self.legacy_client)
 
-    def parse_network_message(self, message):
-        _pos, self.file = self.unpack_string(message)
-
 
 class PlaceInQueue(PeerMessage):
     """ Peer code: 44 """
     """ The peer replies with the upload queue placement of the requested file. """
 
+    __slots__ = ("init", "filename", "place")
+
+    MAKE_SCHEMA = (
+        ("filename", FieldType.STRING),
+        ("place", FieldType.UINT32)
+    )
+
+    PARSE_SCHEMA = (
+        ("filename", FieldType.STRING),
+        ("place", FieldType.UINT32)
+    )
+
     def __init__(self, init=None, filename=None, place=None):
         self.init = init
         self.filename = filename
         self.place = place
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.filename))
-        msg.extend(self.pack_uint32(self.place))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.filename = self.unpack_string(message)
-        pos, self.place = self.unpack_uint32(message, pos)
-
 
 class UploadFailed(PlaceholdUpload):
     """ Peer code: 46 """
@@ -2841,39 +3323,46 @@ class UploadFailed(PlaceholdUpload):
     not be read. The recipient either re-queues the upload (download on their
     end), or ignores the message if the transfer finished. """
 
+    __slots__ = ()
+
 
 class UploadDenied(PeerMessage):
     """ Peer code: 50 """
     """ This message is sent to reject QueueUpload attempts and previously queued
     files. The reason for rejection will appear in the transfer list of the recipient. """
 
+    __slots__ = ("init", "file", "reason")
+
+    MAKE_SCHEMA = (
+        ("file", FieldType.STRING),
+        ("reason", FieldType.STRING)
+    )
+
+    PARSE_SCHEMA = (
+        ("file", FieldType.STRING),
+        ("reason", FieldType.STRING)
+    )
+
     def __init__(self, init=None, file=None, reason=None):
         self.init = init
         self.file = file
         self.reason = reason
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_string(self.file))
-        msg.extend(self.pack_string(self.reason))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.file = self.unpack_string(message)
-        pos, self.reason = self.unpack_string(message, pos)
-
 
 class PlaceInQueueRequest(QueueUpload):
     """ Peer code: 51 """
     """ This message is sent when asking for the upload queue placement of a file. """
 
+    __slots__ = ()
+
 
 class UploadQueueNotification(PeerMessage):
     """ Peer code: 52 """
     """ This message is sent to inform a peer about an upload attempt initiated by us. """
     """ DEPRECATED, sent by Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("init",)
+
     def __init__(self, init=None):
         self.init = init
 
@@ -2888,6 +3377,8 @@ class UnknownPeerMessage(PeerMessage):
     """ Peer code: 12547 """
     """ UNKNOWN """
 
+    __slots__ = ("init",)
+
     def __init__(self, init=None):
         self.init = init
 
@@ -2902,6 +3393,9 @@ File Messages
 
 
 class FileMessage(SlskMessage):
+
+    __slots__ = ()
+
     msgtype = MessageType.FILE
 
 
@@ -2910,42 +3404,52 @@ class FileDownloadInit(FileMessage):
     uploading a file to us. The token is the same as the one previously included
     in the TransferRequest peer message. """
 
+    __slots__ = ("init", "token")
+
+    PARSE_SCHEMA = (
+        ("token", FieldType.UINT32),
+    )
+
     def __init__(self, init=None, token=None):
         self.init = init
         self.token = token
 
-    def parse_network_message(self, message):
-        _pos, self.token = self.unpack_uint32(message)
-
 
 class FileUploadInit(FileMessage):
     """ We send this to a peer via a 'F' connection to tell them that we want to
     start uploading a file. The token is the same as the one previously included
     in the TransferRequest peer message. """
 
+    __slots__ = ("init", "token")
+
+    MAKE_SCHEMA = (
+        ("token", FieldType.UINT32),
+    )
+
     def __init__(self, init=None, token=None):
         self.init = init
         self.token = token
 
-    def make_network_message(self):
-        return self.pack_uint32(self.token)
-
 
 class FileOffset(FileMessage):
     """ We send this to the uploading peer at the beginning of a 'F' connection,
     to tell them how many bytes of the file we've previously downloaded. If none,
     the offset is 0. """
 
+    __slots__ = ("init", "offset")
+
+    MAKE_SCHEMA = (
+        ("offset", FieldType.UINT64),
+    )
+
+    PARSE_SCHEMA = (
+        ("offset", FieldType.UINT64),
+    )
+
     def __init__(self, init=None, offset=None):
         self.init = init
         self.offset = offset
 
-    def make_network_message(self):
-        return self.pack_uint64(self.offset)
-
-    def parse_network_message(self, message):
-        _pos, self.offset = self.unpack_uint64(message)
-
 
 """
 Distributed Messages
@@ -2953,12 +3457,17 @@ Distributed Messages
 
 
 class DistribMessage(SlskMessage):
+
+    __slots__ = ()
+
     msgtype = MessageType.DISTRIBUTED
 
 
 class DistribAlive(DistribMessage):
     """ Distrib code: 0 """
 
+    __slots__ = ("init",)
+
     def __init__(self, init=None):
         self.init = init
 
@@ -2977,6 +3486,20 @@ class DistribSearch(DistribMessage):
 
     __slots__ = ("unknown", "init", "user", "token", "searchterm")
 
+    MAKE_SCHEMA = (
+        ("unknown", FieldType.UINT32),
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32),
+        ("searchterm", FieldType.STRING)
+    )
+
+    PARSE_SCHEMA = (
+        ("unknown", FieldType.UINT32),
+        ("user", FieldType.STRING),
+        ("token", FieldType.UINT32),
+        ("searchterm", FieldType.STRING)
+    )
+
     def __init__(self, init=None, unknown=None, user=None, token=None, searchterm=None):
         self.init = init
         self.unknown = unknown
@@ -2984,53 +3507,46 @@ class DistribSearch(DistribMessage):
         self.token = token
         self.searchterm = searchterm
 
-    def make_network_message(self):
-        msg = bytearray()
-        msg.extend(self.pack_uint32(self.unknown))
-        msg.extend(self.pack_string(self.user))
-        msg.extend(self.pack_uint32(self.token))
-        msg.extend(self.pack_string(self.searchterm))
-
-        return msg
-
-    def parse_network_message(self, message):
-        pos, self.unknown = self.unpack_uint32(message)
-        pos, self.user = self.unpack_string(message, pos)
-        pos, self.token = self.unpack_uint32(message, pos)
-        pos, self.searchterm = self.unpack_string(message, pos)
-
 
 class DistribBranchLevel(DistribMessage):
     """ Distrib code: 4 """
     """ We tell our distributed children what our position is in our branch (xth
     generation) on the distributed network. """
 
+    __slots__ = ("init", "value")
+
+    MAKE_SCHEMA = (
+        ("value", FieldType.INT32),
+    )
+
+    PARSE_SCHEMA = (
+        ("value", FieldType.INT32),
+    )
+
     def __init__(self, init=None, value=None):
         self.init = init
         self.value = value
 
-    def make_network_message(self):
-        return self.pack_int32(self.value)
-
-    def parse_network_message(self, message):
-        _pos, self.value = self.unpack_int32(message)
-
 
 class DistribBranchRoot(DistribMessage):
     """ Distrib code: 5 """
     """ We tell our distributed children the username of the root of the branch
     we’re in on the distributed network. """
 
+    __slots__ = ("init", "user")
+
+    MAKE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
+    PARSE_SCHEMA = (
+        ("user", FieldType.STRING),
+    )
+
     def __init__(self, init=None, user=None):
         self.init = init
         self.user = user
 
-    def make_network_message(self):
-        return self.pack_string(self.user)
-
-    def parse_network_message(self, message):
-        _pos, self.user = self.unpack_string(message)
-
 
 class DistribChildDepth(DistribMessage):
     """ Distrib code: 7 """
@@ -3038,16 +3554,20 @@ class DistribChildDepth(DistribMessage):
     we have on the distributed network. """
     """ DEPRECATED, sent by Soulseek NS but not SoulseekQt """
 
+    __slots__ = ("init", "value")
+
+    MAKE_SCHEMA = (
+        ("value", FieldType.UINT32),
+    )
+
+    PARSE_SCHEMA = (
+        ("value", FieldType.UINT32),
+    )
+
     def __init__(self, init=None, value=None):
         self.init = init
         self.value = value
 
-    def make_network_message(self):
-        return self.pack_uint32(self.value)
-
-    def parse_network_message(self, message):
-        _pos, self.value = self.unpack_uint32(message)
-
 
 class DistribEmbeddedMessage(DistribMessage):
     """ Distrib code: 93 """
@@ -3063,7 +3583,7 @@ class DistribEmbeddedMessage(DistribMessage):
         self.distrib_message = distrib_message
 
     def make_network_message(self):
-        msg = bytearray()
+        msg = bytearray(3)  # Unknown, skipped by parse_network_message()
         msg.extend(self.pack_uint8(self.distrib_code))
         msg.extend(self.distrib_message)
 
@@ -3071,7 +3591,7 @@ class DistribEmbeddedMessage(DistribMessage):
 
     def parse_network_message(self, message):
         pos, self.distrib_code = self.unpack_uint8(message, 3)
-        self.distrib_message = message[pos:]
+        self.distrib_message = bytes(message[pos:])
 
 
 """
@@ -23,7 +23,12 @@
 This module implements Soulseek networking protocol.
 """
 
+import asyncio
 import copy
+import errno
+import io
+import json
+import os
 import selectors
 import socket
 import struct
@@ -31,16 +36,23 @@ import sys
 import threading
 import time
 
+from collections import deque
+from collections import OrderedDict
+
 from pynicotine.logfacility import log
+from pynicotine.metrics import metrics
+from pynicotine.scheduler import scheduler
 from pynicotine.slskmessages import DISTRIBUTED_MESSAGE_CLASSES
 from pynicotine.slskmessages import DISTRIBUTED_MESSAGE_CODES
 from pynicotine.slskmessages import PEER_MESSAGE_CLASSES
 from pynicotine.slskmessages import PEER_MESSAGE_CODES
 from pynicotine.slskmessages import PEER_INIT_MESSAGE_CLASSES
 from pynicotine.slskmessages import PEER_INIT_MESSAGE_CODES
+from pynicotine.slskmessages import SEARCH_TOKENS_ALLOWED
 from pynicotine.slskmessages import SERVER_MESSAGE_CLASSES
 from pynicotine.slskmessages import SERVER_MESSAGE_CODES
 from pynicotine.slskmessages import AcceptChildren
+from pynicotine.slskmessages import AddUser
 from pynicotine.slskmessages import BranchLevel
 from pynicotine.slskmessages import BranchRoot
 from pynicotine.slskmessages import CheckPrivileges
@@ -57,9 +69,9 @@ from pynicotine.slskmessages import DownloadFile
 from pynicotine.slskmessages import DownloadFileError
 from pynicotine.slskmessages import EmbeddedMessage
 from pynicotine.slskmessages import FileOffset
+from pynicotine.slskmessages import FileSearchResult
 from pynicotine.slskmessages import FileDownloadInit
 from pynicotine.slskmessages import FileUploadInit
-from pynicotine.slskmessages import FileSearchResult
 from pynicotine.slskmessages import GetPeerAddress
 from pynicotine.slskmessages import GetUserStats
 from pynicotine.slskmessages import GetUserStatus
@@ -82,16 +94,23 @@ from pynicotine.slskmessages import ServerDisconnect
 from pynicotine.slskmessages import ServerTimeout
 from pynicotine.slskmessages import SetConnectionStats
 from pynicotine.slskmessages import SetDownloadLimit
+from pynicotine.slskmessages import SetLoopProfiling
 from pynicotine.slskmessages import SetUploadLimit
 from pynicotine.slskmessages import SetWaitPort
 from pynicotine.slskmessages import SharedFileList
+from pynicotine.slskmessages import SharedFileListChunk
+from pynicotine.slskmessages import SharedFileListParser
 from pynicotine.slskmessages import ShowConnectionErrorMessage
 from pynicotine.slskmessages import UploadConnClose
 from pynicotine.slskmessages import UploadFile
 from pynicotine.slskmessages import UploadFileError
+from pynicotine.slskmessages import UploadPriority
 from pynicotine.slskmessages import UserInfoReply
 from pynicotine.slskmessages import UserStatus
 from pynicotine.slskmessages import increment_token
+from pynicotine.utils import encode_path
+from pynicotine.utils import load_file
+from pynicotine.utils import write_file_and_backup
 
 
 # Set the maximum number of open files to the hard limit reported by the OS.
@@ -127,16 +146,529 @@ else:
 
     MAXSOCKETS = min(max(int(MAXFILELIMIT * 0.75), 50), 3072)
 
+# Send upload data directly from file to socket, if supported by the OS
+SENDFILE_SUPPORTED = hasattr(os, "sendfile")
+SENDFILE_UNSUPPORTED_ERRORS = {errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP}
+
+# Send multiple output buffers in a single call, if supported by the OS
+SENDMSG_SUPPORTED = hasattr(socket.socket, "sendmsg")
+
+UINT_PACK = struct.Struct("<I").pack
 UINT_UNPACK = struct.Struct("<I").unpack
 DOUBLE_UINT_UNPACK = struct.Struct("<II").unpack
 
+# SharedFileList messages that don't arrive at once are parsed while data is received
+SHARED_FILE_LIST_CODE = PEER_MESSAGE_CODES[SharedFileList]
+
+# Metrics are only recorded while metrics.enabled is set, i.e. an exporter is added
+MESSAGE_TYPE_NAMES = {
+    MessageType.INIT: "peer init",
+    MessageType.SERVER: "server",
+    MessageType.PEER: "peer",
+    MessageType.FILE: "file",
+    MessageType.DISTRIBUTED: "distrib"
+}
+RECEIVED_BYTES = metrics.counter(
+    "pynicotine_network_received_bytes_total", "Bytes received, by connection type", ("conn_type",))
+SENT_BYTES = metrics.counter(
+    "pynicotine_network_sent_bytes_total", "Bytes sent, by connection type", ("conn_type",))
+PARSED_MESSAGES = metrics.counter(
+    "pynicotine_network_parsed_messages_total", "Messages parsed, by message class", ("msg_class",))
+PARSE_TIME = metrics.histogram(
+    "pynicotine_network_parse_seconds", "Time spent parsing a message, by connection type", ("conn_type",))
+PACK_TIME = metrics.histogram(
+    "pynicotine_network_pack_seconds", "Time spent packing a message, by connection type", ("conn_type",))
+SELECT_TIME = metrics.histogram(
+    "pynicotine_network_select_seconds", "Time spent waiting for socket events in select()")
+LOOP_ITERATION_TIME = metrics.histogram(
+    "pynicotine_network_loop_iteration_seconds", "Time spent processing events in a networking loop iteration")
+SOCKETS = metrics.gauge(
+    "pynicotine_network_sockets", "Number of sockets, by state", ("state",))
+CORE_BACKLOG = metrics.gauge(
+    "pynicotine_network_core_backlog", "Highest number of messages not yet processed by the core, last second")
+QUEUE_DEPTH = metrics.gauge(
+    "pynicotine_network_queue_depth", "Highest number of messages queued for the networking thread, last second")
+CONNECT_QUEUE_DEPTH = metrics.gauge(
+    "pynicotine_network_connect_queue_depth", "Number of peer connection attempts waiting to start")
+PEER_CONNECTS = metrics.counter(
+    "pynicotine_network_peer_connects_total", "Peer connection attempts, by method and result", ("method", "result"))
+LOOP_PHASE_TIME = metrics.summary(
+    "pynicotine_network_loop_phase_seconds", "Time spent in each phase of the networking loop, while profiling",
+    ("phase", "msg_class"))
+
+
+class NetworkQueue(deque):
+    """ A deque holding messages for the networking thread. Appending a message
+    wakes up the networking thread, which otherwise sleeps until there is socket
+    activity or a timer is due. """
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self._wakeup_function = None
+
+    def set_wakeup_function(self, function):
+        self._wakeup_function = function
+
+    def append(self, msg):
+
+        super().append(msg)
+
+        if self._wakeup_function is not None:
+            self._wakeup_function()
+
+
+class OutputBuffer:
+    """ Holds outgoing data for a connection. Large chunks of data, such as our compressed
+    list of shares, are queued by reference instead of being copied, while small messages
+    are coalesced. Queued data is sent using scatter-gather I/O, if supported. """
+
+    __slots__ = ("_segments", "_tail", "_length")
+
+    COALESCE_MAX_SIZE = 16384
+    MAX_SEND_SEGMENTS = 64
+
+    def __init__(self):
+
+        self._segments = deque()
+        self._tail = None
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def extend(self, data):
+
+        length = len(data)
+
+        if not length:
+            return
+
+        if length <= self.COALESCE_MAX_SIZE:
+            tail = self._tail
+
+            if tail is None:
+                tail = self._tail = bytearray()
+                self._segments.append(tail)
+
+            tail.extend(data)
+
+        else:
+            # Data must not be modified after it's queued
+            self._segments.append(data)
+            self._tail = None
+
+        self._length += length
+
+    def append_shared(self, data):
+        """ Queue data by reference, regardless of its size. Used for a message sent to
+        many connections at once, such as a search request forwarded to our distributed
+        children. data must be immutable. """
+
+        self._segments.append(data)
+        self._tail = None
+        self._length += len(data)
+
+    def clear(self):
+
+        self._segments.clear()
+        self._tail = None
+        self._length = 0
+
+    def send(self, sock, limit=None):
+        """ Send as much queued data as the socket accepts, but no more than limit bytes
+        if provided. Returns the number of bytes sent. """
+
+        if not self._length:
+            return 0
+
+        if limit is None:
+            limit = self._length
+
+        buffers = []
+        num_bytes = 0
+
+        for segment in self._segments:
+            view = memoryview(segment)
+            num_bytes += len(view)
+
+            if num_bytes >= limit:
+                buffers.append(view[:len(view) - (num_bytes - limit)])
+                break
+
+            buffers.append(view)
+
+            if len(buffers) >= self.MAX_SEND_SEGMENTS:
+                break
+
+        # Queued data that is being sent can't be resized, append new data to a new segment
+        self._tail = None
+
+        if len(buffers) > 1 and SENDMSG_SUPPORTED:
+            bytes_sent = sock.sendmsg(buffers)
+        else:
+            bytes_sent = sock.send(buffers[0])
+
+        self._consume(bytes_sent)
+        return bytes_sent
+
+    def _consume(self, num_bytes):
+
+        segments = self._segments
+        self._length -= num_bytes
+
+        while num_bytes:
+            segment = segments[0]
+            segment_len = len(segment)
+
+            if num_bytes < segment_len:
+                segments[0] = memoryview(segment)[num_bytes:]
+                break
+
+            segments.popleft()
+            num_bytes -= segment_len
+
+
+class TokenBucket:
+    """ Limits the transfer speed of connections. Tokens (bytes) are added to the bucket
+    at a constant rate, based on monotonic time, up to a small burst size. A bucket with
+    a parent is also limited by its parent, e.g. a single transfer by the total speed
+    limit for all transfers. A rate of 0 disables the limit. """
+
+    __slots__ = ("rate", "capacity", "tokens", "last_refill_time", "parent", "consumed", "exhausted",
+                 "stats_start_time")
+
+    BURST_TIME = 0.1
+    MIN_CAPACITY = 1024
+
+    def __init__(self, rate=0, parent=None):
+
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = 0
+        self.last_refill_time = time.monotonic()
+        self.parent = parent
+
+        # Usage since the last call to reset_stats(), or since the bucket was created
+        self.consumed = 0
+        self.exhausted = False
+        self.stats_start_time = self.last_refill_time
+
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+
+        previous_rate = self.rate
+        self.rate = rate
+
+        if not rate:
+            self.capacity = self.tokens = 0
+            return
+
+        self.capacity = max(int(rate * self.BURST_TIME), self.MIN_CAPACITY)
+
+        if not previous_rate:
+            self.tokens = self.capacity
+        else:
+            self.tokens = min(self.tokens, self.capacity)
+
+    def refill(self, current_time):
+
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (current_time - self.last_refill_time) * self.rate)
+
+        self.last_refill_time = current_time
+
+    def get_available(self, current_time):
+        """ Returns the number of bytes that can be transferred right now, or None if
+        there is no limit """
+
+        available = None
+
+        if self.rate:
+            self.refill(current_time)
+
+            # Avoid waking up for tiny amounts of data
+            available = int(self.tokens) if self.tokens >= self.capacity / 8 else 0
+
+        if self.parent is not None:
+            parent_available = self.parent.get_available(current_time)
+
+            if available is None or (parent_available is not None and parent_available < available):
+                available = parent_available
+
+        return available
+
+    def consume(self, num_bytes):
+
+        self.consumed += num_bytes
+
+        if self.rate:
+            self.tokens -= num_bytes
+
+        if self.parent is not None:
+            self.parent.consume(num_bytes)
+
+    def get_refill_delay(self):
+        """ Returns the number of seconds until the bucket is half full again, i.e. when
+        it's worth transferring more data """
+
+        delay = 0
+
+        if self.rate:
+            delay = max(0, (self.capacity / 2 - self.tokens) / self.rate)
+
+        if self.parent is not None:
+            delay = max(delay, self.parent.get_refill_delay())
+
+        return delay
+
+    def set_exhausted(self):
+        """ Marks the buckets that ran out of tokens, i.e. this bucket, its parent or both.
+        This tells transfers limited by their own speed limit apart from transfers limited
+        by the total speed limit. """
+
+        if self.rate and self.tokens < self.capacity / 8:
+            self.exhausted = True
+
+        if self.parent is not None:
+            self.parent.set_exhausted()
+
+    def reset_stats(self, current_time):
+
+        self.consumed = 0
+        self.exhausted = False
+        self.stats_start_time = current_time
+
+
+class PeerAddressCache:
+    """ Remembers the IP addresses and ports of users, to avoid asking the server for
+    them every time we connect to a peer. Addresses expire after a while, since users
+    get new addresses when they reconnect. Users that are offline are remembered for a
+    shorter time, to avoid asking the server about them over and over again.
+
+    Addresses can optionally be saved to a JSON file, to reuse them after a restart. """
+
+    __slots__ = ("file_path", "_addresses")
+
+    ADDRESS_TTL = 3600
+    OFFLINE_TTL = 30
+    MAX_ADDRESSES = 20000
+
+    def __init__(self, file_path=None):
+
+        self.file_path = file_path
+
+        # user: (address, expiry time). Address is None if the user is offline,
+        # and expiry time is None if the address never expires.
+        self._addresses = {}
+
+    def __contains__(self, user):
+        return self.get(user) is not None
+
+    def get(self, user, default=None):
+        """ Returns the (ip, port) of a user, or default if unknown or offline """
+
+        entry = self._get_entry(user)
+
+        if entry is None or entry[0] is None:
+            return default
+
+        return entry[0]
+
+    def is_offline(self, user):
+
+        entry = self._get_entry(user)
+        return entry is not None and entry[0] is None
+
+    def add(self, user, address, ttl=ADDRESS_TTL):
+
+        addresses = self._addresses
+
+        # Move the user to the end, to expire the oldest addresses first if the cache is full
+        addresses.pop(user, None)
+        addresses[user] = (address, time.time() + ttl if ttl is not None else None)
+
+        if len(addresses) > self.MAX_ADDRESSES:
+            # Expired entries are removed when looked up, or by prune() when saving
+            del addresses[next(iter(addresses))]
+
+    def set_offline(self, user):
+        self.add(user, None, ttl=self.OFFLINE_TTL)
+
+    def remove(self, user):
+        self._addresses.pop(user, None)
+
+    def prune(self):
+        """ Remove expired entries, and the oldest ones if there are too many. Scans all
+        entries, and is only called before saving. """
+
+        current_time = time.time()
+        addresses = self._addresses
+
+        for user, (_address, expiry_time) in list(addresses.items()):
+            if expiry_time is not None and expiry_time <= current_time:
+                del addresses[user]
+
+        num_excess = len(addresses) - self.MAX_ADDRESSES
+
+        if num_excess > 0:
+            for user in list(addresses)[:num_excess]:
+                del addresses[user]
+
+    def _get_entry(self, user):
+
+        entry = self._addresses.get(user)
+
+        if entry is None:
+            return None
+
+        expiry_time = entry[1]
+
+        if expiry_time is not None and expiry_time <= time.time():
+            del self._addresses[user]
+            return None
+
+        return entry
+
+    def load(self):
+
+        if self.file_path is None or not os.path.isfile(encode_path(self.file_path)):
+            return
+
+        addresses = load_file(self.file_path, self._load_addresses_file)
+
+        if not addresses:
+            return
+
+        current_time = time.time()
+
+        for user, (ip_address, port, expiry_time) in addresses.items():
+            if expiry_time > current_time:
+                self._addresses[user] = ((ip_address, port), expiry_time)
+
+    @staticmethod
+    def _load_addresses_file(file_path):
+
+        with open(encode_path(file_path), encoding="utf-8") as handle:
+            return json.load(handle)
+
+    def save(self):
+
+        if self.file_path is None:
+            return
+
+        self.prune()
+        write_file_and_backup(self.file_path, self._save_addresses_callback)
+
+    def _save_addresses_callback(self, file_handle):
+
+        # Offline users and addresses that never expire (our own) are not saved
+        addresses = {
+            user: (address[0], address[1], expiry_time)
+            for user, (address, expiry_time) in self._addresses.items()
+            if address is not None and expiry_time is not None
+        }
+        json.dump(addresses, file_handle, ensure_ascii=False)
+
+
+class PeerConnectionStats:
+    """ Outcome and latency of previous direct and indirect connection attempts to a
+    user. Used to skip or delay connection methods that are unlikely to succeed. """
+
+    __slots__ = ("direct_successes", "direct_failures", "indirect_successes", "indirect_failures",
+                 "direct_latency", "indirect_latency", "direct_skips")
+
+    MIN_ATTEMPTS = 3
+    MAX_ATTEMPTS = 32
+    LATENCY_WEIGHT = 0.25
+    DIRECT_RETRY_INTERVAL = 8
+
+    def __init__(self):
+
+        self.direct_successes = 0
+        self.direct_failures = 0
+        self.indirect_successes = 0
+        self.indirect_failures = 0
+        self.direct_latency = None
+        self.indirect_latency = None
+        self.direct_skips = 0
+
+    @classmethod
+    def _update_latency(cls, average, latency):
+
+        if average is None:
+            return latency
+
+        return average + (latency - average) * cls.LATENCY_WEIGHT
+
+    def add_direct_result(self, success, latency=None):
+
+        if metrics.enabled:
+            PEER_CONNECTS.inc(labels=("direct", "success" if success else "failure"))
+
+        if success:
+            self.direct_successes += 1
+            self.direct_latency = self._update_latency(self.direct_latency, latency)
+        else:
+            self.direct_failures += 1
+
+        if self.direct_successes + self.direct_failures > self.MAX_ATTEMPTS:
+            # Give recent attempts more weight, in case the user's network changes
+            self.direct_successes //= 2
+            self.direct_failures //= 2
+
+    def add_indirect_result(self, success, latency=None):
+
+        if metrics.enabled:
+            PEER_CONNECTS.inc(labels=("indirect", "success" if success else "failure"))
+
+        if success:
+            self.indirect_successes += 1
+            self.indirect_latency = self._update_latency(self.indirect_latency, latency)
+        else:
+            self.indirect_failures += 1
+
+        if self.indirect_successes + self.indirect_failures > self.MAX_ATTEMPTS:
+            self.indirect_successes //= 2
+            self.indirect_failures //= 2
+
+    def _is_unreliable(self, successes, failures):
+        # Less than 20% of attempts succeeded
+        return failures >= self.MIN_ATTEMPTS and successes * 4 < failures
+
+    def should_connect_directly(self):
+        """ Skip direct connections if they keep failing, e.g. when the user's port is
+        closed. Try again once in a while, in case the port was opened. """
+
+        if not self._is_unreliable(self.direct_successes, self.direct_failures):
+            return True
+
+        self.direct_skips += 1
+        return self.direct_skips % self.DIRECT_RETRY_INTERVAL == 0
+
+    def get_indirect_delay(self):
+        """ Returns the number of seconds to wait for a direct connection before requesting
+        an indirect connection. Returns None if an indirect connection should only be
+        requested once the direct connection fails. """
+
+        if self.direct_successes < self.MIN_ATTEMPTS or self.direct_failures * 4 > self.direct_successes:
+            # Direct connections are not reliable enough, request both at the same time
+            return 0
+
+        if self._is_unreliable(self.indirect_successes, self.indirect_failures):
+            return None
+
+        return min(max(self.direct_latency * 2, 0.5), 3)
+
 
 class Connection:
     """ Holds data about a connection. sock is a socket object,
     addr is (ip, port) pair, ibuf and obuf are input and output msgBuffer,
     init is a PeerInit object (see slskmessages docstrings). """
 
-    __slots__ = ("sock", "addr", "events", "ibuf", "obuf", "lastactive", "lastreadlength")
+    __slots__ = ("sock", "addr", "events", "ibuf", "obuf", "lastactive", "lastreadlength", "timeout_timer")
 
     def __init__(self, sock=None, addr=None, events=None):
 
@@ -144,9 +676,10 @@ class Connection:
         self.addr = addr
         self.events = events
         self.ibuf = bytearray()
-        self.obuf = bytearray()
+        self.obuf = OutputBuffer()
         self.lastactive = time.time()
         self.lastreadlength = 100 * 1024
+        self.timeout_timer = None
 
 
 class ServerConnection(Connection):
@@ -162,7 +695,8 @@ class ServerConnection(Connection):
 
 class PeerConnection(Connection):
 
-    __slots__ = ("init", "fileinit", "filedown", "fileupl", "lastcallback")
+    __slots__ = ("init", "fileinit", "filedown", "fileupl", "lastcallback", "use_sendfile", "readbuf", "bucket",
+                 "shares_parser")
 
     def __init__(self, sock=None, addr=None, events=None, init=None):
 
@@ -173,33 +707,83 @@ class PeerConnection(Connection):
         self.filedown = None
         self.fileupl = None
         self.lastcallback = time.time()
+        self.use_sendfile = SENDFILE_SUPPORTED
+        self.readbuf = None
+        self.bucket = None
+        self.shares_parser = None
 
 
-class SlskProtoThread(threading.Thread):
-    """ This is a networking thread that actually does all the communication.
+class SlskProtoEngine:
+    """ This is the networking engine that actually does all the communication.
     It sends data to the NicotineCore via a callback function and receives
-    data via a deque object. """
+    data via a deque object. SlskProtoThread runs it in a dedicated thread,
+    and SlskProtoAsyncio inside an asyncio event loop. """
 
     """ The server and peers send each other small binary messages that start
     with length and message code followed by the actual message data. """
 
     IN_PROGRESS_STALE_AFTER = 2
     CONNECTION_MAX_IDLE = 60
-
-    def __init__(self, core_callback, queue, bindip, interface, port, port_range):
+    FILE_READ_BUFFER_SIZE = 256 * 1024
+
+    """ Outgoing peer connections are queued by priority, and only a limited number of
+    connection attempts are in progress at once, started at a limited rate. """
+
+    MAX_CONNECTS_IN_PROGRESS = 64
+    CONNECTS_PER_SECOND = 40
+    CONNECT_BURST = 10
+    INDIRECT_REQUEST_TIMEOUT = 20
+    MAX_PEER_CONN_STATS = 10000
+
+    """ When NicotineCore falls behind processing messages from the networking thread, or
+    queues messages faster than the networking thread processes them, peer and distributed
+    connections (search results, browsed shares, search requests) are no longer read from
+    until the backlog drops below the low water mark. Server and file connections keep
+    flowing. """
+
+    BACKLOG_HIGH_WATER_MARK = 20000
+    BACKLOG_LOW_WATER_MARK = 5000
+
+    """ Distributed network. Children connect to us to receive the search requests we get
+    from our parent, or from the server if we're a branch root. Children that don't read
+    the data we send them fast enough are disconnected. """
+
+    MAX_DISTRIB_CHILDREN = 10
+    MAX_DISTRIB_CHILD_OUTPUT_SIZE = 1024 * 1024
+
+    """ Loop profiling replaces the methods running each phase of the networking loop with
+    timed versions while enabled, and restores them when disabled. Parsing and packing
+    are also timed per message class, and are part of the incoming and queue phases. """
+
+    PROFILED_PHASES = (
+        ("queue", "process_queue_messages"),
+        ("accept", "accept_incoming_connection"),
+        ("connect", "process_conn_in_progress"),
+        ("read", "read_data"),
+        ("read", "read_file_data"),
+        ("incoming", "process_conn_incoming_messages"),
+        ("write", "write_data"),
+        ("callback", "send_callback_msgs")
+    )
+
+    def __init__(self, core_callback, queue, bindip, interface, port, port_range,
+                 max_peer_conns=200, peer_conn_idle_time=120, peer_address_file=None,
+                 core_backlog_function=None):
         """ core_callback is a NicotineCore callback function to be called with messages
         list as a parameter. queue is deque object that holds network messages from
-        NicotineCore. """
-
-        threading.Thread.__init__(self)
-
-        self.name = "NetworkThread"
+        NicotineCore. Use a NetworkQueue to let NicotineCore wake up the networking
+        thread as soon as a message is queued. max_peer_conns and peer_conn_idle_time
+        limit how many idle P connections are kept open for reuse, and for how long.
+        Known peer addresses are saved to peer_address_file, if provided.
+        core_backlog_function returns the number of messages passed to core_callback
+        that NicotineCore hasn't processed yet. """
 
         if sys.platform not in ("linux", "darwin"):
             # TODO: support custom network interface for other systems than Linux and macOS
             interface = None
 
         self._core_callback = core_callback
+        self._core_backlog_function = core_backlog_function
         self._queue = queue
         self._callback_msgs = []
         self._pending_init_msgs = {}
@@ -213,6 +797,9 @@ class SlskProtoThread(threading.Thread):
 
         self.selector = None
         self.listen_socket = None
+        self._wakeup_socket = None
+        self._wakeup_trigger_socket = None
+        self._wakeup_pending = False
 
         self.server_socket = None
         self.server_address = None
@@ -227,33 +814,98 @@ class SlskProtoThread(threading.Thread):
         self.potential_parents = {}
         self.distrib_parent_min_speed = 0
         self.distrib_parent_speed_ratio = 1
-        self.max_distrib_children = 10
+        self.max_distrib_children = 0
+        self._distrib_children = {}
+        self._accept_children = None
+        self._branch_level = 0
+        self._branch_root = None
+        self._upload_speed = 0
 
         self._numsockets = 1
-        self._last_conn_stat_time = 0
+        self._conn_stats_timer = None
 
         self._conns = {}
         self._connsinprogress = {}
-        self._out_indirect_conn_request_times = {}
+        self._peer_conn_pool = OrderedDict()
+        self._connect_queues = (deque(), deque(), deque())
+        self._connect_allowance = self.CONNECT_BURST
+        self._connect_allowance_time = time.monotonic()
+        self._connect_timer = None
+        self._peer_conn_stats = OrderedDict()
+        self._delayed_indirect_conn_requests = {}
+        self._max_peer_conns = max_peer_conns
+        self._peer_conn_idle_time = peer_conn_idle_time
+        self._out_indirect_conn_request_timers = {}
         self._token = 0
-        self.exit = threading.Event()
-        self.user_addresses = {}
+        self.user_addresses = PeerAddressCache(peer_address_file)
+        self.user_addresses.load()
 
         self._calc_upload_limit_function = self._calc_upload_limit_none
         self._upload_limit = 0
         self._download_limit = 0
-        self._upload_limit_split = 0
-        self._download_limit_split = 0
-        self._ulimits = {}
-        self._dlimits = {}
+        self._upload_bucket = TokenBucket()
+        self._download_bucket = TokenBucket()
+        self._upload_transfer_rate = 0
+        self._download_transfer_rate = 0
+        self._upload_priority_weights = {
+            UploadPriority.PRIVILEGED: 4,
+            UploadPriority.BUDDY: 2,
+            UploadPriority.REGULAR: 1
+        }
+        self._last_upload_allocation_time = time.monotonic()
+        self._throttled_conns = {}
+        self._throttle_resume_time = None
+        self.peer_reads_paused = False
+        self._read_paused_conns = set()
+        self._max_core_backlog = 0
+        self._max_queue_depth = 0
+        self.loop_profiling = False
+        self._loop_profiling_start_time = None
         self.total_uploads = 0
         self.total_downloads = 0
         self.total_download_bandwidth = 0
         self.total_upload_bandwidth = 0
-        self.last_cycle_time = time.time()
-        self.current_cycle_loop_count = 0
-        self.last_cycle_loop_count = 0
-        self.loops_per_second = 0
+
+        # Handlers for messages queued by NicotineCore. The handler for each message class
+        # is looked up once, and cached in _queue_message_handlers.
+        self._output_handlers = {
+            MessageType.INIT: self.process_peer_init_output,
+            MessageType.INTERNAL: self.process_internal_messages,
+            MessageType.PEER: self.process_peer_output,
+            MessageType.DISTRIBUTED: self.process_distrib_output,
+            MessageType.FILE: self.process_file_output,
+            MessageType.SERVER: self.process_server_output
+        }
+        self._internal_message_handlers = {
+            ConnClose: self._on_conn_close,
+            ConnCloseIP: self._on_conn_close_ip,
+            DownloadFile: self._on_download_file,
+            InitPeerConn: self._on_init_peer_conn,
+            SendNetworkMessage: self._on_send_network_message,
+            ServerConnect: self.server_connect,
+            ServerDisconnect: self._on_server_disconnect,
+            SetDownloadLimit: self._on_set_download_limit,
+            SetLoopProfiling: self._on_set_loop_profiling,
+            SetUploadLimit: self._on_set_upload_limit,
+            UploadFile: self._on_upload_file
+        }
+        self._queue_message_handlers = {}
+
+        # Server messages that also need to be handled in the networking thread, before
+        # they're passed on to NicotineCore
+        self._server_input_hooks = {
+            AddUser: self._on_add_user,
+            ConnectToPeer: self._on_connect_to_peer,
+            GetPeerAddress: self._on_get_peer_address,
+            GetUserStats: self._on_get_user_stats,
+            GetUserStatus: self._on_get_user_status,
+            Login: self._on_login,
+            ParentMinSpeed: self._on_parent_min_speed,
+            ParentSpeedRatio: self._on_parent_speed_ratio,
+            PossibleParents: self._on_possible_parents,
+            Relogged: self._on_relogged,
+            ResetDistributed: self._on_reset_distributed
+        }
 
     """ General """
 
@@ -345,9 +997,8 @@ class SlskProtoThread(threading.Thread):
         self.server_disconnected = False
         self.manual_server_disconnect = False
 
-        if self.server_timer is not None:
-            self.server_timer.cancel()
-            self.server_timer = None
+        scheduler.cancel(self.server_timer)
+        self.server_timer = None
 
         ip_address, port = msg_obj.addr
         log.add("Connecting to %(host)s:%(port)s", {'host': ip_address, 'port': port})
@@ -371,9 +1022,21 @@ class SlskProtoThread(threading.Thread):
         self._token_init_msgs.clear()
         self._username_init_msgs.clear()
 
-        # Inform threads we've disconnected
-        self.exit.set()
-        self._out_indirect_conn_request_times.clear()
+        for connect_queue in self._connect_queues:
+            connect_queue.clear()
+
+        scheduler.cancel(self._connect_timer)
+        self._connect_timer = None
+
+        for timer in self._out_indirect_conn_request_timers.values():
+            scheduler.cancel(timer)
+
+        for timer in self._delayed_indirect_conn_requests.values():
+            scheduler.cancel(timer)
+
+        self._out_indirect_conn_request_timers.clear()
+        self._delayed_indirect_conn_requests.clear()
+        self._accept_children = None
 
         if self._want_abort:
             return
@@ -415,10 +1078,7 @@ class SlskProtoThread(threading.Thread):
         elif 0 < self.server_timeout_value < 600:
             self.server_timeout_value = self.server_timeout_value * 2
 
-        self.server_timer = threading.Timer(self.server_timeout_value, self.server_timeout)
-        self.server_timer.name = "ServerTimer"
-        self.server_timer.daemon = True
-        self.server_timer.start()
+        self.server_timer = scheduler.add(delay=self.server_timeout_value, callback=self.server_timeout)
 
         log.add("The server seems to be down or not responding, retrying in %i seconds",
                 self.server_timeout_value)
@@ -426,6 +1086,60 @@ class SlskProtoThread(threading.Thread):
     def abort(self):
         """ Call this to abort the thread """
         self._want_abort = True
+        self.wakeup()
+
+    def wakeup(self):
+        """ Interrupt the select() call of the networking loop. Can be called from any thread. """
+
+        if self._wakeup_pending or self._wakeup_trigger_socket is None:
+            return
+
+        self._wakeup_pending = True
+
+        try:
+            self._wakeup_trigger_socket.send(b"\0")
+
+        except OSError:
+            # Socket buffer is full or socket was closed, the loop wakes up either way
+            pass
+
+    def _init_wakeup_sockets(self):
+
+        self._wakeup_socket, self._wakeup_trigger_socket = socket.socketpair()
+        self._wakeup_socket.setblocking(False)
+        self._wakeup_trigger_socket.setblocking(False)
+        self.selector.register(self._wakeup_socket, selectors.EVENT_READ)
+
+        if hasattr(self._queue, "set_wakeup_function"):
+            self._queue.set_wakeup_function(self.wakeup)
+
+        scheduler.set_wakeup_function(self.wakeup)
+
+    def _clear_wakeup(self):
+
+        try:
+            self._wakeup_socket.recv(4096)
+
+        except OSError:
+            pass
+
+        # Clear the flag after draining the socket, but before the queue is processed in
+        # the next iteration, to ensure no queued message is left without a wakeup
+        self._wakeup_pending = False
+
+    def _close_wakeup_sockets(self):
+
+        if hasattr(self._queue, "set_wakeup_function"):
+            self._queue.set_wakeup_function(None)
+
+        scheduler.set_wakeup_function(None)
+
+        self.selector.unregister(self._wakeup_socket)
+
+        for sock in (self._wakeup_socket, self._wakeup_trigger_socket):
+            self.close_socket(sock, shutdown=False)
+
+        self._wakeup_socket = self._wakeup_trigger_socket = None
 
     """ File Transfers """
 
@@ -443,13 +1157,77 @@ class SlskProtoThread(threading.Thread):
         loop_limit = 1024  # 1 KB/s is the minimum upload speed per transfer
 
         if limit_disabled or limit < loop_limit:
-            self._upload_limit_split = 0
-            return
+            total_rate = transfer_rate = 0
+
+        elif limit_per_transfer:
+            total_rate = 0
+            transfer_rate = limit
+
+        else:
+            # Transfers that haven't started yet get an even share, until the next allocation
+            total_rate = limit
+            transfer_rate = limit // max(self.total_uploads, 1)
+
+        self._upload_bucket.set_rate(total_rate)
+        self._upload_transfer_rate = transfer_rate
+        self._update_transfer_buckets(self._is_upload, transfer_rate)
+
+        if total_rate:
+            self._allocate_upload_bandwidth(measure_usage=False)
+
+    def _allocate_upload_bandwidth(self, measure_usage=True):
+        """ Share the total upload speed limit between transfers, weighted by the priority
+        class of the user (privileged, buddy or regular). Transfers that didn't use their
+        whole share since the last allocation, e.g. due to a slow peer, are limited to a bit
+        more than they used, and the rest is shared between the other transfers. Transfers
+        that ran out of their own share, or started after the last allocation, get an even
+        share of what's left. """
+
+        current_time = time.monotonic()
+        elapsed = current_time - self._last_upload_allocation_time
+        transfers = []
+
+        for conn_obj in self._conns.values():
+            if conn_obj.__class__ is not PeerConnection or conn_obj.bucket is None or not self._is_upload(conn_obj):
+                continue
+
+            bucket = conn_obj.bucket
+            priority = conn_obj.fileupl.priority if conn_obj.fileupl is not None else UploadPriority.REGULAR
+            weight = self._upload_priority_weights.get(priority) or 1
+            demand = None
+
+            if (measure_usage and not bucket.exhausted and elapsed > 0
+                    and bucket.stats_start_time <= self._last_upload_allocation_time):
+                # Leave room for the transfer to speed up
+                demand = max(bucket.consumed / elapsed * 1.25, TokenBucket.MIN_CAPACITY)
+
+            transfers.append((bucket, weight, demand))
+
+            if measure_usage:
+                bucket.reset_stats(current_time)
+
+        if measure_usage:
+            self._upload_bucket.reset_stats(current_time)
+            self._last_upload_allocation_time = current_time
+
+        remaining_rate = self._upload_bucket.rate
 
-        if not limit_per_transfer and self.total_uploads > 1:
-            limit = limit // self.total_uploads
+        while transfers:
+            total_weight = sum(weight for _bucket, weight, _demand in transfers)
+            satisfied = [transfer for transfer in transfers
+                         if transfer[2] is not None and transfer[2] <= remaining_rate * transfer[1] / total_weight]
 
-        self._upload_limit_split = int(limit)
+            if not satisfied:
+                for bucket, weight, _demand in transfers:
+                    bucket.set_rate(max(int(remaining_rate * weight / total_weight), 1))
+
+                break
+
+            for transfer in satisfied:
+                bucket, _weight, demand = transfer
+                bucket.set_rate(int(demand))
+                remaining_rate -= demand
+                transfers.remove(transfer)
 
     def _calc_upload_limit_by_transfer(self):
         return self._calc_upload_limit(limit_per_transfer=True)
@@ -464,100 +1242,238 @@ class SlskProtoThread(threading.Thread):
 
         if limit < loop_limit:
             # Download limit disabled
-            self._download_limit_split = 0
-            return
+            limit = 0
 
-        if self.total_downloads > 1:
-            limit = limit // self.total_downloads
+        transfer_rate = limit // max(self.total_downloads, 1)
 
-        self._download_limit_split = int(limit)
+        self._download_bucket.set_rate(limit)
+        self._download_transfer_rate = transfer_rate
+        self._update_transfer_buckets(self._is_download, transfer_rate)
 
-    def _calc_loops_per_second(self):
-        """ Calculate number of loops per second. This value is used to split the
-        per-second transfer speed limit evenly for each loop. """
+    def _update_transfer_buckets(self, is_transfer_type, transfer_rate):
 
-        current_time = time.time()
+        for conn_obj in self._conns.values():
+            if conn_obj.__class__ is PeerConnection and conn_obj.bucket is not None and is_transfer_type(conn_obj):
+                conn_obj.bucket.set_rate(transfer_rate)
 
-        if current_time - self.last_cycle_time >= 1:
-            self.loops_per_second = (self.last_cycle_loop_count + self.current_cycle_loop_count) // 2
+    @staticmethod
+    def get_transfer_limit(conn_obj, total_bucket, transfer_rate):
+        """ Returns the number of bytes a transfer can send or receive right now, or None
+        if there is no speed limit """
 
-            self.last_cycle_loop_count = self.current_cycle_loop_count
-            self.last_cycle_time = current_time
-            self.current_cycle_loop_count = 0
-        else:
-            self.current_cycle_loop_count = self.current_cycle_loop_count + 1
+        bucket = conn_obj.bucket
 
-    def set_conn_speed_limit(self, sock, limit, limits):
+        if bucket is None:
+            bucket = conn_obj.bucket = TokenBucket(transfer_rate, parent=total_bucket)
 
-        limit = limit // (self.loops_per_second or 1)
+        return bucket.get_available(time.monotonic())
 
-        if limit > 0:
-            limits[sock] = limit
+    def throttle_connection(self, conn_obj, event):
+        """ Transfer speed limit reached. Stop watching the connection for reads or writes
+        until enough tokens are available again, to avoid waking up for nothing. """
 
-    """ Connections """
+        resume_time = time.monotonic() + conn_obj.bucket.get_refill_delay()
 
-    def _check_indirect_connection_timeouts(self):
+        if self._throttle_resume_time is None or resume_time < self._throttle_resume_time:
+            self._throttle_resume_time = resume_time
 
-        while True:
-            curtime = time.time()
+        conn_obj.bucket.set_exhausted()
+        self._throttled_conns[conn_obj.sock] = self._throttled_conns.get(conn_obj.sock, 0) | event
+        self.modify_connection_events(conn_obj, conn_obj.events & ~event)
 
-            if self._out_indirect_conn_request_times:
-                for init, request_time in self._out_indirect_conn_request_times.copy().items():
-                    username = init.target_user
-                    conn_type = init.conn_type
+    def resume_throttled_connections(self):
 
-                    if (curtime - request_time) >= 20 and self._out_indirect_conn_request_times.pop(init, None):
-                        log.add_conn(("Indirect connect request of type %(type)s to user %(user)s with "
-                                      "token %(token)s expired, giving up"), {
-                            'type': conn_type,
-                            'user': username,
-                            'token': init.token
-                        })
+        if self._throttle_resume_time is None or time.monotonic() < self._throttle_resume_time:
+            return
 
-                        self._callback_msgs.append(ShowConnectionErrorMessage(username, init.outgoing_msgs[:]))
+        throttled_conns = self._throttled_conns
+        self._throttled_conns = {}
+        self._throttle_resume_time = None
 
-                        self._token_init_msgs.pop(init.token, None)
-                        init.outgoing_msgs.clear()
+        for sock, event in throttled_conns.items():
+            conn_obj = self._conns.get(sock)
 
-            if self.exit.wait(1):
-                # Event set, we're exiting
-                return
+            if conn_obj is not None:
+                self.modify_connection_events(conn_obj, conn_obj.events | event)
 
-    @staticmethod
-    def connection_still_active(conn_obj):
+    """ Backpressure """
 
-        init = conn_obj.init
+    @staticmethod
+    def _is_deferrable(conn_obj):
+        """ Messages from peer and distributed connections can wait for the backlog to clear """
 
-        if init is not None and init.conn_type != 'P':
-            # Distributed and file connections are critical, always assume they are active
-            return True
+        if conn_obj.__class__ is not PeerConnection or conn_obj.init is None:
+            return False
 
-        return len(conn_obj.obuf) > 0 or len(conn_obj.ibuf) > 0
+        return conn_obj.init.conn_type in (ConnectionType.PEER, ConnectionType.DISTRIBUTED)
 
-    def has_existing_user_socket(self, user, conn_type):
+    def update_backpressure(self):
+        """ Pause or resume reading from peer and distributed connections, depending on how
+        many messages are waiting for NicotineCore and the networking thread. Called once
+        per iteration of the networking loop. """
 
-        prev_init = self._username_init_msgs.get(user + conn_type)
+        core_backlog = self._core_backlog_function() if self._core_backlog_function is not None else 0
+        queue_depth = len(self._queue)
 
-        if prev_init is not None and prev_init.sock is not None:
-            return True
+        if core_backlog > self._max_core_backlog:
+            self._max_core_backlog = core_backlog
 
-        return False
+        if queue_depth > self._max_queue_depth:
+            self._max_queue_depth = queue_depth
 
-    def add_init_message(self, init):
+        backlog = max(core_backlog, queue_depth)
 
-        conn_type = init.conn_type
+        if not self.peer_reads_paused:
+            if backlog >= self.BACKLOG_HIGH_WATER_MARK:
+                log.add_conn(("Message backlog too large (%(core_backlog)s for core, %(queue_depth)s queued), "
+                              "pausing reads from peer connections"), {
+                    "core_backlog": core_backlog,
+                    "queue_depth": queue_depth
+                })
+                self.peer_reads_paused = True
 
-        if conn_type == ConnectionType.FILE:
-            # File transfer connections are not unique or reused later
             return
 
-        self._username_init_msgs[init.target_user + conn_type] = init
+        if backlog <= self.BACKLOG_LOW_WATER_MARK:
+            self.resume_peer_reads()
+
+    def pause_peer_reads(self, conn_obj):
+        """ Stop watching a peer connection for reads while the backlog clears. Connections
+        are paused once they have data for us, instead of all at once. """
+
+        self._read_paused_conns.add(conn_obj.sock)
+        self.modify_connection_events(conn_obj, conn_obj.events & ~selectors.EVENT_READ)
+
+    def resume_peer_reads(self):
+
+        log.add_conn("Message backlog cleared, resuming reads from %s peer connections",
+                     len(self._read_paused_conns))
+
+        self.peer_reads_paused = False
+        read_paused_conns = self._read_paused_conns
+        self._read_paused_conns = set()
+        current_time = time.time()
+
+        for sock in read_paused_conns:
+            conn_obj = self._conns.get(sock)
+
+            if conn_obj is not None:
+                # Don't let the idle timeout close the connection before we read its data
+                conn_obj.lastactive = current_time
+                self.modify_connection_events(conn_obj, conn_obj.events | selectors.EVENT_READ)
+
+    """ Connections """
+
+    def _check_indirect_connection_timeout(self, init):
+
+        if self._out_indirect_conn_request_timers.pop(init, None) is None:
+            return
+
+        username = init.target_user
+        self.get_peer_conn_stats(username).add_indirect_result(success=False)
+
+        log.add_conn(("Indirect connect request of type %(type)s to user %(user)s with "
+                      "token %(token)s expired, giving up"), {
+            'type': init.conn_type,
+            'user': username,
+            'token': init.token
+        })
+
+        self._callback_msgs.append(ShowConnectionErrorMessage(username, init.outgoing_msgs[:]))
+
+        self._token_init_msgs.pop(init.token, None)
+        init.outgoing_msgs.clear()
+
+    @staticmethod
+    def connection_still_active(conn_obj):
+
+        init = conn_obj.init
+
+        if init is not None and init.conn_type != 'P':
+            # Distributed and file connections are critical, always assume they are active
+            return True
+
+        return len(conn_obj.obuf) > 0 or len(conn_obj.ibuf) > 0
+
+    def has_existing_user_socket(self, user, conn_type):
+
+        prev_init = self._username_init_msgs.get(user + conn_type)
+
+        if prev_init is not None and prev_init.sock is not None:
+            return True
+
+        return False
+
+    def add_init_message(self, init):
+
+        conn_type = init.conn_type
+
+        if conn_type == ConnectionType.FILE:
+            # File transfer connections are not unique or reused later
+            return
+
+        self._username_init_msgs[init.target_user + conn_type] = init
+
+    def is_current_init_message(self, init):
+        """ Returns False if a newer connection attempt of the same type to the user
+        replaced init. File transfer connections are never replaced. """
+
+        if init.conn_type == ConnectionType.FILE:
+            return True
+
+        return self._username_init_msgs.get(init.target_user + init.conn_type) is init
+
+    def add_pooled_peer_connection(self, conn_obj):
+        """ Established P connections are kept open for reuse, in least recently used
+        order. Once the pool is full, the least recently used connection that isn't
+        transferring any data is closed. """
+
+        init = conn_obj.init
+
+        if init.conn_type != ConnectionType.PEER:
+            return
+
+        pool = self._peer_conn_pool
+
+        if len(pool) >= self._max_peer_conns:
+            self.close_pooled_peer_connections(len(pool) - self._max_peer_conns + 1)
+
+        pool[init.target_user + init.conn_type] = conn_obj
+        self.set_connection_timeout(conn_obj, self._peer_conn_idle_time)
+
+    def use_pooled_peer_connection(self, conn_obj):
+
+        init = conn_obj.init
+        init_key = init.target_user + init.conn_type
+
+        if self._peer_conn_pool.get(init_key) is conn_obj:
+            self._peer_conn_pool.move_to_end(init_key)
+
+    def close_pooled_peer_connections(self, num_conns):
+        """ Close up to num_conns of the least recently used P connections that aren't
+        sending or receiving data """
+
+        for conn_obj in list(self._peer_conn_pool.values()):
+            if num_conns <= 0:
+                break
+
+            if self.connection_still_active(conn_obj):
+                continue
+
+            self.close_connection(self._conns, conn_obj.sock)
+            num_conns -= 1
 
     @staticmethod
     def pack_network_message(msg_obj):
 
         try:
-            return msg_obj.make_network_message()
+            if not metrics.enabled:
+                return msg_obj.make_network_message()
+
+            start_time = time.perf_counter()
+            msg = msg_obj.make_network_message()
+            PACK_TIME.observe(time.perf_counter() - start_time, (MESSAGE_TYPE_NAMES[msg_obj.msgtype],))
+            return msg
 
         except Exception:
             from traceback import format_exc
@@ -575,7 +1491,14 @@ class SlskProtoThread(threading.Thread):
             else:
                 msg = msg_class()
 
+            if not metrics.enabled:
+                msg.parse_network_message(msg_buffer)
+                return msg
+
+            start_time = time.perf_counter()
             msg.parse_network_message(msg_buffer)
+            PARSE_TIME.observe(time.perf_counter() - start_time, (conn_type,))
+            PARSED_MESSAGES.inc(labels=(msg_class.__name__,))
             return msg
 
         except Exception as error:
@@ -603,11 +1526,43 @@ class SlskProtoThread(threading.Thread):
 
         return distrib_msg
 
+    def get_allowed_connection_events(self, conn_obj, events):
+        """ Removes events we're not waiting for at the moment. Connections paused while
+        the core backlog clears are not read from, and throttled transfers are not read
+        from or written to until their bucket refills. """
+
+        sock = conn_obj.sock
+
+        if sock in self._read_paused_conns:
+            events &= ~selectors.EVENT_READ
+
+        throttled_events = self._throttled_conns.get(sock)
+
+        if throttled_events:
+            events &= ~throttled_events
+
+        return events
+
     def modify_connection_events(self, conn_obj, events):
+        """ Watch the connection for events, except the ones we're not waiting for at the
+        moment (see get_allowed_connection_events) """
+
+        events = self.get_allowed_connection_events(conn_obj, events)
+
+        if conn_obj.events == events:
+            return
+
+        if not events:
+            # Connection is throttled, and we're not waiting for anything else
+            self.selector.unregister(conn_obj.sock)
 
-        if conn_obj.events != events:
+        elif not conn_obj.events:
+            self.selector.register(conn_obj.sock, events)
+
+        else:
             self.selector.modify(conn_obj.sock, events)
-            conn_obj.events = events
+
+        conn_obj.events = events
 
     def process_conn_messages(self, init):
         """ A connection is established with the peer, time to queue up our peer
@@ -675,16 +1630,21 @@ class SlskProtoThread(threading.Thread):
         """ Prepare to initiate a connection with a peer """
 
         init = PeerInit(init_user=self.server_username, target_user=user, conn_type=conn_type)
-        addr = None
+        addr = self.user_addresses.get(user)
 
         if message is not None:
             init.outgoing_msgs.append(message)
 
-        if user in self.user_addresses:
-            addr = self.user_addresses[user]
+        if addr is None and address is not None:
+            self.user_addresses.add(user, address)
+            addr = address
 
-        elif address is not None:
-            self.user_addresses[user] = addr = address
+        elif addr is None and self.user_addresses.is_offline(user):
+            log.add_conn("User %(user)s was recently offline, not requesting address", {
+                'user': user
+            })
+            self._callback_msgs.append(ShowConnectionErrorMessage(user, init.outgoing_msgs[:]))
+            return
 
         if addr is None:
             if user not in self._pending_init_msgs:
@@ -718,16 +1678,125 @@ class SlskProtoThread(threading.Thread):
             })
             return
 
-        if not init.indirect:
+        self.add_init_message(init)
+        self._connect_queues[self.get_connection_priority(init)].append((addr, init))
+        self.process_connect_queue()
+
+    @staticmethod
+    def get_connection_priority(init):
+        """ File transfer connections are started first, and connections that are only
+        used to deliver search results last """
+
+        if init.conn_type == ConnectionType.FILE:
+            return 0
+
+        if init.outgoing_msgs and all(msg.__class__ is FileSearchResult for msg in init.outgoing_msgs):
+            return 2
+
+        return 1
+
+    def process_connect_queue(self):
+        """ Start queued outgoing peer connections, as long as the limits allow it """
+
+        if self.server_disconnected or not any(self._connect_queues):
+            return
+
+        current_time = time.monotonic()
+        self._connect_allowance = min(
+            self.CONNECT_BURST,
+            self._connect_allowance + (current_time - self._connect_allowance_time) * self.CONNECTS_PER_SECOND
+        )
+        self._connect_allowance_time = current_time
+
+        for connect_queue in self._connect_queues:
+            while connect_queue:
+                if len(self._connsinprogress) >= self.MAX_CONNECTS_IN_PROGRESS or self._numsockets >= MAXSOCKETS:
+                    # Continue once a connection attempt finishes, or sockets are freed
+                    return
+
+                if self._connect_allowance < 1:
+                    if self._connect_timer is None:
+                        delay = (1 - self._connect_allowance) / self.CONNECTS_PER_SECOND
+                        self._connect_timer = scheduler.add(delay=delay, callback=self._process_connect_queue_timer)
+
+                    return
+
+                addr, init = connect_queue.popleft()
+
+                if init.sock is not None or not self.is_current_init_message(init):
+                    # Connection was established or superseded while queued
+                    continue
+
+                self._connect_allowance -= 1
+                self.start_peer_connection(addr, init)
+
+    def _process_connect_queue_timer(self):
+        self._connect_timer = None
+        self.process_connect_queue()
+
+    def send_delayed_indirect_request(self, init):
+        """ Request an indirect connection, if it was delayed and the direct connection
+        hasn't succeeded yet """
+
+        if init not in self._delayed_indirect_conn_requests:
+            return
+
+        scheduler.cancel(self._delayed_indirect_conn_requests.pop(init))
+
+        if init.sock is None and self.is_current_init_message(init):
+            self.connect_to_peer_indirect(init)
+
+    def get_peer_conn_stats(self, user):
+
+        stats = self._peer_conn_stats.get(user)
+
+        if stats is None:
+            stats = self._peer_conn_stats[user] = PeerConnectionStats()
+
+            if len(self._peer_conn_stats) > self.MAX_PEER_CONN_STATS:
+                self._peer_conn_stats.popitem(last=False)
+        else:
+            self._peer_conn_stats.move_to_end(user)
+
+        return stats
+
+    def start_peer_connection(self, addr, init):
+        """ Race a direct connection against an indirect one. Based on previous attempts,
+        the direct connection is skipped, or the indirect request is delayed. """
+
+        if init.indirect:
+            # Responding to an indirect connection request, connect directly
+            self.init_peer_conn(InitPeerConn(addr, init))
+            return
+
+        stats = self._peer_conn_stats.get(init.target_user)
+
+        if stats is not None and not stats.should_connect_directly():
+            log.add_conn("Direct connections to user %(user)s usually fail, only requesting indirect connection", {
+                'user': init.target_user
+            })
+            self.connect_to_peer_indirect(init)
+            return
+
+        indirect_delay = stats.get_indirect_delay() if stats is not None else 0
+
+        if indirect_delay == 0:
             # Also request indirect connection in case the user's port is closed
             self.connect_to_peer_indirect(init)
 
-        self.add_init_message(init)
-        self._queue.append(InitPeerConn(addr, init))
+        elif indirect_delay is not None:
+            self._delayed_indirect_conn_requests[init] = scheduler.add(
+                delay=indirect_delay, callback=self.send_delayed_indirect_request, args=(init,))
+
+        else:
+            # Only request an indirect connection if the direct connection fails
+            self._delayed_indirect_conn_requests[init] = None
+
+        self.init_peer_conn(InitPeerConn(addr, init))
 
         log.add_conn("Attempting direct connection of type %(type)s to user %(user)s %(addr)s", {
-            'type': conn_type,
-            'user': user,
+            'type': init.conn_type,
+            'user': init.target_user,
             'addr': addr
         })
 
@@ -752,9 +1821,11 @@ class SlskProtoThread(threading.Thread):
                 "user": conn_obj.init.target_user,
                 "error": error
             })
+            self.get_peer_conn_stats(conn_obj.init.target_user).add_direct_result(success=False)
+            self.send_delayed_indirect_request(conn_obj.init)
             return
 
-        if conn_obj.init in self._out_indirect_conn_request_times:
+        if conn_obj.init in self._out_indirect_conn_request_timers:
             return
 
         log.add_conn(
@@ -773,7 +1844,8 @@ class SlskProtoThread(threading.Thread):
         init.token = self._token
 
         self._token_init_msgs[self._token] = init
-        self._out_indirect_conn_request_times[init] = time.time()
+        self._out_indirect_conn_request_timers[init] = scheduler.add(
+            delay=self.INDIRECT_REQUEST_TIMEOUT, callback=self._check_indirect_connection_timeout, args=(init,))
         self._queue.append(ConnectToPeer(self._token, username, conn_type))
 
         log.add_conn(("Attempting indirect connection to user %(user)s with token %(token)s"), {
@@ -818,16 +1890,25 @@ class SlskProtoThread(threading.Thread):
 
             # Direct and indirect connections are attempted at the same time, clean up
             self._token_init_msgs.pop(token, None)
+            scheduler.cancel(self._delayed_indirect_conn_requests.pop(init, None))
 
-            if self._out_indirect_conn_request_times.pop(init, None):
+            timer = self._out_indirect_conn_request_timers.pop(init, None)
+
+            if timer is not None:
+                scheduler.cancel(timer)
                 log.add_conn(("Stopping indirect connection attempt of type %(type)s to user "
                               "%(user)s"), {
                     'type': conn_type,
                     'user': user
                 })
 
+        self.add_pooled_peer_connection(conn_obj)
         self.process_conn_messages(init)
 
+        if init.indirect and conn_type == ConnectionType.DISTRIBUTED:
+            # A peer asked us to connect to them, to become our child
+            self.add_distrib_child(conn_obj)
+
     def establish_outgoing_server_connection(self, conn_obj):
 
         self._conns[self.server_socket] = conn_obj
@@ -841,7 +1922,7 @@ class SlskProtoThread(threading.Thread):
         )
 
         login, password = conn_obj.login
-        self.user_addresses[login] = (self.bindip or '127.0.0.1', self.listenport)
+        self.user_addresses.add(login, (self.bindip or '127.0.0.1', self.listenport), ttl=None)
         conn_obj.login = True
 
         self.server_address = addr
@@ -919,7 +2000,14 @@ class SlskProtoThread(threading.Thread):
             # Already removed
             return
 
-        self.selector.unregister(sock)
+        if conn_obj.events:
+            self.selector.unregister(sock)
+
+        scheduler.cancel(conn_obj.timeout_timer)
+        conn_obj.timeout_timer = None
+
+        self._throttled_conns.pop(sock, None)
+        self._read_paused_conns.discard(sock)
         self.close_socket(sock, shutdown=(connection_list != self._connsinprogress))
         self._numsockets -= 1
 
@@ -930,6 +2018,9 @@ class SlskProtoThread(threading.Thread):
         elif sock is self.parent_socket and not self.server_disconnected:
             self.send_have_no_parent()
 
+        elif sock in self._distrib_children:
+            self.remove_distrib_child(sock)
+
         elif self._is_download(conn_obj):
             self.total_downloads -= 1
 
@@ -970,6 +2061,10 @@ class SlskProtoThread(threading.Thread):
         })
 
         init_key = user + conn_type
+
+        if self._peer_conn_pool.get(init_key) is conn_obj:
+            del self._peer_conn_pool[init_key]
+
         init = self._username_init_msgs.get(init_key)
 
         if init is None:
@@ -993,22 +2088,54 @@ class SlskProtoThread(threading.Thread):
 
         del self._username_init_msgs[init_key]
 
-    def close_connection_if_inactive(self, conn_obj, sock, current_time, num_sockets):
+    def close_inactive_connections(self):
+        """ Connection limit reached, close the least recently used P connections to
+        make room for new connections """
 
-        if sock is self.server_socket:
-            return False
+        self.close_pooled_peer_connections(self._numsockets - MAXSOCKETS + max(MAXSOCKETS // 10, 1))
 
-        if num_sockets >= MAXSOCKETS and not self.connection_still_active(conn_obj):
-            # Connection limit reached, close connection if inactive
-            self.close_connection(self._conns, sock)
-            return True
+    def set_connection_timeout(self, conn_obj, timeout):
+
+        scheduler.cancel(conn_obj.timeout_timer)
+        conn_obj.timeout_timer = scheduler.add(delay=timeout, callback=self._check_connection_timeout, args=(conn_obj,))
+
+    def _check_connection_timeout(self, conn_obj):
+        """ Close connections that failed to connect in time, or haven't sent or received
+        any data for a while. Activity doesn't reschedule the timer, it's checked here. """
+
+        sock = conn_obj.sock
+        conn_obj.timeout_timer = None
+
+        if self._connsinprogress.get(sock) is conn_obj:
+            # Connection failed
+            self.connect_error("Timed out", conn_obj)
+            self.close_connection(self._connsinprogress, sock, callback=False)
+            self.process_connect_queue()
+            return
+
+        if self._conns.get(sock) is not conn_obj or sock is self.server_socket:
+            return
 
-        if (current_time - conn_obj.lastactive) > self.CONNECTION_MAX_IDLE:
+        init = conn_obj.init
+
+        if init is not None and init.conn_type == ConnectionType.PEER:
+            max_idle_time = self._peer_conn_idle_time
+        else:
+            max_idle_time = self.CONNECTION_MAX_IDLE
+
+        if sock in self._read_paused_conns:
+            # Data is waiting for us, but we don't read it until the backlog clears
+            idle_time = 0
+        else:
+            idle_time = time.time() - conn_obj.lastactive
+
+        if idle_time > max_idle_time:
             # No recent activity, peer connection is stale
             self.close_connection(self._conns, sock)
-            return True
+            return
 
-        return False
+        # Add a second to ensure the connection has been idle for long enough next time
+        self.set_connection_timeout(conn_obj, max_idle_time - idle_time + 1)
 
     def close_connection_by_ip(self, ip_address):
 
@@ -1091,11 +2218,29 @@ class SlskProtoThread(threading.Thread):
             self._connsinprogress[server_socket] = conn_obj
             self._numsockets += 1
 
+            self.set_connection_timeout(conn_obj, self.IN_PROGRESS_STALE_AFTER)
+
         except OSError as error:
             self.connect_error(error, conn_obj)
             self.close_socket(server_socket, shutdown=False)
             self.server_disconnect()
 
+    @staticmethod
+    def consume_input_buffer(conn_obj, msg_buffer, msg_buffer_mem, idx):
+        """ Remove processed data from the start of the input buffer. Deleting from the
+        start of a bytearray only advances its start offset, and the memory is compacted
+        lazily, so unprocessed data isn't copied every time messages are parsed. """
+
+        # Resizing the buffer is not allowed while memoryviews of it exist
+        msg_buffer_mem.release()
+
+        try:
+            del msg_buffer[:idx]
+
+        except BufferError:
+            # A parsed message still references the buffer, fall back to a copy
+            conn_obj.ibuf = msg_buffer[idx:]
+
     def process_server_input(self, conn_obj, msg_buffer):
         """ Server has sent us something, this function retrieves messages
         from the msg_buffer, creates message objects and returns them and the rest
@@ -1104,6 +2249,7 @@ class SlskProtoThread(threading.Thread):
         msg_buffer_mem = memoryview(msg_buffer)
         buffer_len = len(msg_buffer_mem)
         idx = 0
+        server_input_hooks = self._server_input_hooks
 
         # Server messages are 8 bytes or greater in length
         while buffer_len >= 8:
@@ -1122,140 +2268,165 @@ class SlskProtoThread(threading.Thread):
 
                 if msg is not None:
                     if msg_class is EmbeddedMessage:
+                        # We're a branch root, pass the embedded message on to our children
+                        self.forward_distrib_message(
+                            DistribEmbeddedMessage(distrib_code=msg.distrib_code, distrib_message=msg.distrib_message))
                         msg = self.unpack_embedded_message(msg)
 
-                    elif msg_class is Login:
-                        if msg.success:
-                            # Check for indirect connection timeouts
-                            self.exit.clear()
+                    elif msg_class in server_input_hooks:
+                        server_input_hooks[msg_class](msg)
 
-                            thread = threading.Thread(target=self._check_indirect_connection_timeouts)
-                            thread.name = "IndirectConnectionTimeoutTimer"
-                            thread.daemon = True
-                            thread.start()
+                    if msg is not None:
+                        self._callback_msgs.append(msg)
 
-                            msg.username = self.server_username
-                            self._queue.append(CheckPrivileges())
+            else:
+                log.add_debug("Server message type %(type)i size %(size)i contents %(msg_buffer)s unknown", {
+                    'type': msgtype,
+                    'size': msgsize - 4,
+                    'msg_buffer': msg_buffer[idx + 8:idx + msgsize_total]
+                })
 
-                            # Ask for a list of parents to connect to (distributed network)
-                            self.send_have_no_parent()
+            idx += msgsize_total
+            buffer_len -= msgsize_total
 
-                            # TODO: We can currently receive search requests from a parent connection, but
-                            # redirecting results to children is not implemented yet. Tell the server we don't accept
-                            # children for now.
-                            self._queue.append(AcceptChildren(False))
+        if idx:
+            self.consume_input_buffer(conn_obj, msg_buffer, msg_buffer_mem, idx)
 
-                            # Request a complete room list. A limited room list not including blacklisted rooms and
-                            # rooms with few users is automatically sent when logging in, but subsequent room list
-                            # requests contain all rooms.
-                            self._queue.append(RoomList())
+    """ Server Message Hooks """
 
-                        else:
-                            self._queue.append(ServerDisconnect())
+    def _on_login(self, msg):
 
-                    elif msg_class is ConnectToPeer:
-                        user = msg.user
-                        addr = (msg.ip_address, msg.port)
-                        conn_type = msg.conn_type
-                        token = msg.token
-
-                        log.add_conn(("Received indirect connection request of type %(type)s from user %(user)s, "
-                                      "token %(token)s, address %(addr)s"), {
-                            "type": conn_type,
-                            "user": user,
-                            "token": token,
-                            "addr": addr
-                        })
+        if not msg.success:
+            self._queue.append(ServerDisconnect())
+            return
 
-                        init = PeerInit(addr=addr, init_user=user, target_user=user,
-                                        conn_type=conn_type, indirect=True, token=token)
-                        self.connect_to_peer(user, addr, init)
+        msg.username = self.server_username
+        self._queue.append(CheckPrivileges())
 
-                    elif msg_class is GetUserStatus:
-                        if msg.status == UserStatus.OFFLINE:
-                            # User went offline, reset stored IP address
-                            if msg.user in self.user_addresses:
-                                del self.user_addresses[msg.user]
+        # Ask for a list of parents to connect to (distributed network)
+        self.send_have_no_parent()
 
-                    elif msg_class is GetUserStats:
-                        if msg.user == self.server_username:
-                            self.max_distrib_children = msg.avgspeed // self.distrib_parent_speed_ratio
+        # Tell the server if we accept children, based on our upload speed
+        self._update_max_distrib_children()
 
-                    elif msg_class is GetPeerAddress:
-                        user = msg.user
-                        pending_init_msgs = self._pending_init_msgs.pop(msg.user, [])
+        # Request a complete room list. A limited room list not including blacklisted rooms and
+        # rooms with few users is automatically sent when logging in, but subsequent room list
+        # requests contain all rooms.
+        self._queue.append(RoomList())
 
-                        if msg.port == 0:
-                            log.add_conn(
-                                "Server reported port 0 for user %(user)s", {
-                                    'user': user
-                                }
-                            )
+    def _on_connect_to_peer(self, msg):
 
-                        addr = (msg.ip_address, msg.port)
-                        user_offline = (addr == ("0.0.0.0", 0))
+        user = msg.user
+        addr = (msg.ip_address, msg.port)
+        conn_type = msg.conn_type
+        token = msg.token
 
-                        for init in pending_init_msgs:
-                            # We now have the IP address for a user we previously didn't know,
-                            # attempt a direct connection to the peer/user
-                            if user_offline:
-                                self._callback_msgs.append(ShowConnectionErrorMessage(user, init.outgoing_msgs[:]))
-                            else:
-                                init.addr = addr
-                                self.connect_to_peer(user, addr, init)
+        log.add_conn(("Received indirect connection request of type %(type)s from user %(user)s, "
+                      "token %(token)s, address %(addr)s"), {
+            "type": conn_type,
+            "user": user,
+            "token": token,
+            "addr": addr
+        })
 
-                        # We already store a local IP address for our username
-                        # Port 0 means the user is offline or bugged, don't store address
-                        if user != self.server_username and msg.port != 0:
-                            self.user_addresses[msg.user] = addr
+        if msg.port != 0:
+            self.user_addresses.add(user, addr)
 
-                    elif msg_class is Relogged:
-                        self.manual_server_disconnect = True
-                        self._server_relogged = True
+        init = PeerInit(addr=addr, init_user=user, target_user=user,
+                        conn_type=conn_type, indirect=True, token=token)
+        self.connect_to_peer(user, addr, init)
 
-                    elif msg_class is PossibleParents:
-                        # Server sent a list of 10 potential parents, whose purpose is to forward us search requests.
-                        # We attempt to connect to them all at once, since connection errors are fairly common.
+    def _on_get_user_status(self, msg):
 
-                        self.potential_parents = msg.list
-                        log.add_conn("Server sent us a list of %s possible parents", len(msg.list))
+        if msg.status == UserStatus.OFFLINE:
+            # User went offline, reset stored IP address
+            self.user_addresses.set_offline(msg.user)
 
-                        if self.parent_socket is None and self.potential_parents:
-                            for user in self.potential_parents:
-                                addr = self.potential_parents[user]
+        elif self.user_addresses.is_offline(msg.user):
+            self.user_addresses.remove(msg.user)
 
-                                log.add_conn("Attempting parent connection to user %s", user)
-                                self.initiate_connection_to_peer(user, ConnectionType.DISTRIBUTED, address=addr)
+    def _on_add_user(self, msg):
 
-                    elif msg_class is ParentMinSpeed:
-                        self.distrib_parent_min_speed = msg.speed
+        if msg.user == self.server_username and msg.avgspeed is not None:
+            self._upload_speed = msg.avgspeed
+            self._update_max_distrib_children()
 
-                    elif msg_class is ParentSpeedRatio:
-                        self.distrib_parent_speed_ratio = msg.ratio
+    def _on_get_user_stats(self, msg):
 
-                    elif msg_class is ResetDistributed:
-                        log.add_conn("Received a reset request for distributed network")
+        if msg.user == self.server_username:
+            self._upload_speed = msg.avgspeed
+            self._update_max_distrib_children()
 
-                        if self.parent_socket is not None:
-                            self.close_connection(self._conns, self.parent_socket)
+    def _on_get_peer_address(self, msg):
 
-                        self.send_have_no_parent()
+        user = msg.user
+        pending_init_msgs = self._pending_init_msgs.pop(msg.user, [])
 
-                    if msg is not None:
-                        self._callback_msgs.append(msg)
+        if msg.port == 0:
+            log.add_conn(
+                "Server reported port 0 for user %(user)s", {
+                    'user': user
+                }
+            )
 
+        addr = (msg.ip_address, msg.port)
+        user_offline = (addr == ("0.0.0.0", 0))
+
+        for init in pending_init_msgs:
+            # We now have the IP address for a user we previously didn't know,
+            # attempt a direct connection to the peer/user
+            if user_offline:
+                self._callback_msgs.append(ShowConnectionErrorMessage(user, init.outgoing_msgs[:]))
             else:
-                log.add_debug("Server message type %(type)i size %(size)i contents %(msg_buffer)s unknown", {
-                    'type': msgtype,
-                    'size': msgsize - 4,
-                    'msg_buffer': msg_buffer[idx + 8:idx + msgsize_total]
-                })
+                init.addr = addr
+                self.connect_to_peer(user, addr, init)
 
-            idx += msgsize_total
-            buffer_len -= msgsize_total
+        # We already store a local IP address for our username
+        # Port 0 means the user is offline or bugged, don't store address
+        if user != self.server_username:
+            if user_offline:
+                self.user_addresses.set_offline(user)
 
-        if idx:
-            conn_obj.ibuf = msg_buffer[idx:]
+            elif msg.port != 0:
+                self.user_addresses.add(user, addr)
+
+    def _on_relogged(self, _msg):
+        self.manual_server_disconnect = True
+        self._server_relogged = True
+
+    def _on_possible_parents(self, msg):
+        # Server sent a list of 10 potential parents, whose purpose is to forward us search requests.
+        # We attempt to connect to them all at once, since connection errors are fairly common.
+
+        self.potential_parents = msg.list
+        log.add_conn("Server sent us a list of %s possible parents", len(msg.list))
+
+        if self.parent_socket is None and self.potential_parents:
+            for user in self.potential_parents:
+                addr = self.potential_parents[user]
+
+                log.add_conn("Attempting parent connection to user %s", user)
+                self.initiate_connection_to_peer(user, ConnectionType.DISTRIBUTED, address=addr)
+
+    def _on_parent_min_speed(self, msg):
+        self.distrib_parent_min_speed = msg.speed
+        self._update_max_distrib_children()
+
+    def _on_parent_speed_ratio(self, msg):
+        self.distrib_parent_speed_ratio = msg.ratio
+        self._update_max_distrib_children()
+
+    def _on_reset_distributed(self, _msg):
+
+        log.add_conn("Received a reset request for distributed network")
+
+        if self.parent_socket is not None:
+            self.close_connection(self._conns, self.parent_socket)
+
+        for sock in list(self._distrib_children):
+            self.close_connection(self._conns, sock)
+
+        self.send_have_no_parent()
 
     def process_server_output(self, msg_obj):
 
@@ -1264,7 +2435,7 @@ class SlskProtoThread(threading.Thread):
         if self.server_socket not in self._conns:
             log.add_conn("Cannot send the message over the closed connection: %(type)s %(msg_obj)s", {
                 'type': msg_class,
-                'msg_obj': vars(msg_obj)
+                'msg_obj': log.contents(msg_obj)
             })
             return
 
@@ -1326,9 +2497,18 @@ class SlskProtoThread(threading.Thread):
                             return
 
                         self.add_init_message(init)
+                        self.add_pooled_peer_connection(conn_obj)
 
                         init.sock = conn_obj.sock
-                        self._out_indirect_conn_request_times.pop(init, None)
+                        timer = self._out_indirect_conn_request_timers.pop(init, None)
+
+                        if timer is not None:
+                            scheduler.cancel(timer)
+
+                            # The timer was added when the indirect connection was requested
+                            request_time = timer.when - self.INDIRECT_REQUEST_TIMEOUT
+                            self.get_peer_conn_stats(init.target_user).add_indirect_result(
+                                success=True, latency=time.monotonic() - request_time)
 
                         log.add_conn("Indirect connection to user %(user)s with token %(token)s established", {
                             "user": init.target_user,
@@ -1360,8 +2540,12 @@ class SlskProtoThread(threading.Thread):
                         conn_obj.init.addr = addr
 
                         self.add_init_message(msg)
+                        self.add_pooled_peer_connection(conn_obj)
                         self.process_conn_messages(msg)
 
+                        if conn_type == ConnectionType.DISTRIBUTED:
+                            self.add_distrib_child(conn_obj)
+
                     self._callback_msgs.append(msg)
 
             else:
@@ -1379,7 +2563,7 @@ class SlskProtoThread(threading.Thread):
             buffer_len -= msgsize_total
 
         if idx:
-            conn_obj.ibuf = msg_buffer[idx:]
+            self.consume_input_buffer(conn_obj, msg_buffer, msg_buffer_mem, idx)
 
     def process_peer_init_output(self, msg_obj):
 
@@ -1388,7 +2572,7 @@ class SlskProtoThread(threading.Thread):
         if msg_obj.sock not in self._conns:
             log.add_conn("Cannot send the message over the closed connection: %(type)s %(msg_obj)s", {
                 'type': msg_class,
-                'msg_obj': vars(msg_obj)
+                'msg_obj': log.contents(msg_obj)
             })
             return
 
@@ -1442,6 +2626,8 @@ class SlskProtoThread(threading.Thread):
             self._connsinprogress[sock] = conn_obj
             self._numsockets += 1
 
+            self.set_connection_timeout(conn_obj, self.IN_PROGRESS_STALE_AFTER)
+
         except OSError as error:
             self.connect_error(error, conn_obj)
             self.close_socket(sock, shutdown=False)
@@ -1455,7 +2641,10 @@ class SlskProtoThread(threading.Thread):
         msg_buffer_mem = memoryview(msg_buffer)
         buffer_len = len(msg_buffer_mem)
         idx = 0
-        search_result_received = False
+
+        if conn_obj.shares_parser is not None:
+            idx = self.process_shared_file_list_input(conn_obj, msg_buffer_mem, idx, buffer_len)
+            buffer_len -= idx
 
         # Peer messages are 8 bytes or greater in length
         while buffer_len >= 8:
@@ -1473,6 +2662,13 @@ class SlskProtoThread(threading.Thread):
             except KeyError:
                 pass
 
+            if msgtype == SHARED_FILE_LIST_CODE and msgsize_total > buffer_len and msgsize >= 4:
+                # Large list of shared files, decompress and parse it while data arrives
+                conn_obj.shares_parser = SharedFileListParser(conn_obj.init, msgsize - 4)
+                idx += 8
+                idx += self.process_shared_file_list_input(conn_obj, msg_buffer_mem, idx, buffer_len - 8)
+                break
+
             if msgsize_total > buffer_len or msgsize < 0:
                 # Invalid message size or buffer is being filled
                 break
@@ -1483,8 +2679,10 @@ class SlskProtoThread(threading.Thread):
                 msg = self.unpack_network_message(
                     msg_class, msg_buffer_mem[idx + 8:idx + msgsize_total], msgsize - 4, "peer", conn_obj.init)
 
-                if msg_class is FileSearchResult:
-                    search_result_received = True
+                if msg_class is FileSearchResult and msg is not None and msg.token not in SEARCH_TOKENS_ALLOWED:
+                    # Search was removed, the result list was never parsed. Drop the message here
+                    # instead of passing it on to NicotineCore.
+                    msg = None
 
                 if msg is not None:
                     self._callback_msgs.append(msg)
@@ -1505,13 +2703,48 @@ class SlskProtoThread(threading.Thread):
             buffer_len -= msgsize_total
 
         if idx:
-            conn_obj.ibuf = msg_buffer[idx:]
+            self.consume_input_buffer(conn_obj, msg_buffer, msg_buffer_mem, idx)
+            self.use_pooled_peer_connection(conn_obj)
 
-        if search_result_received and not self.connection_still_active(conn_obj):
-            # Forcibly close peer connection. Only used after receiving a search result,
-            # as we need to get rid of peer connections before they pile up.
+    def process_shared_file_list_input(self, conn_obj, msg_buffer_mem, idx, buffer_len):
+        """ Pass the available part of a SharedFileList message to the parser of the connection.
+        Returns the number of bytes consumed from the input buffer. """
 
-            self.close_connection(self._conns, conn_obj.sock)
+        parser = conn_obj.shares_parser
+        data_len = min(parser.remaining, buffer_len)
+
+        with msg_buffer_mem[idx:idx + data_len] as data:
+            if parser.failed:
+                parser.remaining -= data_len
+
+            else:
+                try:
+                    public_dirs, private_dirs = parser.feed(data)
+
+                    if public_dirs or private_dirs:
+                        self._callback_msgs.append(SharedFileListChunk(conn_obj.init, public_dirs, private_dirs))
+
+                    if not parser.remaining:
+                        self._callback_msgs.append(parser.finish())
+
+                except Exception as error:
+                    parser.failed = True
+                    log.add_debug(("Unable to parse peer message type %(msg_type)s size %(size)i "
+                                   "from user %(user)s: %(error)s"), {
+                        'msg_type': SharedFileList,
+                        'size': parser.total,
+                        'user': conn_obj.init.target_user,
+                        'error': error
+                    })
+
+        if parser.remaining:
+            self._callback_msgs.append(
+                MessageProgress(conn_obj.init.target_user, SharedFileList, parser.total - parser.remaining + 8,
+                                parser.total + 8))
+        else:
+            conn_obj.shares_parser = None
+
+        return data_len
 
     def process_peer_output(self, msg_obj):
 
@@ -1520,7 +2753,7 @@ class SlskProtoThread(threading.Thread):
         if msg_obj.init.sock not in self._conns:
             log.add_conn("Cannot send the message over the closed connection: %(type)s %(msg_obj)s", {
                 'type': msg_class,
-                'msg_obj': vars(msg_obj)
+                'msg_obj': log.contents(msg_obj)
             })
             return
 
@@ -1535,6 +2768,7 @@ class SlskProtoThread(threading.Thread):
         conn_obj.obuf.extend(msg_obj.pack_uint32(PEER_MESSAGE_CODES[msg_class]))
         conn_obj.obuf.extend(msg)
 
+        self.use_pooled_peer_connection(conn_obj)
         self.modify_connection_events(conn_obj, selectors.EVENT_READ | selectors.EVENT_WRITE)
 
     """ File Connection """
@@ -1562,34 +2796,7 @@ class SlskProtoThread(threading.Thread):
 
         elif conn_obj.filedown is not None:
             idx = conn_obj.filedown.leftbytes
-            added_bytes = msg_buffer_mem[:idx]
-
-            if added_bytes:
-                try:
-                    conn_obj.filedown.file.write(added_bytes)
-
-                except (OSError, ValueError) as error:
-                    self._callback_msgs.append(
-                        DownloadFileError(conn_obj.filedown.token, conn_obj.filedown.file, error)
-                    )
-                    self.close_connection(self._conns, conn_obj.sock)
-
-                added_bytes_len = len(added_bytes)
-                self.total_download_bandwidth += added_bytes_len
-                conn_obj.filedown.leftbytes -= added_bytes_len
-
-            current_time = time.time()
-            finished = (conn_obj.filedown.leftbytes == 0)
-
-            if finished or (current_time - conn_obj.lastcallback) > 1:
-                # We save resources by not sending data back to the NicotineCore
-                # every time a part of a file is downloaded
-
-                self._callback_msgs.append(copy.copy(conn_obj.filedown))
-                conn_obj.lastcallback = current_time
-
-            if finished:
-                self.close_connection(self._conns, conn_obj.sock)
+            self.write_download_data(conn_obj, msg_buffer_mem[:idx])
 
         elif conn_obj.fileupl is not None and conn_obj.fileupl.offset is None:
             msgsize = idx = 8
@@ -1607,16 +2814,47 @@ class SlskProtoThread(threading.Thread):
                 conn_obj.fileupl.offset = msg.offset
 
         if idx:
-            conn_obj.ibuf = msg_buffer[idx:]
+            self.consume_input_buffer(conn_obj, msg_buffer, msg_buffer_mem, idx)
 
-    def process_file_output(self, msg_obj):
+    def write_download_data(self, conn_obj, added_bytes):
+        """ Write received file data to the file we're downloading, and report the
+        download progress to NicotineCore """
 
-        msg_class = msg_obj.__class__
+        if added_bytes:
+            try:
+                conn_obj.filedown.file.write(added_bytes)
 
-        if msg_obj.init.sock not in self._conns:
-            log.add_conn("Cannot send the message over the closed connection: %(type)s %(msg_obj)s", {
+            except (OSError, ValueError) as error:
+                self._callback_msgs.append(
+                    DownloadFileError(conn_obj.filedown.token, conn_obj.filedown.file, error)
+                )
+                self.close_connection(self._conns, conn_obj.sock)
+
+            added_bytes_len = len(added_bytes)
+            self.total_download_bandwidth += added_bytes_len
+            conn_obj.filedown.leftbytes -= added_bytes_len
+
+        current_time = time.time()
+        finished = (conn_obj.filedown.leftbytes == 0)
+
+        if finished or (current_time - conn_obj.lastcallback) > 1:
+            # We save resources by not sending data back to the NicotineCore
+            # every time a part of a file is downloaded
+
+            self._callback_msgs.append(copy.copy(conn_obj.filedown))
+            conn_obj.lastcallback = current_time
+
+        if finished:
+            self.close_connection(self._conns, conn_obj.sock)
+
+    def process_file_output(self, msg_obj):
+
+        msg_class = msg_obj.__class__
+
+        if msg_obj.init.sock not in self._conns:
+            log.add_conn("Cannot send the message over the closed connection: %(type)s %(msg_obj)s", {
                 'type': msg_class,
-                'msg_obj': vars(msg_obj)
+                'msg_obj': log.contents(msg_obj)
             })
             return
 
@@ -1652,7 +2890,8 @@ class SlskProtoThread(threading.Thread):
     def verify_parent_connection(self, conn_obj):
         """ Verify that a connection is our current parent connection """
 
-        if self.parent_socket is not None and conn_obj.sock != self.parent_socket:
+        if (self.parent_socket is not None and conn_obj.sock != self.parent_socket
+                or conn_obj.sock in self._distrib_children):
             log.add_conn("Received a distributed message from user %s, who is not our parent. Closing connection.",
                          conn_obj.init.target_user)
             conn_obj.ibuf = bytearray()
@@ -1671,6 +2910,124 @@ class SlskProtoThread(threading.Thread):
         self._queue.append(HaveNoParent(True))
         self._queue.append(BranchRoot(self.server_username))
         self._queue.append(BranchLevel(0))
+        self.set_branch(level=0, root=self.server_username)
+
+    def set_branch(self, level=None, root=None):
+        """ Our position in the distributed network changed, tell our children """
+
+        if level is not None:
+            self._branch_level = level
+
+        if root is not None:
+            self._branch_root = root
+
+        for conn_obj in self._distrib_children.values():
+            self.send_branch_to_distrib_child(conn_obj)
+
+    def send_branch_to_distrib_child(self, conn_obj):
+
+        self._queue.append(DistribBranchLevel(conn_obj.init, self._branch_level))
+
+        if self._branch_root is not None:
+            self._queue.append(DistribBranchRoot(conn_obj.init, self._branch_root))
+
+    def _update_max_distrib_children(self):
+        """ The server tells us the minimum upload speed required to have children, and a
+        speed ratio that determines how many children we can have. Both are compared with
+        our average upload speed in KiB/s. If we have too many children, the ones that
+        connected last are disconnected. """
+
+        upload_speed = self._upload_speed // 1024
+
+        if upload_speed < self.distrib_parent_min_speed or self.distrib_parent_speed_ratio <= 0:
+            self.max_distrib_children = 0
+        else:
+            self.max_distrib_children = min(
+                upload_speed // self.distrib_parent_speed_ratio, self.MAX_DISTRIB_CHILDREN)
+
+        while len(self._distrib_children) > self.max_distrib_children:
+            sock = next(reversed(self._distrib_children))
+
+            log.add_conn("Too many distributed children, disconnecting user %s",
+                         self._distrib_children[sock].init.target_user)
+            self.close_connection(self._conns, sock)
+
+        self._update_accept_children()
+
+    def _update_accept_children(self):
+        """ Tell the server if we accept more children """
+
+        accept_children = (len(self._distrib_children) < self.max_distrib_children)
+
+        if accept_children == self._accept_children or self.server_disconnected:
+            return
+
+        self._accept_children = accept_children
+        self._queue.append(AcceptChildren(accept_children))
+
+    def add_distrib_child(self, conn_obj):
+        """ A peer connected to us to become our child in the distributed network. Tell them
+        about our position in the network, and forward search requests to them. """
+
+        user = conn_obj.init.target_user
+
+        if len(self._distrib_children) >= self.max_distrib_children:
+            log.add_conn("Cannot accept user %(user)s as distributed child, limit of %(limit)s children reached", {
+                "user": user,
+                "limit": self.max_distrib_children
+            })
+            conn_obj.ibuf = bytearray()
+            self.close_connection(self._conns, conn_obj.sock)
+            return
+
+        log.add_conn("Adopting user %s as distributed child", user)
+
+        self._distrib_children[conn_obj.sock] = conn_obj
+        self.send_branch_to_distrib_child(conn_obj)
+        self._update_accept_children()
+
+    def remove_distrib_child(self, sock):
+
+        conn_obj = self._distrib_children.pop(sock)
+        log.add_conn("Removed distributed child %s", conn_obj.init.target_user)
+
+        self._update_accept_children()
+
+    def forward_to_distrib_children(self, data):
+        """ Queue a packed distributed message for all our children. The same bytes are
+        queued by reference for every child. Children with more than
+        MAX_DISTRIB_CHILD_OUTPUT_SIZE bytes of unsent data are stalled, and disconnected
+        instead, to let another peer take their place. """
+
+        stalled_children = []
+
+        for conn_obj in self._distrib_children.values():
+            if len(conn_obj.obuf) > self.MAX_DISTRIB_CHILD_OUTPUT_SIZE:
+                stalled_children.append(conn_obj)
+                continue
+
+            conn_obj.obuf.append_shared(data)
+            self.modify_connection_events(conn_obj, conn_obj.events | selectors.EVENT_WRITE)
+
+        for conn_obj in stalled_children:
+            log.add_conn("Distributed child %(user)s is not reading search requests, disconnecting", {
+                "user": conn_obj.init.target_user
+            })
+            self.close_connection(self._conns, conn_obj.sock)
+
+    def forward_distrib_message(self, msg_obj):
+        """ Pack a distributed message once, and queue it for all our children """
+
+        if not self._distrib_children:
+            return
+
+        msg = self.pack_network_message(msg_obj)
+
+        if msg is None:
+            return
+
+        self.forward_to_distrib_children(
+            b"".join((UINT_PACK(len(msg) + 1), bytes((DISTRIBUTED_MESSAGE_CODES[msg_obj.__class__],)), msg)))
 
     def process_distrib_input(self, conn_obj, msg_buffer):
         """ We have a distributed network connection, parent has sent us
@@ -1700,13 +3057,24 @@ class SlskProtoThread(threading.Thread):
                     msg_class, msg_buffer_mem[idx + 5:idx + msgsize_total], msgsize - 1, "distrib", conn_obj.init)
 
                 if msg is not None:
-                    if msg_class is DistribSearch and not self.verify_parent_connection(conn_obj):
-                        return
+                    if msg_class is DistribSearch:
+                        if not self.verify_parent_connection(conn_obj):
+                            return
 
-                    if msg_class is DistribEmbeddedMessage:
+                        if self._distrib_children:
+                            # Forward the search request as we received it
+                            self.forward_to_distrib_children(bytes(msg_buffer_mem[idx:idx + msgsize_total]))
+
+                    elif msg_class is DistribEmbeddedMessage:
                         if not self.verify_parent_connection(conn_obj):
                             return
 
+                        if self._distrib_children and msg.distrib_code in DISTRIBUTED_MESSAGE_CLASSES:
+                            # Our parent is a branch root, forward the unpacked message
+                            self.forward_to_distrib_children(b"".join((
+                                UINT_PACK(len(msg.distrib_message) + 1), bytes((msg.distrib_code,)),
+                                msg.distrib_message)))
+
                         msg = self.unpack_embedded_message(msg)
 
                     elif msg_class is DistribBranchLevel:
@@ -1719,13 +3087,15 @@ class SlskProtoThread(threading.Thread):
                             self.close_connection(self._conns, conn_obj.sock)
                             return
 
-                        if self.parent_socket is None and msg.init.target_user in self.potential_parents:
+                        if (self.parent_socket is None and msg.init.target_user in self.potential_parents
+                                and conn_obj.sock not in self._distrib_children):
                             # We have a successful connection with a potential parent. Tell the server who
                             # our parent is, and stop requesting new potential parents.
                             self.parent_socket = conn_obj.sock
 
                             self._queue.append(HaveNoParent(False))
                             self._queue.append(BranchLevel(msg.value + 1))
+                            self.set_branch(level=msg.value + 1)
 
                             log.add_conn("Adopting user %s as parent", msg.init.target_user)
                             log.add_conn("Our branch level is %s", msg.value + 1)
@@ -1739,6 +3109,7 @@ class SlskProtoThread(threading.Thread):
                         else:
                             # Inform the server of our new branch level
                             self._queue.append(BranchLevel(msg.value + 1))
+                            self.set_branch(level=msg.value + 1)
                             log.add_conn("Received a branch level update from our parent. Our new branch level is %s",
                                          msg.value + 1)
 
@@ -1748,6 +3119,7 @@ class SlskProtoThread(threading.Thread):
 
                         # Inform the server of our branch root
                         self._queue.append(BranchRoot(msg.user))
+                        self.set_branch(root=msg.user)
                         log.add_conn("Our branch root is user %s", msg.user)
 
                     if msg is not None:
@@ -1768,7 +3140,7 @@ class SlskProtoThread(threading.Thread):
             buffer_len -= msgsize_total
 
         if idx:
-            conn_obj.ibuf = msg_buffer[idx:]
+            self.consume_input_buffer(conn_obj, msg_buffer, msg_buffer_mem, idx)
 
     def process_distrib_output(self, msg_obj):
 
@@ -1777,7 +3149,7 @@ class SlskProtoThread(threading.Thread):
         if msg_obj.init.sock not in self._conns:
             log.add_conn("Cannot send the message over the closed connection: %(type)s %(msg_obj)s", {
                 'type': msg_class,
-                'msg_obj': vars(msg_obj)
+                'msg_obj': log.contents(msg_obj)
             })
             return
 
@@ -1798,54 +3170,82 @@ class SlskProtoThread(threading.Thread):
 
     def process_internal_messages(self, msg_obj):
 
-        msg_class = msg_obj.__class__
+        handler = self._internal_message_handlers.get(msg_obj.__class__)
 
-        if msg_class is InitPeerConn:
-            if self._numsockets < MAXSOCKETS:
-                self.init_peer_conn(msg_obj)
-            else:
-                # Connection limit reached, re-queue
-                self._queue.append(msg_obj)
+        if handler is not None:
+            handler(msg_obj)
 
-        elif msg_class is ConnClose and msg_obj.sock in self._conns:
-            sock = msg_obj.sock
-            self.close_connection(self._conns, sock)
+    def _on_init_peer_conn(self, msg_obj):
 
-        elif msg_class is ConnCloseIP:
-            self.close_connection_by_ip(msg_obj.addr)
+        if self._numsockets < MAXSOCKETS:
+            self.init_peer_conn(msg_obj)
+        else:
+            # Connection limit reached, re-queue without waking up the networking loop.
+            # We retry the next time the loop wakes up.
+            deque.append(self._queue, msg_obj)
 
-        elif msg_class is ServerConnect:
-            self.server_connect(msg_obj)
+    def _on_conn_close(self, msg_obj):
 
-        elif msg_class is ServerDisconnect:
-            self.manual_server_disconnect = True
-            self.server_disconnect()
+        if msg_obj.sock in self._conns:
+            self.close_connection(self._conns, msg_obj.sock)
 
-        elif msg_class is DownloadFile and msg_obj.init.sock in self._conns:
-            self._conns[msg_obj.init.sock].filedown = msg_obj
+    def _on_conn_close_ip(self, msg_obj):
+        self.close_connection_by_ip(msg_obj.addr)
 
-        elif msg_class is UploadFile and msg_obj.init.sock in self._conns:
-            self._conns[msg_obj.init.sock].fileupl = msg_obj
+    def _on_server_disconnect(self, _msg_obj):
+        self.manual_server_disconnect = True
+        self.server_disconnect()
 
-        elif msg_class is SetDownloadLimit:
-            self._download_limit = msg_obj.limit * 1024
-            self._calc_download_limit()
+    def _on_download_file(self, msg_obj):
 
-        elif msg_class is SetUploadLimit:
-            if msg_obj.uselimit:
-                if msg_obj.limitby:
-                    self._calc_upload_limit_function = self._calc_upload_limit
-                else:
-                    self._calc_upload_limit_function = self._calc_upload_limit_by_transfer
+        conn_obj = self._conns.get(msg_obj.init.sock)
+
+        if conn_obj is None:
+            return
+
+        conn_obj.filedown = msg_obj
+
+        if conn_obj.ibuf:
+            # File data arrived before the download was ready, write it now
+            self.process_conn_incoming_messages(conn_obj)
+
+    def _on_upload_file(self, msg_obj):
+
+        conn_obj = self._conns.get(msg_obj.init.sock)
 
+        if conn_obj is None:
+            return
+
+        conn_obj.fileupl = msg_obj
+        self._calc_upload_limit_function()
+
+        if conn_obj.ibuf:
+            # File offset arrived before the upload was ready, process it now
+            self.process_conn_incoming_messages(conn_obj)
+
+    def _on_set_download_limit(self, msg_obj):
+        self._download_limit = msg_obj.limit * 1024
+        self._calc_download_limit()
+
+    def _on_set_upload_limit(self, msg_obj):
+
+        if msg_obj.uselimit:
+            if msg_obj.limitby:
+                self._calc_upload_limit_function = self._calc_upload_limit
             else:
-                self._calc_upload_limit_function = self._calc_upload_limit_none
+                self._calc_upload_limit_function = self._calc_upload_limit_by_transfer
 
-            self._upload_limit = msg_obj.limit * 1024
-            self._calc_upload_limit_function()
+        else:
+            self._calc_upload_limit_function = self._calc_upload_limit_none
 
-        elif msg_class is SendNetworkMessage:
-            self.send_message_to_peer(msg_obj.user, msg_obj.message, msg_obj.addr)
+        if msg_obj.priority_weights:
+            self._upload_priority_weights.update(msg_obj.priority_weights)
+
+        self._upload_limit = msg_obj.limit * 1024
+        self._calc_upload_limit_function()
+
+    def _on_send_network_message(self, msg_obj):
+        self.send_message_to_peer(msg_obj.user, msg_obj.message, msg_obj.addr)
 
     """ Input/Output """
 
@@ -1859,7 +3259,13 @@ class SlskProtoThread(threading.Thread):
 
         if init is None:
             self.process_peer_init_input(conn_obj, conn_obj.ibuf)
-            return
+            init = conn_obj.init
+
+            if init is None or not conn_obj.ibuf:
+                return
+
+            # The peer sent more messages right after the init message. Process them now, since
+            # the networking loop only wakes up again once more data arrives.
 
         if init.conn_type == ConnectionType.PEER:
             self.process_peer_input(conn_obj, conn_obj.ibuf)
@@ -1877,89 +3283,149 @@ class SlskProtoThread(threading.Thread):
         while self._queue:
             msgs.append(self._queue.popleft())
 
+        handlers = self._queue_message_handlers
+
         for msg_obj in msgs:
             if self.server_disconnected:
                 # Disconnected from server, stop processing queue
                 return
 
-            msg_type = msg_obj.msgtype
+            msg_class = msg_obj.__class__
+            handler = handlers.get(msg_class)
 
-            if msg_type == MessageType.INIT:
-                self.process_peer_init_output(msg_obj)
+            if handler is None:
+                handler = handlers[msg_class] = self.get_queue_message_handler(msg_class)
 
-            elif msg_type == MessageType.INTERNAL:
-                self.process_internal_messages(msg_obj)
+            handler(msg_obj)
 
-            elif msg_type == MessageType.PEER:
-                self.process_peer_output(msg_obj)
+    def get_queue_message_handler(self, msg_class):
+        """ Internal messages have their own handlers, other messages are sent over the
+        connection matching their type """
 
-            elif msg_type == MessageType.DISTRIBUTED:
-                self.process_distrib_output(msg_obj)
+        msg_type = msg_class.msgtype
 
-            elif msg_type == MessageType.FILE:
-                self.process_file_output(msg_obj)
+        if msg_type == MessageType.INTERNAL:
+            return self._internal_message_handlers.get(msg_class, self.ignore_message)
 
-            elif msg_type == MessageType.SERVER:
-                self.process_server_output(msg_obj)
+        return self._output_handlers[msg_type]
 
-    def read_data(self, conn_obj):
+    @staticmethod
+    def ignore_message(_msg_obj):
+        pass
 
-        sock = conn_obj.sock
+    @staticmethod
+    def get_conn_type_name(conn_obj):
+        """ Returns the name of the connection type, used as metric label """
 
-        # Check for a download limit
-        if sock in self._dlimits:
-            limit = self._dlimits[sock]
-        else:
-            limit = None
+        if conn_obj.__class__ is ServerConnection:
+            return "server"
+
+        if conn_obj.init is None:
+            return "peer init"
+
+        return MESSAGE_TYPE_NAMES.get(conn_obj.init.conn_type, "peer init")
 
+    def read_data(self, conn_obj, limit=None):
+
+        sock = conn_obj.sock
         conn_obj.lastactive = time.time()
-        data = sock.recv(conn_obj.lastreadlength)
-        conn_obj.ibuf.extend(data)
 
         if limit is None:
             # Unlimited download data
+            data = sock.recv(conn_obj.lastreadlength)
+
             if len(data) >= conn_obj.lastreadlength // 2:
                 conn_obj.lastreadlength = conn_obj.lastreadlength * 2
 
         else:
-            # Speed Limited Download data (transfers)
-            conn_obj.lastreadlength = limit
+            # Speed limited download data (transfers)
+            data = sock.recv(min(conn_obj.lastreadlength, limit))
+            conn_obj.bucket.consume(len(data))
+
+        conn_obj.ibuf.extend(data)
 
         if not data:
             return False
 
+        if metrics.enabled:
+            RECEIVED_BYTES.inc(len(data), (self.get_conn_type_name(conn_obj),))
+
         return True
 
-    def write_data(self, conn_obj):
+    def read_file_data(self, conn_obj, limit=None):
+        """ Download fast path. File data is received into a reusable buffer with
+        recv_into(), and written to the file from there, bypassing the input buffer.
+        Returns False if the connection was closed remotely. """
 
         sock = conn_obj.sock
+        readbuf = conn_obj.readbuf
 
-        if sock in self._ulimits:
-            limit = self._ulimits[sock]
-        else:
-            limit = None
+        if readbuf is None:
+            readbuf = conn_obj.readbuf = memoryview(bytearray(self.FILE_READ_BUFFER_SIZE))
+
+        # Never read past the end of the file, and respect the download limit
+        nbytes = min(conn_obj.filedown.leftbytes, len(readbuf))
+
+        if limit is not None:
+            nbytes = min(nbytes, limit)
+
+        if nbytes <= 0:
+            # Nothing left to download
+            self.write_download_data(conn_obj, readbuf[:0])
+            return True
+
+        conn_obj.lastactive = time.time()
+        received = sock.recv_into(readbuf, nbytes)
+
+        if not received:
+            return False
+
+        if limit is not None:
+            conn_obj.bucket.consume(received)
 
+        if metrics.enabled:
+            RECEIVED_BYTES.inc(received, ("file",))
+
+        self.write_download_data(conn_obj, readbuf[:received])
+        return True
+
+    def write_data(self, conn_obj, limit=None):
+
+        sock = conn_obj.sock
         prev_active = conn_obj.lastactive
         conn_obj.lastactive = time.time()
 
+        is_file_upload = (self._is_upload(conn_obj) and conn_obj.fileupl is not None
+                          and conn_obj.fileupl.offset is not None)
+        sendfile_pending = False
+
         if conn_obj.obuf:
-            if limit is None:
-                bytes_send = sock.send(conn_obj.obuf)
-            else:
-                bytes_send = sock.send(conn_obj.obuf[:limit])
+            bytes_send = conn_obj.obuf.send(sock, limit)
+
+        elif is_file_upload and conn_obj.use_sendfile:
+            bytes_send = self.send_file_data(conn_obj, limit)
 
-            conn_obj.obuf = conn_obj.obuf[bytes_send:]
         else:
             bytes_send = 0
 
-        if self._is_upload(conn_obj) and conn_obj.fileupl is not None and conn_obj.fileupl.offset is not None:
+        if limit is not None:
+            conn_obj.bucket.consume(bytes_send)
+
+        if metrics.enabled and bytes_send:
+            SENT_BYTES.inc(bytes_send, (self.get_conn_type_name(conn_obj),))
+
+        if is_file_upload:
             conn_obj.fileupl.sentbytes += bytes_send
             totalsentbytes = conn_obj.fileupl.offset + conn_obj.fileupl.sentbytes + len(conn_obj.obuf)
 
             try:
                 size = conn_obj.fileupl.size
 
-                if totalsentbytes < size:
+                if totalsentbytes < size and conn_obj.use_sendfile:
+                    # File data is sent without reading it into the output buffer
+                    sendfile_pending = True
+
+                elif totalsentbytes < size:
                     bytestoread = int(max(4096, bytes_send * 1.2) / max(1, conn_obj.lastactive - prev_active)
                                       - len(conn_obj.obuf))
 
@@ -1985,16 +3451,344 @@ class SlskProtoThread(threading.Thread):
                     self._callback_msgs.append(copy.copy(conn_obj.fileupl))
                     conn_obj.lastcallback = current_time
 
-        if not conn_obj.obuf:
+        if not conn_obj.obuf and not sendfile_pending:
             # Nothing else to send, stop watching connection for writes
             self.modify_connection_events(conn_obj, selectors.EVENT_READ)
 
+    def send_file_data(self, conn_obj, limit):
+        """ Send upload data straight from the file to the socket using sendfile(),
+        without copying it to the output buffer first. If sendfile() doesn't work for
+        this file or socket, switch to reading file data into the output buffer. """
+
+        fileupl = conn_obj.fileupl
+        offset = fileupl.offset + fileupl.sentbytes
+        count = fileupl.size - offset
+
+        if limit is not None:
+            count = min(count, limit)
+
+        if count <= 0:
+            return 0
+
+        try:
+            return os.sendfile(conn_obj.sock.fileno(), fileupl.file.fileno(), offset, count)
+
+        except OSError as error:
+            if error.errno not in SENDFILE_UNSUPPORTED_ERRORS and not isinstance(error, io.UnsupportedOperation):
+                raise
+
+            log.add_conn("Cannot use sendfile() for upload to %(addr)s, falling back to regular reads. "
+                         "Error: %(error)s", {
+                             "addr": conn_obj.addr,
+                             "error": error
+                         })
+
+        conn_obj.use_sendfile = False
+
+        # sendfile() doesn't update the file position, continue where it left off
+        fileupl.file.seek(offset)
+        return 0
+
+    """ Loop Profiling """
+
+    @staticmethod
+    def _get_profiled_function(function, phase, get_msg_class_name=None):
+
+        perf_counter = time.perf_counter
+        labels = (phase, "")
+
+        def profiled_function(*args, **kwargs):
+
+            start_time = perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+
+            finally:
+                if get_msg_class_name is not None:
+                    LOOP_PHASE_TIME.observe(perf_counter() - start_time, (phase, get_msg_class_name(args[0])))
+                else:
+                    LOOP_PHASE_TIME.observe(perf_counter() - start_time, labels)
+
+        return profiled_function
+
+    def enable_loop_profiling(self):
+
+        if self.loop_profiling:
+            return
+
+        LOOP_PHASE_TIME.clear()
+
+        for phase, method_name in self.PROFILED_PHASES:
+            setattr(self, method_name, self._get_profiled_function(getattr(self, method_name), phase))
+
+        self.unpack_network_message = self._get_profiled_function(
+            self.unpack_network_message, "parse", lambda msg_class: msg_class.__name__)
+        self.pack_network_message = self._get_profiled_function(
+            self.pack_network_message, "pack", lambda msg_obj: msg_obj.__class__.__name__)
+        scheduler.run_due_timers = self._get_profiled_function(scheduler.run_due_timers, "timers")
+
+        if hasattr(self.selector, "select"):
+            # Not used when running in an asyncio event loop
+            self.selector.select = self._get_profiled_function(self.selector.select, "select")
+
+        self.loop_profiling = True
+        self._loop_profiling_start_time = time.monotonic()
+        log.add("Networking loop profiling enabled")
+
+    def disable_loop_profiling(self):
+
+        if not self.loop_profiling:
+            return
+
+        for _phase, method_name in self.PROFILED_PHASES:
+            delattr(self, method_name)
+
+        del self.unpack_network_message
+        del self.pack_network_message
+        del scheduler.run_due_timers
+
+        if "select" in vars(self.selector):
+            del self.selector.select
+
+        self.loop_profiling = False
+        self.log_loop_profile()
+
+    def log_loop_profile(self):
+        """ Log the number of calls, total time and percentiles of each phase, slowest
+        phases first """
+
+        duration = time.monotonic() - self._loop_profiling_start_time
+        stats = sorted(LOOP_PHASE_TIME.get_stats().items(), key=lambda item: item[1][1], reverse=True)
+        lines = [
+            "Networking loop profile over %.1f seconds:" % duration,
+            "%-9s %-28s %10s %12s %10s %10s %10s" % (
+                "phase", "message", "calls", "total ms", "p50 µs", "p90 µs", "p99 µs")
+        ]
+
+        for (phase, msg_class_name), (count, total, (median, p90, p99)) in stats:
+            lines.append("%-9s %-28s %10i %12.2f %10.1f %10.1f %10.1f" % (
+                phase, msg_class_name, count, total * 1000, median * 1e6, p90 * 1e6, p99 * 1e6))
+
+        log.add("\n".join(lines))
+
+    def _on_set_loop_profiling(self, msg_obj):
+
+        if msg_obj.enabled:
+            self.enable_loop_profiling()
+        else:
+            self.disable_loop_profiling()
+
     """ Networking Loop """
 
-    def run(self):
+    def send_conn_stats(self):
+        """ Send updated connection count to NicotineCore. Runs once per second, to avoid
+        sending too many updates at once if there are a lot of connections. """
 
-        # Select Networking Input and Output sockets
-        self.selector = selectors.DefaultSelector()
+        if self.server_disconnected:
+            return
+
+        if self._numsockets >= MAXSOCKETS:
+            self.close_inactive_connections()
+
+        self.process_connect_queue()
+
+        self._callback_msgs.append(
+            SetConnectionStats(self._numsockets, self.total_downloads, self.total_download_bandwidth,
+                               self.total_uploads, self.total_upload_bandwidth,
+                               self._max_core_backlog, self._max_queue_depth, len(self._read_paused_conns)))
+
+        if metrics.enabled:
+            self.update_socket_metrics()
+
+        self.total_download_bandwidth = 0
+        self.total_upload_bandwidth = 0
+        self._max_core_backlog = 0
+        self._max_queue_depth = 0
+
+        if self._upload_bucket.rate:
+            self._allocate_upload_bandwidth()
+
+    def update_socket_metrics(self):
+
+        SOCKETS.set(len(self._conns), ("connected",))
+        SOCKETS.set(len(self._connsinprogress), ("connecting",))
+        SOCKETS.set(len(self._peer_conn_pool), ("pooled",))
+        SOCKETS.set(len(self._read_paused_conns), ("read_paused",))
+        SOCKETS.set(len(self._throttled_conns), ("throttled",))
+        SOCKETS.set(len(self._distrib_children), ("distrib_child",))
+
+        CORE_BACKLOG.set(self._max_core_backlog)
+        QUEUE_DEPTH.set(self._max_queue_depth)
+        CONNECT_QUEUE_DEPTH.set(sum(len(connect_queue) for connect_queue in self._connect_queues))
+
+    def accept_incoming_connection(self):
+
+        try:
+            incsock, incaddr = self.listen_socket.accept()
+
+        except OSError:
+            return
+
+        events = selectors.EVENT_READ
+        incsock.setblocking(False)
+
+        conn_obj = self._conns[incsock] = PeerConnection(sock=incsock, addr=incaddr, events=events)
+        self._numsockets += 1
+        log.add_conn("Incoming connection from %s", str(incaddr))
+
+        self.set_connection_timeout(conn_obj, self.CONNECTION_MAX_IDLE)
+
+        # Event flags are modified to include 'write' in subsequent loops, if necessary.
+        # Don't do it here, otherwise connections may break.
+        self.selector.register(incsock, events)
+
+    def process_conn_in_progress(self, sock, conn_obj, readable, writable):
+
+        try:
+            if readable:
+                # Check if the socket has any data for us
+                try:
+                    sock.recv(1, socket.MSG_PEEK)
+
+                except BlockingIOError:
+                    # Readiness was already consumed
+                    pass
+
+            if writable:
+                # Connection has been established
+
+                current_time = time.time()
+                connect_time = current_time - conn_obj.lastactive
+                conn_obj.lastactive = current_time
+
+                if sock is self.server_socket:
+                    self.establish_outgoing_server_connection(conn_obj)
+                else:
+                    self.establish_outgoing_peer_connection(conn_obj)
+
+                    if not conn_obj.init.indirect:
+                        self.get_peer_conn_stats(conn_obj.init.target_user).add_direct_result(
+                            success=True, latency=connect_time)
+
+                del self._connsinprogress[sock]
+
+        except OSError as error:
+            self.connect_error(error, conn_obj)
+            self.close_connection(self._connsinprogress, sock, callback=False)
+
+    def process_conn(self, sock, conn_obj, readable, writable):
+
+        limit = None
+
+        if readable and self.peer_reads_paused and self._is_deferrable(conn_obj):
+            self.pause_peer_reads(conn_obj)
+            readable = False
+
+        if readable and self._is_download(conn_obj):
+            limit = self.get_transfer_limit(conn_obj, self._download_bucket, self._download_transfer_rate)
+
+            if limit == 0:
+                self.throttle_connection(conn_obj, selectors.EVENT_READ)
+                readable = False
+
+        if readable:
+            try:
+                if conn_obj.__class__ is PeerConnection and conn_obj.filedown is not None and not conn_obj.ibuf:
+                    # Downloading file data, receive it directly into the file
+                    received = self.read_file_data(conn_obj, limit)
+                else:
+                    received = self.read_data(conn_obj, limit)
+
+                if not received:
+                    # No data received, socket was likely closed remotely
+                    self.close_connection(self._conns, sock)
+                    return
+
+            except BlockingIOError:
+                # Readiness was already consumed, try again later
+                pass
+
+            except OSError as error:
+                log.add_conn(("Cannot read data from connection %(addr)s, closing connection. "
+                              "Error: %(error)s"), {
+                    "addr": conn_obj.addr,
+                    "error": error
+                })
+                self.close_connection(self._conns, sock)
+                return
+
+        if conn_obj.ibuf:
+            self.process_conn_incoming_messages(conn_obj)
+
+        limit = None
+
+        if writable and self._is_upload(conn_obj) and sock in self._conns:
+            limit = self.get_transfer_limit(conn_obj, self._upload_bucket, self._upload_transfer_rate)
+
+            if limit == 0:
+                self.throttle_connection(conn_obj, selectors.EVENT_WRITE)
+                writable = False
+
+        if writable:
+            try:
+                self.write_data(conn_obj, limit)
+
+            except BlockingIOError:
+                # Socket buffer is full, try again later
+                pass
+
+            except Exception as err:
+                log.add_conn("Cannot write data to connection %(addr)s, closing connection. Error: %(error)s", {
+                    "addr": conn_obj.addr,
+                    "error": err
+                })
+                self.close_connection(self._conns, sock)
+
+    def process_ready_sockets(self, input_list, output_list):
+        """ Accept new connections, and send/receive data for the sockets in input_list
+        and output_list. Other connections are left alone, their timeouts are handled
+        by timers. """
+
+        if self._wakeup_socket in input_list:
+            self._clear_wakeup()
+
+        # Manage incoming connections to listen socket
+        if self._numsockets < MAXSOCKETS and not self.server_disconnected and self.listen_socket in input_list:
+            self.accept_incoming_connection()
+
+        for sock in input_list | output_list:
+            readable = sock in input_list
+            writable = sock in output_list
+
+            # Manage outgoing connections in progress
+            conn_obj = self._connsinprogress.get(sock)
+
+            if conn_obj is not None:
+                self.process_conn_in_progress(sock, conn_obj, readable, writable)
+
+            # Process read/write for active connections, including ones that were just established
+            conn_obj = self._conns.get(sock)
+
+            if conn_obj is not None:
+                self.process_conn(sock, conn_obj, readable, writable)
+
+        # Connection attempts may have finished, start queued ones
+        self.process_connect_queue()
+
+    def send_callback_msgs(self):
+        """ Inform the main thread """
+
+        if not self._callback_msgs:
+            return
+
+        for msg in self._callback_msgs:
+            log.add_msg_contents(msg)
+
+        self._core_callback(self._callback_msgs)
+        self._callback_msgs.clear()
+
+    def init_listen_socket(self):
 
         self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -2004,34 +3798,84 @@ class SlskProtoThread(threading.Thread):
         self._core_callback([SetConnectionStats()])
         self.bind_listen_port()
 
+    def close_listen_socket(self):
+        self.selector.unregister(self.listen_socket)
+        self.close_socket(self.listen_socket, shutdown=False)
+
+    def start_conn_stats_timer(self):
+        self._conn_stats_timer = scheduler.add(delay=1, callback=self.send_conn_stats, repeat_interval=1)
+
+    def close_all_sockets(self):
+
+        scheduler.cancel(self._conn_stats_timer)
+        self._conn_stats_timer = None
+
+        self.disable_loop_profiling()
+        self.user_addresses.save()
+
+        self.manual_server_disconnect = True
+        self.server_disconnect()
+
+        self._close_wakeup_sockets()
+        self.close_listen_socket()
+        self.selector.close()
+
+
+class SlskProtoThread(SlskProtoEngine, threading.Thread):
+    """ Runs the networking engine in a dedicated thread """
+
+    def __init__(self, *args, **kwargs):
+        threading.Thread.__init__(self, name="NetworkThread")
+        SlskProtoEngine.__init__(self, *args, **kwargs)
+
+    def run(self):
+
+        # Select Networking Input and Output sockets
+        self.selector = selectors.DefaultSelector()
+        self._init_wakeup_sockets()
+        self.init_listen_socket()
+        self.start_conn_stats_timer()
+
         while not self._want_abort:
 
             if self.server_disconnected:
                 # We're not connected to the server at the moment
+                scheduler.run_due_timers()
                 time.sleep(0.1)
                 continue
 
-            current_time = time.time()
-            num_sockets = self._numsockets
+            record_metrics = metrics.enabled
 
-            # Send updated connection count to NicotineCore. Avoid sending too many
-            # updates at once, if there are a lot of connections.
-            if (current_time - self._last_conn_stat_time) >= 1:
-                self._callback_msgs.append(
-                    SetConnectionStats(self._numsockets, self.total_downloads, self.total_download_bandwidth,
-                                       self.total_uploads, self.total_upload_bandwidth))
+            if record_metrics:
+                iteration_start_time = time.perf_counter()
 
-                self.total_download_bandwidth = 0
-                self.total_upload_bandwidth = 0
-                self._last_conn_stat_time = current_time
+            self.update_backpressure()
 
             # Process queue messages
             if self._queue:
                 self.process_queue_messages()
 
-            # Check which connections are ready to send/receive data
+            self.resume_throttled_connections()
+
+            # Check which connections are ready to send/receive data. Sleep until there is
+            # socket activity, a message is queued, throttled transfers can continue or a
+            # timer is due (connection stats are sent once per second).
             try:
-                key_events = self.selector.select(timeout=-1)
+                timeout = scheduler.get_timeout()
+
+                if self._throttle_resume_time is not None:
+                    throttle_timeout = max(0, self._throttle_resume_time - time.monotonic())
+                    timeout = throttle_timeout if timeout is None else min(timeout, throttle_timeout)
+
+                if record_metrics:
+                    select_start_time = time.perf_counter()
+
+                key_events = self.selector.select(timeout=timeout)
+
+                if record_metrics:
+                    select_time = time.perf_counter() - select_start_time
+                    SELECT_TIME.observe(select_time)
+
                 input_list = {key.fileobj for key, event in key_events if event & selectors.EVENT_READ}
                 output_list = {key.fileobj for key, event in key_events if event & selectors.EVENT_WRITE}
 
@@ -2051,117 +3895,281 @@ class SlskProtoThread(threading.Thread):
                 self._callback_msgs.clear()
                 continue
 
-            # Manage incoming connections to listen socket
-            if self._numsockets < MAXSOCKETS and not self.server_disconnected and self.listen_socket in input_list:
-                try:
-                    incsock, incaddr = self.listen_socket.accept()
-                except Exception:
-                    time.sleep(0.01)
-                else:
-                    events = selectors.EVENT_READ
-                    incsock.setblocking(False)
+            scheduler.run_due_timers()
 
-                    self._conns[incsock] = PeerConnection(sock=incsock, addr=incaddr, events=events)
-                    self._numsockets += 1
-                    log.add_conn("Incoming connection from %s", str(incaddr))
+            self.process_ready_sockets(input_list, output_list)
+            self.send_callback_msgs()
 
-                    # Event flags are modified to include 'write' in subsequent loops, if necessary.
-                    # Don't do it here, otherwise connections may break.
-                    self.selector.register(incsock, events)
+            if record_metrics:
+                LOOP_ITERATION_TIME.observe(time.perf_counter() - iteration_start_time - select_time)
 
-            # Manage outgoing connections in progress
-            for sock_in_progress, conn_obj in self._connsinprogress.copy().items():
-                if (current_time - conn_obj.lastactive) > self.IN_PROGRESS_STALE_AFTER:
-                    # Connection failed
+        # Networking thread aborted
+        self.close_all_sockets()
 
-                    self.connect_error("Timed out", conn_obj)
-                    self.close_connection(self._connsinprogress, sock_in_progress, callback=False)
-                    continue
 
-                try:
-                    if sock_in_progress in input_list:
-                        # Check if the socket has any data for us
-                        sock_in_progress.recv(1, socket.MSG_PEEK)
+class EventLoopSelector:
+    """ Minimal selectors-compatible wrapper around the reader/writer callbacks of an
+    asyncio event loop. Lets SlskProtoAsyncio reuse the socket handling code of
+    SlskProtoEngine. """
 
-                    if sock_in_progress in output_list:
-                        # Connection has been established
+    def __init__(self, event_loop, callback):
 
-                        conn_obj.lastactive = time.time()
+        self._event_loop = event_loop
+        self._callback = callback
+        self._events = {}
 
-                        if sock_in_progress is self.server_socket:
-                            self.establish_outgoing_server_connection(conn_obj)
-                        else:
-                            self.establish_outgoing_peer_connection(conn_obj)
+    def register(self, sock, events):
 
-                        del self._connsinprogress[sock_in_progress]
+        if sock in self._events:
+            raise KeyError("%s is already registered" % sock)
 
-                except OSError as error:
-                    self.connect_error(error, conn_obj)
-                    self.close_connection(self._connsinprogress, sock_in_progress, callback=False)
+        self._events[sock] = 0
+        self.modify(sock, events)
 
-            # Process read/write for active connections
-            for sock, conn_obj in self._conns.copy().items():
-                if self.close_connection_if_inactive(conn_obj, sock, current_time, num_sockets):
-                    continue
+    def modify(self, sock, events):
 
-                if sock in input_list:
-                    if self._is_download(conn_obj):
-                        self.set_conn_speed_limit(sock, self._download_limit_split, self._dlimits)
-
-                    try:
-                        if not self.read_data(conn_obj):
-                            # No data received, socket was likely closed remotely
-                            self.close_connection(self._conns, sock)
-                            continue
-
-                    except OSError as error:
-                        log.add_conn(("Cannot read data from connection %(addr)s, closing connection. "
-                                      "Error: %(error)s"), {
-                            "addr": conn_obj.addr,
-                            "error": error
-                        })
-                        self.close_connection(self._conns, sock)
-                        continue
+        old_events = self._events[sock]
 
-                if conn_obj.ibuf:
-                    self.process_conn_incoming_messages(conn_obj)
+        if events & selectors.EVENT_READ and not old_events & selectors.EVENT_READ:
+            self._event_loop.add_reader(sock, self._callback, sock, selectors.EVENT_READ)
 
-                if sock in output_list:
-                    if self._is_upload(conn_obj):
-                        self.set_conn_speed_limit(sock, self._upload_limit_split, self._ulimits)
+        elif old_events & selectors.EVENT_READ and not events & selectors.EVENT_READ:
+            self._event_loop.remove_reader(sock)
 
-                    try:
-                        self.write_data(conn_obj)
+        if events & selectors.EVENT_WRITE and not old_events & selectors.EVENT_WRITE:
+            self._event_loop.add_writer(sock, self._callback, sock, selectors.EVENT_WRITE)
 
-                    except Exception as err:
-                        log.add_conn("Cannot write data to connection %(addr)s, closing connection. Error: %(error)s", {
-                            "addr": conn_obj.addr,
-                            "error": err
-                        })
-                        self.close_connection(self._conns, sock)
-                        continue
+        elif old_events & selectors.EVENT_WRITE and not events & selectors.EVENT_WRITE:
+            self._event_loop.remove_writer(sock)
 
-            # Inform the main thread
-            if self._callback_msgs:
-                for msg in self._callback_msgs:
-                    log.add_msg_contents(msg)
+        self._events[sock] = events
 
-                self._core_callback(self._callback_msgs)
-                self._callback_msgs.clear()
+    def unregister(self, sock):
 
-            # Reset transfer speed limits
-            self._ulimits = {}
-            self._dlimits = {}
+        self.modify(sock, 0)
+        del self._events[sock]
 
-            self._calc_loops_per_second()
+    def close(self):
 
-            # Don't exhaust the CPU
-            time.sleep(1 / 60)
+        for sock in self._events.copy():
+            self.unregister(sock)
 
-        # Networking thread aborted
-        self.selector.unregister(self.listen_socket)
+
+class SlskProtoAsyncio(SlskProtoEngine):
+    """ Networking engine running inside an asyncio event loop, instead of a dedicated
+    thread. It uses the same messages and core callback as SlskProtoThread, but socket
+    readiness is reported by the event loop, and messages queued by NicotineCore are
+    processed as soon as the event loop gets to it.
+
+    The event loop needs to support add_reader() and add_writer(), i.e. the default
+    event loop on Linux and macOS, or a SelectorEventLoop on Windows. The core callback
+    is called from the event loop thread. """
+
+    def __init__(self, core_callback, queue, bindip, interface, port, port_range, event_loop,
+                 max_peer_conns=200, peer_conn_idle_time=120, peer_address_file=None,
+                 core_backlog_function=None):
+
+        super().__init__(core_callback, queue, bindip, interface, port, port_range,
+                         max_peer_conns, peer_conn_idle_time, peer_address_file, core_backlog_function)
+
+        self._event_loop = event_loop
+        self._listen_socket_watched = False
+        self._ready_events = {}
+        self._processing_handle = None
+        self._resume_handle = None
+        self._scheduler_handle = None
+
+    def start(self):
+        """ Start the networking engine and bind the listen socket. Can be called from any
+        thread, and returns once the engine has started, so that the listen port can be
+        validated before connecting to the server. """
+
+        try:
+            on_event_loop_thread = (asyncio.get_running_loop() is self._event_loop)
+
+        except RuntimeError:
+            # No event loop running in this thread
+            on_event_loop_thread = False
+
+        if on_event_loop_thread or not self._event_loop.is_running():
+            self._start_engine()
+            return
+
+        asyncio.run_coroutine_threadsafe(self._start_engine_async(), self._event_loop).result()
+
+    async def _start_engine_async(self):
+        self._start_engine()
+
+    def wakeup(self):
+        """ Process queued messages. Can be called from any thread. """
+
+        if self._wakeup_pending:
+            return
+
+        self._wakeup_pending = True
+
+        try:
+            self._event_loop.call_soon_threadsafe(self._schedule_processing)
+
+        except RuntimeError:
+            # Event loop is closed
+            pass
+
+    def _init_wakeup_sockets(self):
+
+        if hasattr(self._queue, "set_wakeup_function"):
+            self._queue.set_wakeup_function(self.wakeup)
+
+        scheduler.set_wakeup_function(self.wakeup)
+
+    def _close_wakeup_sockets(self):
+
+        if hasattr(self._queue, "set_wakeup_function"):
+            self._queue.set_wakeup_function(None)
+
+        scheduler.set_wakeup_function(None)
+
+    def _start_engine(self):
+
+        self.selector = EventLoopSelector(self._event_loop, self._on_socket_event)
+        self._init_wakeup_sockets()
+        self.init_listen_socket()
+
+        # The listen socket is only watched while we're connected to the server
+        self._listen_socket_watched = True
+        self._watch_listen_socket(False)
+
+        self.start_conn_stats_timer()
+
+    def _stop_engine(self):
+
+        if self._processing_handle is not None:
+            self._processing_handle.cancel()
+            self._processing_handle = None
+
+        if self._resume_handle is not None:
+            self._resume_handle.cancel()
+            self._resume_handle = None
+
+        if self._scheduler_handle is not None:
+            self._scheduler_handle.cancel()
+            self._scheduler_handle = None
+
+        self.close_all_sockets()
+        self._ready_events.clear()
+
+    def _watch_listen_socket(self, watch):
+
+        if watch == self._listen_socket_watched:
+            return
+
+        if watch:
+            self.selector.register(self.listen_socket, selectors.EVENT_READ)
+        else:
+            self.selector.unregister(self.listen_socket)
+
+        self._listen_socket_watched = watch
+
+    def close_listen_socket(self):
+        self._watch_listen_socket(False)
         self.close_socket(self.listen_socket, shutdown=False)
 
-        self.manual_server_disconnect = True
-        self.server_disconnect()
-        self.selector.close()
+    def abort(self):
+        """ Call this to stop the networking engine. Can be called from any thread. """
+
+        if self._want_abort:
+            return
+
+        self._want_abort = True
+        self._event_loop.call_soon_threadsafe(self._stop_engine)
+
+    def server_connect(self, msg_obj):
+
+        super().server_connect(msg_obj)
+
+        if self.server_socket is not None:
+            self._watch_listen_socket(True)
+
+    def server_disconnect(self):
+        self._watch_listen_socket(False)
+        super().server_disconnect()
+
+    def _on_socket_event(self, sock, event):
+
+        self._ready_events[sock] = self._ready_events.get(sock, 0) | event
+        self._schedule_processing()
+
+    def _schedule_processing(self):
+
+        if self._processing_handle is not None or self._want_abort:
+            return
+
+        self._processing_handle = self._event_loop.call_soon(self._process_events)
+
+    def _schedule_resume(self):
+        """ Process events again once throttled transfers can continue """
+
+        if self._resume_handle is not None:
+            self._resume_handle.cancel()
+            self._resume_handle = None
+
+        if self._throttle_resume_time is None:
+            return
+
+        delay = max(0, self._throttle_resume_time - time.monotonic())
+        self._resume_handle = self._event_loop.call_later(delay, self._schedule_processing)
+
+    def _schedule_timers(self):
+        """ Process events again once the next timer is due """
+
+        if self._scheduler_handle is not None:
+            self._scheduler_handle.cancel()
+            self._scheduler_handle = None
+
+        delay = scheduler.get_timeout()
+
+        if delay is None or self._want_abort:
+            return
+
+        self._scheduler_handle = self._event_loop.call_later(delay, self._schedule_processing)
+
+    def _process_events(self):
+        """ Process all socket events reported since the last call, in a single batch """
+
+        self._processing_handle = None
+        self._wakeup_pending = False
+
+        ready_events = self._ready_events
+        self._ready_events = {}
+
+        if self._want_abort:
+            return
+
+        scheduler.run_due_timers()
+        self._schedule_timers()
+
+        if self.server_disconnected:
+            return
+
+        record_metrics = metrics.enabled
+
+        if record_metrics:
+            start_time = time.perf_counter()
+
+        self.update_backpressure()
+
+        # Process queue messages
+        if self._queue:
+            self.process_queue_messages()
+
+        self.resume_throttled_connections()
+
+        input_list = {sock for sock, event in ready_events.items() if event & selectors.EVENT_READ}
+        output_list = {sock for sock, event in ready_events.items() if event & selectors.EVENT_WRITE}
+
+        self.process_ready_sockets(input_list, output_list)
+        self.send_callback_msgs()
+        self._schedule_resume()
+
+        if record_metrics:
+            LOOP_ITERATION_TIME.observe(time.perf_counter() - start_time)
@@ -35,7 +35,6 @@ import os
 import os.path
 import re
 import stat
-import threading
 import time
 
 from collections import defaultdict
@@ -45,6 +44,7 @@ from operator import itemgetter
 
 from pynicotine import slskmessages
 from pynicotine.logfacility import log
+from pynicotine.scheduler import scheduler
 from pynicotine.slskmessages import increment_token
 from pynicotine.slskmessages import TransferDirection
 from pynicotine.slskmessages import UserStatus
@@ -119,7 +119,9 @@ class Transfers:
         self.uploads_file_name = os.path.join(self.config.data_dir, 'uploads.json')
 
         self.network_callback = network_callback
+        self.download_queue_timer = None
         self.download_queue_timer_count = -1
+        self.upload_queue_timer = None
         self.upload_queue_timer_count = -1
 
         self.update_download_filters()
@@ -140,23 +142,13 @@ class Transfers:
         self.update_limits()
         self.watch_stored_downloads()
 
-        # Check for transfer timeouts
-        thread = threading.Thread(target=self._check_transfer_timeouts)
-        thread.name = "TransferTimeoutTimer"
-        thread.daemon = True
-        thread.start()
-
         # Check for failed downloads (1 min delay)
-        thread = threading.Thread(target=self._check_download_queue_timer)
-        thread.name = "DownloadQueueTimer"
-        thread.daemon = True
-        thread.start()
+        self.download_queue_timer = scheduler.add(
+            delay=0, callback=self._check_download_queue_timer, repeat_interval=60)
 
         # Check if queued uploads can be started
-        thread = threading.Thread(target=self._check_upload_queue_timer)
-        thread.name = "UploadQueueTimer"
-        thread.daemon = True
-        thread.start()
+        self.upload_queue_timer = scheduler.add(
+            delay=0, callback=self._check_upload_queue_timer, repeat_interval=10)
 
     """ Load Transfers """
 
@@ -356,6 +348,17 @@ class Transfers:
 
         return self.is_buddy_prioritized(user)
 
+    def get_upload_priority(self, user):
+        """ Returns the class used to share upload bandwidth between users """
+
+        if user in self.privileged_users:
+            return slskmessages.UploadPriority.PRIVILEGED
+
+        if user in (x[0] for x in self.config.sections["server"]["userlist"]):
+            return slskmessages.UploadPriority.BUDDY
+
+        return slskmessages.UploadPriority.REGULAR
+
     def is_buddy_prioritized(self, user):
 
         if not user:
@@ -416,8 +419,9 @@ class Transfers:
         uselimit = self.config.sections["transfers"]["uselimit"]
         uploadlimit = self.config.sections["transfers"]["uploadlimit"]
         limitby = self.config.sections["transfers"]["limitby"]
+        weights = self.config.sections["transfers"]["uploadpriorityweights"]
 
-        self.queue.append(slskmessages.SetUploadLimit(uselimit, uploadlimit, limitby))
+        self.queue.append(slskmessages.SetUploadLimit(uselimit, uploadlimit, limitby, weights))
         self.queue.append(slskmessages.SetDownloadLimit(self.config.sections["transfers"]["downloadlimit"]))
 
     def _update_alt_limits(self):
@@ -426,8 +430,9 @@ class Transfers:
         uselimit = True
         uploadlimit = self.config.sections["transfers"]["uploadlimitalt"]
         limitby = self.config.sections["transfers"]["limitby"]
+        weights = self.config.sections["transfers"]["uploadpriorityweights"]
 
-        self.queue.append(slskmessages.SetUploadLimit(uselimit, uploadlimit, limitby))
+        self.queue.append(slskmessages.SetUploadLimit(uselimit, uploadlimit, limitby, weights))
         self.queue.append(slskmessages.SetDownloadLimit(self.config.sections["transfers"]["downloadlimitalt"]))
 
     def update_limits(self):
@@ -816,7 +821,7 @@ class Transfers:
 
             download.token = token
             download.status = "Getting status"
-            self.transfer_request_times[download] = time.time()
+            self.start_transfer_request_timer(download)
 
             self.update_download(download)
             return slskmessages.TransferResponse(allowed=True, token=token)
@@ -844,7 +849,7 @@ class Transfers:
 
         log.add_transfer("Denied file request: User %(user)s, %(msg)s", {
             'user': user,
-            'msg': str(vars(msg))
+            'msg': str(log.contents(msg))
         })
 
         return slskmessages.TransferResponse(allowed=False, reason=cancel_reason, token=token)
@@ -898,7 +903,7 @@ class Transfers:
         transfer = Transfer(user=user, filename=filename, path=os.path.dirname(real_path),
                             status="Getting status", token=token, size=size)
 
-        self.transfer_request_times[transfer] = time.time()
+        self.start_transfer_request_timer(transfer)
         self.append_upload(user, filename, transfer)
         self.update_upload(transfer)
 
@@ -966,7 +971,7 @@ class Transfers:
             self.check_upload_queue()
             return
 
-        log.add_transfer("Received unknown upload response: %s", str(vars(msg)))
+        log.add_transfer("Received unknown upload response: %s", str(log.contents(msg)))
 
     def transfer_timeout(self, msg):
 
@@ -1222,7 +1227,8 @@ class Transfers:
                 if upload.size > 0:
                     upload.status = "Transferring"
                     self.queue.append(slskmessages.UploadFile(
-                        init=msg.init, token=token, file=file_handle, size=upload.size
+                        init=msg.init, token=token, file=file_handle, size=upload.size,
+                        priority=self.get_upload_priority(username)
                     ))
 
                 else:
@@ -1646,7 +1652,7 @@ class Transfers:
             self.token = increment_token(self.token)
             transfer.token = self.token
             transfer.status = "Getting status"
-            self.transfer_request_times[transfer] = time.time()
+            self.start_transfer_request_timer(transfer)
 
             log.add_transfer(("Requesting to upload file %(filename)s with token %(token)s to user %(user)s"), {
                 "filename": filename,
@@ -2028,50 +2034,32 @@ class Transfers:
 
         self.update_user_counter(user)
 
-    def _check_transfer_timeouts(self):
+    def start_transfer_request_timer(self, transfer):
 
-        while True:
-            current_time = time.time()
+        # When our port is closed, certain clients can take up to ~30 seconds before they
+        # initiate a 'F' connection, since they only send an indirect connection request after
+        # attempting to connect to our port for a certain time period.
+        # Known clients: Nicotine+ 2.2.0 - 3.2.0, 2 s; Soulseek NS, ~20 s; soulseeX, ~30 s.
+        # To account for potential delays while initializing the connection, add 15 seconds
+        # to the timeout value.
 
-            if self.transfer_request_times:
-                for transfer, start_time in self.transfer_request_times.copy().items():
-                    # When our port is closed, certain clients can take up to ~30 seconds before they
-                    # initiate a 'F' connection, since they only send an indirect connection request after
-                    # attempting to connect to our port for a certain time period.
-                    # Known clients: Nicotine+ 2.2.0 - 3.2.0, 2 s; Soulseek NS, ~20 s; soulseeX, ~30 s.
-                    # To account for potential delays while initializing the connection, add 15 seconds
-                    # to the timeout value.
+        request_time = self.transfer_request_times[transfer] = time.time()
+        scheduler.add(delay=45, callback=self._check_transfer_timeout, args=(transfer, request_time))
 
-                    if (current_time - start_time) >= 45:
-                        self.network_callback([slskmessages.TransferTimeout(transfer)])
+    def _check_transfer_timeout(self, transfer, request_time):
 
-            if self.core.protothread.exit.wait(1):
-                # Event set, we're exiting
-                return
+        # The timer is not cancelled when the transfer request is answered. Only time out
+        # if the transfer is still waiting for the same request.
+        if self.transfer_request_times.get(transfer) == request_time:
+            self.network_callback([slskmessages.TransferTimeout(transfer)])
 
     def _check_upload_queue_timer(self):
-
-        self.upload_queue_timer_count = -1
-
-        while True:
-            self.upload_queue_timer_count += 1
-            self.network_callback([slskmessages.CheckUploadQueue()])
-
-            if self.core.protothread.exit.wait(10):
-                # Event set, we're exiting
-                return
+        self.upload_queue_timer_count += 1
+        self.network_callback([slskmessages.CheckUploadQueue()])
 
     def _check_download_queue_timer(self):
-
-        self.download_queue_timer_count = -1
-
-        while True:
-            self.download_queue_timer_count += 1
-            self.network_callback([slskmessages.CheckDownloadQueue()])
-
-            if self.core.protothread.exit.wait(60):
-                # Event set, we're exiting
-                return
+        self.download_queue_timer_count += 1
+        self.network_callback([slskmessages.CheckDownloadQueue()])
 
     def check_queue_upload_allowed(self, user, addr, filename, real_path, msg):
 
@@ -2503,6 +2491,12 @@ class Transfers:
         write_file_and_backup(transfers_file, callback)
 
     def server_disconnect(self):
+
+        scheduler.cancel(self.download_queue_timer)
+        scheduler.cancel(self.upload_queue_timer)
+        self.download_queue_timer = self.upload_queue_timer = None
+        self.download_queue_timer_count = self.upload_queue_timer_count = -1
+
         self.abort_transfers()
 
     def quit(self):